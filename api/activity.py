@@ -1,4 +1,4 @@
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, Request, Header, HTTPException, Depends
+from fastapi import APIRouter, FastAPI, WebSocket, Request, Header, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
 import asyncio
 from typing import Annotated
@@ -6,14 +6,16 @@ import time
 
 from core.config import DIGEST_BEARER
 from .base import APIModule
+from core.broadcast import broadcast_hub
 from core.logger import get_logger
 from core.main_processor import main_processor
+from core.shared_state import shared_state
 from .configurator import validate
 
 
-KEEP_ALIVE = 30
 PC_TIMEOUT_SECONDS = 20
-pc_last_seen = 0
+#shared_state key: any worker may take the ping, the leader's monitor reads it
+PC_LAST_SEEN_KEY = "activity.pc_last_seen"
 pc_was_online = False
 
 activity_data = {
@@ -25,23 +27,10 @@ activity_data = {
     "is_someone_at_room": False
 }
 
-connected_clients = set()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 logger = get_logger("Activity")
 
-async def notify_clients(data):
-    #logger.debug("Notifying WS clients")
-    global connected_clients
-    alive = set()
-    for ws in connected_clients:
-        try:
-            await ws.send_json(data)
-            alive.add(ws)
-        except Exception:
-            pass
-    connected_clients = alive
-
 async def verify_token(token: Annotated[str, Depends(oauth2_scheme)]):
    # logger.debug("Veryfing OAuth2 Token")
     if token != DIGEST_BEARER:
@@ -61,8 +50,9 @@ class ActivityModule(APIModule):
                     activity_data[key] = incoming[key]
                     updated = True
             if updated:
-                await notify_clients(activity_data)
-                await main_processor.handle_activity_update(activity_data)
+                broadcast_hub.publish("activity", activity_data)
+                if shared_state.is_leader:
+                    await main_processor.handle_activity_update(activity_data)
             return {"status": "ok"}
 
         @router.get("/activity")
@@ -73,43 +63,53 @@ class ActivityModule(APIModule):
         @router.post("/ping/pc")
         async def pc_ping(request: Request, token: Annotated[str, Depends(verify_token)]):
             validate(request)
-            global pc_last_seen
-            pc_last_seen = time.time()
+            shared_state.set(PC_LAST_SEEN_KEY, time.time())
             return {"status": "ok"}
 
     def register_websockets(self, app: FastAPI):
+        broadcast_hub.register_topic("activity", lambda: activity_data, delta=True, apply=activity_data.update)
+
         @app.websocket("/activity")
-        async def activity_ws(websocket: WebSocket):
+        async def activity_ws(websocket: WebSocket, delta: bool = False, max_rate: float | None = None):
             logger.debug("WS Connected")
-            await websocket.accept()
-            connected_clients.add(websocket)
-            try:
-                await websocket.send_json(activity_data)
-                while True:
-                    await asyncio.sleep(KEEP_ALIVE)
-            except WebSocketDisconnect:
-                connected_clients.remove(websocket)
+            await broadcast_hub.serve(websocket, "activity", delta, max_rate)
 
     def register_events(self, app: FastAPI):
+        async def process_remote_update(_data):
+            #updates posted to another worker reach Telegram and PiLED through the leader
+            if shared_state.is_leader:
+                await main_processor.handle_activity_update(activity_data)
+
+        shared_state.watch("activity", process_remote_update)
+
+        async def replay_activity(leader: bool):
+            #only once something was posted, so a fresh start doesn't push the defaults to Telegram and PiLED
+            if leader and shared_state.get("activity") is not None:
+                await main_processor.handle_activity_update(activity_data)
+
+        shared_state.on_leadership(replay_activity)
+
         @app.on_event("startup")
         async def startup_event():
             async def monitor_pc_status():
-                global pc_last_seen, pc_was_online
+                global pc_was_online
+                #a worker taking over as leader starts from the shared state
+                pc_was_online = activity_data["pc_status"]
                 while True:
                     await asyncio.sleep(5)
                     now = time.time()
-                    pc_online = (now - pc_last_seen) <= PC_TIMEOUT_SECONDS
+                    pc_online = (now - shared_state.get(PC_LAST_SEEN_KEY, 0)) <= PC_TIMEOUT_SECONDS
                     if pc_online and not pc_was_online:
                         logger.info("PC is back online")
                         activity_data["pc_status"] = True
                         await main_processor.handle_activity_update(activity_data)
-                        await notify_clients(activity_data)
+                        broadcast_hub.publish("activity", activity_data)
                     elif not pc_online and pc_was_online:
                         logger.info("PC is offline")
                         activity_data["pc_status"] = False
                         await main_processor.handle_activity_update(activity_data)
-                        await notify_clients(activity_data)
+                        broadcast_hub.publish("activity", activity_data)
                     pc_was_online = pc_online
 
             logger.info("Spawning PC monitor loop...")
-            asyncio.create_task(monitor_pc_status())
\ No newline at end of file
+            asyncio.create_task(shared_state.run_as_leader(monitor_pc_status))
\ No newline at end of file
@@ -1,5 +1,10 @@
 from abc import ABC, abstractmethod
-from fastapi import APIRouter, FastAPI, Request
+import datetime
+import math
+import pytz
+from fastapi import APIRouter, FastAPI, Request, HTTPException
+
+from core.config import WEATHER_TIMEZONE
 
 def get_real_ip(request: Request) -> str:
     x_forwarded_for = request.headers.get("x-forwarded-for")
@@ -7,6 +12,39 @@ def get_real_ip(request: Request) -> str:
         return x_forwarded_for.split(",")[0].strip()
     return request.client.host
 
+#a year clear of datetime's limits, so time zone shifts and bucket starts of accepted times stay representable
+TIME_PARAM_MIN = datetime.datetime(2, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+TIME_PARAM_MAX = datetime.datetime(9998, 12, 31, tzinfo=datetime.timezone.utc).timestamp()
+
+def parse_time_param(value: str | None, default: datetime.datetime) -> float:
+    """Unix seconds or ISO 8601 (naive values are WEATHER_TIMEZONE local time)."""
+    if value is None:
+        return default.timestamp()
+    try:
+        ts = float(value)
+    except ValueError:
+        try:
+            moment = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid time: {value}")
+        try:
+            if moment.tzinfo is None:
+                moment = pytz.timezone(WEATHER_TIMEZONE).localize(moment)
+            ts = moment.timestamp()
+        except (OverflowError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Time out of range: {value}")
+    if not math.isfinite(ts) or not TIME_PARAM_MIN <= ts <= TIME_PARAM_MAX:
+        raise HTTPException(status_code=400, detail=f"Time out of range: {value}")
+    return ts
+
+def parse_time_window(start: str | None, end: str | None) -> tuple[float, float]:
+    """'from'/'to' query values as unix seconds; default is the 24 h up to now."""
+    end_ts = parse_time_param(end, datetime.datetime.now(datetime.timezone.utc))
+    start_ts = parse_time_param(start, datetime.datetime.fromtimestamp(end_ts, datetime.timezone.utc) - datetime.timedelta(days=1))
+    if start_ts > end_ts:
+        raise HTTPException(status_code=400, detail="'from' is after 'to'")
+    return start_ts, end_ts
+
 class APIModule(ABC):
     @abstractmethod
     def register_routes(self, router: APIRouter) -> None:
@@ -1,11 +1,15 @@
 import json
+import time
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
 from pydantic import BaseModel
 
+from core import storage
 from core.quote_manager import (
+    quote_pool,
+    quote_store,
     load_quotes,
     save_quotes,
     append_quote,
@@ -19,17 +23,22 @@ from core.emoji_manager import (
     update_emoji,
     remove_emoji,
     parse_emoji_kind,
+    get_emoji_pool,
+    get_emoji_store,
 )
 from core.game_manager import (
+    game_catalog,
+    games_store,
     load_games,
     save_games,
     append_game,
     update_game,
     remove_game,
 )
-from core.config import IP_WHITELIST
+from core.config import IP_WHITELIST, STORAGE_BACKEND
 from core.data_paths import (
     DATA_DIR,
+    DATABASE_FILE,
     EMOJI_FILES,
     GAMES_FILE,
     QUOTES_FILE,
@@ -38,7 +47,8 @@ from core.data_paths import (
     USERBOT_SESSION_FILE,
     ensure_data_dir,
 )
-from core.telegram import TelegramAPI
+from core.shared_state import shared_state
+from core.telegram import TelegramAPI, TELEGRAM_SESSION_KEY
 from .base import APIModule, get_real_ip
 from core.logger import get_logger
 
@@ -83,6 +93,19 @@ class GameEditPayload(BaseModel):
     game: GameItem
 
 
+class BatchOperation(BaseModel):
+    target: Literal["quotes", "emoji", "games"]
+    op: Literal["add", "edit", "delete"]
+    index: Optional[int] = None
+    value: Optional[str] = None
+    game: Optional[GameItem] = None
+    type: Optional[str] = "default"
+
+
+class BatchPayload(BaseModel):
+    operations: List[BatchOperation]
+
+
 def validate(request):
     client_ip = get_real_ip(request)
     if client_ip not in IP_WHITELIST:
@@ -141,6 +164,30 @@ def _write_binary(path: Path, raw: bytes) -> None:
     path.write_bytes(raw)
 
 
+def _batch_entry(position: int, operation: BatchOperation) -> tuple:
+    """Map one API operation to (store, (op, index, value), cache)."""
+    if operation.op != "add" and operation.index is None:
+        raise HTTPException(status_code=400, detail=f"Operation {position}: index is required for {operation.op}")
+
+    if operation.target == "games":
+        store, cache = games_store, game_catalog
+        value = operation.game.dict() if operation.game else None
+    elif operation.target == "quotes":
+        store, cache = quote_store, quote_pool
+        value = operation.value
+    else:
+        kind = parse_emoji_kind(operation.type or "default")
+        store, cache = get_emoji_store(kind), get_emoji_pool(kind)
+        value = operation.value
+
+    if operation.op != "delete":
+        if operation.target == "games" and value is None:
+            raise HTTPException(status_code=400, detail=f"Operation {position}: game is required")
+        if operation.target != "games" and not (value and value.strip()):
+            raise HTTPException(status_code=400, detail=f"Operation {position}: value must be a non-empty string")
+    return store, (operation.op, operation.index, value), cache
+
+
 def _file_status(path: Path) -> dict:
     if not path.exists():
         return {"exists": False}
@@ -160,6 +207,7 @@ class ConfigAPI(APIModule):
             validate(request)
             return {
                 "data_dir": str(DATA_DIR),
+                "storage_backend": STORAGE_BACKEND,
                 "files": {
                     "quotes": _file_status(QUOTES_FILE),
                     "games": _file_status(GAMES_FILE),
@@ -170,6 +218,7 @@ class ConfigAPI(APIModule):
                     "telegram_session": _file_status(TELEGRAM_SESSION_FILE),
                     "userbot_session": _file_status(USERBOT_SESSION_FILE),
                     "spotify_token": _file_status(SPOTIFY_TOKEN_FILE),
+                    "database": _file_status(DATABASE_FILE),
                 },
             }
 
@@ -206,7 +255,11 @@ class ConfigAPI(APIModule):
             if not raw:
                 raise HTTPException(status_code=400, detail="Uploaded session file is empty.")
             _write_binary(TELEGRAM_SESSION_FILE, raw)
-            await TelegramAPI.reload_session()
+            if shared_state.is_leader:
+                await TelegramAPI.reload_session()
+            else:
+                #only the leader holds a Telegram client
+                shared_state.set(TELEGRAM_SESSION_KEY, time.time())
             return {"success": True, "path": str(TELEGRAM_SESSION_FILE)}
 
         @router.post("/config/import/spotify-token")
@@ -330,6 +383,26 @@ class ConfigAPI(APIModule):
             remove_game(index)
             return {"success": True}
 
+        @router.post("/config/batch")
+        async def apply_batch(request: Request, payload: BatchPayload):
+            logger.debug(f"POST on /config/batch with {len(payload.operations)} operations")
+            validate(request)
+            if not payload.operations:
+                raise HTTPException(status_code=400, detail="No operations given.")
+
+            entries = [_batch_entry(i, operation) for i, operation in enumerate(payload.operations)]
+            caches = {id(cache): cache for _, _, cache in entries}
+            current = {key: cache.current() for key, cache in caches.items()}
+            try:
+                changes = storage.apply_batch([(store, operation) for store, operation, _ in entries])
+            except IndexError as e:
+                raise HTTPException(status_code=400, detail=f"Batch rejected, nothing was changed: {e}")
+
+            for key, cache in caches.items():
+                cache_changes = [change for (_, change), (_, _, other) in zip(changes, entries) if other is cache]
+                cache.mirror(cache_changes, current[key])
+            return {"success": True, "count": len(entries)}
+
     def register_websockets(self, router: APIRouter) -> None:
         pass
 
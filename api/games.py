@@ -7,24 +7,42 @@ from core.logger import get_logger
 
 logger = get_logger("Games")
 
+
+def _game_response(game: dict) -> dict:
+    return {
+        "steam_id": game.get("steam_id"),
+        "name": game.get("name"),
+        "emoji_id": game.get("emoji_id"),
+        "color": game.get("color")
+    }
+
+
 class GameModule(APIModule):
     def register_routes(self, router: APIRouter) -> None:
 
         @router.get("/games")
-        async def get_game(request: Request, q: Optional[str] = Query(None, alias="query")):
+        async def get_game(
+            request: Request,
+            q: Optional[str] = Query(None, alias="query"),
+            top_k: Optional[int] = Query(None, ge=1, le=50),
+            threshold: float = Query(game_manager.FUZZY_MATCH_THRESHOLD, ge=0.0, le=1.0),
+        ):
             logger.debug("GET on /games")
             if not q:
                 logger.error(f"No query parameter in request: {request}")
                 raise HTTPException(status_code=400, detail="Query parameter is required")
 
+            if top_k:
+                matches = game_manager.game_catalog.match(q, limit=top_k, threshold=threshold)
+                logger.debug(f"Fuzzy candidates for {q}: {len(matches)}")
+                return {
+                    "query": q,
+                    "candidates": [{**_game_response(game), "score": score} for game, score in matches]
+                }
+
             game = game_manager.find_game_by_query(q)
             if not game:
                 logger.error(f"No game for query: {q}")
                 raise HTTPException(status_code=404, detail="Game not found")
 
-            return {
-                "steam_id": game.get("steam_id"),
-                "name": game.get("name"),
-                "emoji_id": game.get("emoji_id"),
-                "color": game.get("color")
-            }
+            return _game_response(game)
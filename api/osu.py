@@ -1,10 +1,11 @@
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
-import asyncio
+from fastapi import APIRouter, FastAPI, WebSocket, Request, HTTPException
 import json
 
 from .base import APIModule, get_real_ip
 from core.config import IP_WHITELIST
+from core.broadcast import broadcast_hub
 from core.main_processor import main_processor
+from core.shared_state import shared_state
 from core.logger import get_logger
 
 logger = get_logger("OSU")
@@ -17,22 +18,8 @@ latest_osu_data = {
     "status": None #Status should be 3 or -1 when osu shutted down.
 }
 
-connected_clients = set()
-
 ALLOWED_IPS = IP_WHITELIST
 
-async def notify_clients(data):
-    logger.debug("Notifying WS clients about change")
-    global connected_clients
-    alive = set()
-    for ws in connected_clients:
-        try:
-            await ws.send_json(data)
-            alive.add(ws)
-        except Exception:
-            pass
-    connected_clients = alive
-
 class OsuModule(APIModule):
     def register_routes(self, router: APIRouter) -> None:
         @router.post("/osu")
@@ -53,8 +40,9 @@ class OsuModule(APIModule):
 
             if updated:
                 logger.info("New change, notifying clients")
-                await notify_clients(latest_osu_data)
-                await main_processor.handle_osu_update(latest_osu_data)
+                broadcast_hub.publish("osu", latest_osu_data)
+                if shared_state.is_leader:
+                    await main_processor.handle_osu_update(latest_osu_data)
 
             return {"status": "ok"}
 
@@ -64,11 +52,23 @@ class OsuModule(APIModule):
             return latest_osu_data
 
     def register_websockets(self, app: FastAPI):
+        broadcast_hub.register_topic("osu", lambda: latest_osu_data, delta=True, apply=latest_osu_data.update)
+
         @app.websocket("/osu")
-        async def osus_ws(websocket: WebSocket):
-            await websocket.accept()
-            connected_clients.add(websocket)
-            try:
-                await websocket.send_json(latest_osu_data)
-            except WebSocketDisconnect:
-                connected_clients.remove(websocket)
+        async def osus_ws(websocket: WebSocket, delta: bool = False, max_rate: float | None = None):
+            await broadcast_hub.serve(websocket, "osu", delta, max_rate)
+
+    def register_events(self, app: FastAPI) -> None:
+        async def process_remote_update(_data):
+            #updates posted to another worker reach Telegram and PiLED through the leader
+            if shared_state.is_leader:
+                await main_processor.handle_osu_update(latest_osu_data)
+
+        shared_state.watch("osu", process_remote_update)
+
+        async def replay_osu(leader: bool):
+            #whatever the previous leader showed for osu! is now this worker's to keep up
+            if leader and latest_osu_data["status"] is not None:
+                await main_processor.handle_osu_update(latest_osu_data)
+
+        shared_state.on_leadership(replay_osu)
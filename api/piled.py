@@ -1,11 +1,24 @@
 from typing import Optional
+import time
 
-from fastapi import APIRouter, Query, Request, HTTPException
+from fastapi import APIRouter, FastAPI, Query, Request, HTTPException
 from pydantic import BaseModel, Field, conint
 
 from .base import APIModule, get_real_ip
-from core.piled import get_current_color, send_color_request, update_default_color, get_default_color
+from core.piled import (
+    get_current_color,
+    send_color_request,
+    update_default_color,
+    store_default_color,
+    get_default_color,
+    color_queue,
+    color_shadow,
+    PILED_COLOR_KEY,
+    PILED_DEFAULT_KEY,
+    PILED_SHADOW_KEY,
+)
 from core.config import IP_WHITELIST
+from core.shared_state import shared_state
 from core.logger import get_logger
 
 from .activity import activity_data
@@ -21,13 +34,48 @@ class ColorRequest(BaseModel):
 class DefaultColorRequest(BaseModel):
     color: str
 
+
+#the leader owns the device connection and the duplicate check, so colors posted to another worker go through it;
+#"pending" stays set until the leader has applied the value, and a new leader applies what is still pending
+async def apply_color(command):
+    if command is None or not command["pending"] or not shared_state.is_leader:
+        return
+    await send_color_request(command["red"], command["green"], command["blue"], command["duration"], command["steps"])
+    shared_state.set(PILED_COLOR_KEY, {**command, "pending": False})
+
+
+async def apply_default(command):
+    if command is None:
+        return
+    if command["pending"] and shared_state.is_leader:
+        await update_default_color(command["color"])
+        shared_state.set(PILED_DEFAULT_KEY, {**command, "pending": False})
+    else:
+        store_default_color(command["color"])
+
+
+async def request_color(red: int, green: int, blue: int, duration: int = 3, steps: int = 150):
+    if shared_state.is_leader:
+        await send_color_request(red, green, blue, duration, steps)
+    else:
+        shared_state.set(PILED_COLOR_KEY, {"red": red, "green": green, "blue": blue, "duration": duration, "steps": steps, "pending": True})
+
+
+async def request_default_color(color: str):
+    if shared_state.is_leader:
+        await update_default_color(color)
+    else:
+        store_default_color(color)
+    shared_state.set(PILED_DEFAULT_KEY, {"color": color, "pending": not shared_state.is_leader})
+
+
 class PiLEDModule(APIModule):
     def register_routes(self, router: APIRouter) -> None:
 
         @router.get("/piled")
-        async def get_color():
-            logger.debug("GET on /piled")
-            return get_current_color()
+        async def get_color(refresh: bool = Query(False, description="Ask the device instead of the shadow copy")):
+            logger.debug(f"GET on /piled, refresh: {refresh}")
+            return await get_current_color(refresh)
 
         @router.post("/piled")
         async def set_color(request: Request, body: ColorRequest):
@@ -60,7 +108,7 @@ class PiLEDModule(APIModule):
                     logger.debug(f"nothing detected. body: {body.dict()}")
                     raise HTTPException(status_code=400, detail="Missing color parameters")
 
-                send_color_request(r, g, b, 3, 50)
+                await request_color(r, g, b, 3, 50)
                 logger.debug(f"Set color r: {r}, g: {g}, b: {b}")
                 return {
                     "status": "ok",
@@ -73,6 +121,19 @@ class PiLEDModule(APIModule):
             except Exception as e:
                 raise HTTPException(status_code=500, detail=str(e))
 
+        @router.get("/services/piled/status")
+        async def get_piled_status():
+            return {
+                "last_sent": color_queue.last_sent,
+                "stats": color_queue.stats,
+                "shadow": {
+                    "color": color_shadow.color,
+                    "source": color_shadow.source,
+                    "age": color_shadow.age,
+                    "stats": color_shadow.stats,
+                },
+            }
+
         @router.get("/piled/default")
         async def get_def_color():
             return {"color": get_default_color()}
@@ -83,6 +144,34 @@ class PiLEDModule(APIModule):
             if client_ip not in IP_WHITELIST:
                 logger.warning(f"POST on /piled/default from non-whitelisted IP: {client_ip}")
                 raise HTTPException(status_code=403, detail=f"Forbidden: IP {client_ip} not allowed")
-            
-            update_default_color(body.color)
-            return {"status": "ok", "new_default": body.color}
\ No newline at end of file
+
+            await request_default_color(body.color)
+            return {"status": "ok", "new_default": body.color}
+
+    def register_events(self, app: FastAPI) -> None:
+        shared_state.watch(PILED_COLOR_KEY, apply_color)
+        shared_state.watch(PILED_DEFAULT_KEY, apply_default)
+
+        async def apply_pending(leader: bool):
+            #posted while no worker was the leader
+            if leader:
+                await apply_default(shared_state.get(PILED_DEFAULT_KEY))
+                await apply_color(shared_state.get(PILED_COLOR_KEY))
+
+        shared_state.on_leadership(apply_pending)
+
+        def report_shadow(color, source):
+            #followers answer GET /piled from the leader's copy instead of their own, which nothing updates
+            if shared_state.is_leader and shared_state.enabled:
+                shared_state.set(PILED_SHADOW_KEY, {"color": color, "source": source, "at": time.time()})
+
+        def shadow_changed(report):
+            if shared_state.is_leader:
+                return
+            if report["color"] is None:
+                color_shadow.invalidate()
+            else:
+                color_shadow.record(tuple(report["color"]), report["source"], max(0.0, time.time() - report["at"]))
+
+        color_shadow.on_change = report_shadow
+        shared_state.watch(PILED_SHADOW_KEY, shadow_changed)
\ No newline at end of file
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
-import asyncio
+from fastapi import APIRouter, FastAPI, WebSocket, Request, HTTPException, Query
 import json
+import math
+import time
 
-from .base import APIModule, get_real_ip
-from core.config import IP_WHITELIST
+from .base import APIModule, get_real_ip, parse_time_window
+from core.config import IP_WHITELIST, SENSOR_BATCH_MAX, SENSOR_BATCH_MAX_SKEW
+from core.broadcast import broadcast_hub
 from core.logger import get_logger
+from core.sensor_history import sensor_history, RESOLUTIONS, DEFAULT_PERCENTILES
 
 logger = get_logger("Sensors")
 
@@ -15,58 +18,156 @@ latest_sensor_data = {
     "co2": None
 }
 
-connected_clients = set()
-
 ALLOWED_IPS = IP_WHITELIST
 
-async def notify_clients(data):
-    #logger.debug("Notifying WS clients about update")
-    global connected_clients
-    alive = set()
-    for ws in connected_clients:
+def check_sender(request: Request, path: str) -> None:
+    client_ip = get_real_ip(request)
+    if client_ip not in ALLOWED_IPS:
+        logger.warning(f"POST on {path} from non-whitelisted IP: {client_ip}")
+        raise HTTPException(status_code=403, detail=f"Forbidden: IP {client_ip} not allowed")
+
+
+def apply_reading(incoming: dict, ts: float | None = None, record: bool = True) -> bool:
+    """Merge one reading into latest_sensor_data and record it (with ``record``); False if it had no sensor fields."""
+    updated = False
+    for key in latest_sensor_data:
+        if key in incoming:
+            latest_sensor_data[key] = incoming[key]
+            updated = True
+    if updated and record:
+        try:
+            sensor_history.append(latest_sensor_data, ts)
+        except Exception as e:
+            logger.error(f"Failed to record sensor history: {e}")
+    return updated
+
+
+def parse_batch(body: bytes) -> list:
+    """A JSON array of readings, or NDJSON with one reading per line."""
+    try:
+        readings = json.loads(body)
+    except ValueError:
         try:
-            await ws.send_json(data)
-            alive.add(ws)
-        except Exception:
-            pass
-    connected_clients = alive
+            readings = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON of readings")
+    if isinstance(readings, dict):
+        #a single NDJSON line parses as a plain object
+        readings = [readings]
+    if not isinstance(readings, list) or not all(isinstance(reading, dict) for reading in readings):
+        raise HTTPException(status_code=400, detail="Every reading must be a JSON object")
+    return readings
+
 
 class SensorsModule(APIModule):
     def register_routes(self, router: APIRouter) -> None:
         @router.post("/sensors")
         async def update_sensors(request: Request):
-            client_ip = get_real_ip(request)
-            #logger.debug(f"POST on /sensors from {client_ip}")
-            if client_ip not in ALLOWED_IPS:
-                logger.warning(f"POST on /sensors from non-whitelisted IP: {client_ip}")
-                raise HTTPException(status_code=403, detail=f"Forbidden: IP {client_ip} not allowed")
+            check_sender(request, "/sensors")
 
-            global latest_sensor_data
             incoming = await request.json()
             #logger.debug(f"Data in POST sensors: {incoming}")
 
-            updated = False
-            for key in latest_sensor_data:
-                if key in incoming:
-                    latest_sensor_data[key] = incoming[key]
-                    updated = True
-
-            if updated:
-                await notify_clients(latest_sensor_data)
+            if apply_reading(incoming):
+                broadcast_hub.publish("sensors", latest_sensor_data)
 
             return {"status": "ok"}
 
+        @router.post("/sensors/batch")
+        async def update_sensors_batch(request: Request):
+            """Buffered readings in one request, oldest first.
+
+            Each reading is an object like POST /sensors takes, plus an optional
+            "ts" in unix seconds (missing means now). They are applied in order
+            and the resulting state is broadcast once. Readings not newer than
+            the newest one already recorded still update the state but are left
+            out of the history, so posting a batch again adds nothing; readings
+            sharing a "ts" are recorded once, with their merged state. A "ts" that isn't a finite number or lies more than
+            SENSOR_BATCH_MAX_SKEW seconds in the future rejects the whole batch,
+            since it would become the newest sample and shut out every later
+            one; a smaller lead is taken as now.
+            """
+            check_sender(request, "/sensors/batch")
+
+            readings = parse_batch(await request.body())
+            if len(readings) > SENSOR_BATCH_MAX:
+                raise HTTPException(status_code=413, detail=f"At most {SENSOR_BATCH_MAX} readings per batch")
+            now = time.time()
+            timestamps = []
+            for reading in readings:
+                try:
+                    ts = float(reading.get("ts", now))
+                except (TypeError, ValueError):
+                    ts = math.nan
+                if not math.isfinite(ts) or ts > now + SENSOR_BATCH_MAX_SKEW:
+                    raise HTTPException(status_code=400, detail=f"Invalid ts: {reading.get('ts')}")
+                #within the skew it is the sender's clock running ahead
+                timestamps.append(min(ts, now))
+
+            #history keeps one sample per timestamp: readings sharing one are recorded once, merged
+            last = [ts != following for ts, following in zip(timestamps, timestamps[1:])] + [True]
+            applied = sum(apply_reading(reading, ts, record) for reading, ts, record in zip(readings, timestamps, last))
+            if applied:
+                broadcast_hub.publish("sensors", latest_sensor_data)
+            logger.debug(f"POST on /sensors/batch applied {applied} of {len(readings)} readings")
+
+            return {"status": "ok", "received": len(readings), "applied": applied}
+
         @router.get("/sensors")
         async def get_sensors():
             logger.debug("GET on /sensors")
             return latest_sensor_data
 
+        @router.get("/sensors/history")
+        def get_sensors_history(
+            start: str | None = Query(None, alias="from", description="Unix seconds or ISO 8601, default 24 h before 'to'"),
+            end: str | None = Query(None, alias="to", description="Unix seconds or ISO 8601, default now"),
+            resolution: str = Query("auto", description="raw (up to SENSOR_HISTORY_MAX_POINTS samples), minute or auto"),
+        ):
+            logger.debug(f"GET on /sensors/history from={start} to={end} resolution={resolution}")
+            if resolution != "auto" and resolution not in RESOLUTIONS:
+                raise HTTPException(status_code=400, detail=f"resolution must be auto or one of {', '.join(RESOLUTIONS)}")
+            start_ts, end_ts = parse_time_window(start, end)
+            try:
+                return sensor_history.history(start_ts, end_ts, resolution)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+        @router.get("/sensors/stats")
+        def get_sensors_stats(
+            start: str | None = Query(None, alias="from", description="Unix seconds or ISO 8601, default 24 h before 'to'"),
+            end: str | None = Query(None, alias="to", description="Unix seconds or ISO 8601, default now"),
+            percentiles: str = Query(",".join(str(p) for p in DEFAULT_PERCENTILES), description="comma separated, 0-100"),
+        ):
+            logger.debug(f"GET on /sensors/stats from={start} to={end} percentiles={percentiles}")
+            try:
+                wanted = [float(p) for p in percentiles.split(",") if p.strip()]
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid percentiles: {percentiles}")
+            if any(not 0 <= p <= 100 for p in wanted):
+                raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+            start_ts, end_ts = parse_time_window(start, end)
+            try:
+                return sensor_history.stats(start_ts, end_ts, wanted)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+        @router.get("/services/sensors/status")
+        def get_sensors_status():
+            samples, minutes = sensor_history.rings
+            return {
+                "samples": {"count": len(samples), "capacity": samples.capacity, "oldest": samples.oldest_ts()},
+                "minutes": {"count": len(minutes), "capacity": minutes.capacity, "oldest": minutes.oldest_ts()},
+            }
+
     def register_websockets(self, app: FastAPI):
+        broadcast_hub.register_topic("sensors", lambda: latest_sensor_data, delta=True, apply=latest_sensor_data.update)
+
         @app.websocket("/sensors")
-        async def sensors_ws(websocket: WebSocket):
-            await websocket.accept()
-            connected_clients.add(websocket)
-            try:
-                await websocket.send_json(latest_sensor_data)
-            except WebSocketDisconnect:
-                connected_clients.remove(websocket)
+        async def sensors_ws(websocket: WebSocket, delta: bool = False, max_rate: float | None = None):
+            await broadcast_hub.serve(websocket, "sensors", delta, max_rate)
+
+    def register_events(self, app: FastAPI) -> None:
+        @app.on_event("shutdown")
+        async def flush_sensor_history():
+            sensor_history.flush()
@@ -1,12 +1,12 @@
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi import APIRouter, FastAPI, WebSocket, HTTPException, Request
 import asyncio
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from datetime import datetime
 
 from .base import APIModule, get_real_ip
+from core.broadcast import broadcast_hub
 from core.main_processor import main_processor
-from core.data_paths import SPOTIFY_TOKEN_FILE
+from core.shared_state import shared_state
+from core.spotify import spotify_client, spotify_poll_schedule
 from core.logger import get_logger
 from core.config import IP_WHITELIST
 
@@ -18,22 +18,15 @@ last_spotify = {
     "state": "stopped",
 }
 
-connected_clients: set[WebSocket] = set()
-
-
-def get_info():
-    sp = spotipy.Spotify(
-        auth_manager=SpotifyOAuth(
-            scope="user-read-playback-state",
-            cache_path=str(SPOTIFY_TOKEN_FILE),
-        )
-    )
-    return sp.current_playback()
+async def get_info():
+    return await spotify_client.current_playback()
 
 
 spotify_task = None
 spotify_task_running = False
 last_update = None
+#shared_state key: the toggle may hit any worker, the leader polls
+SPOTIFY_ENABLED_KEY = "spotify.enabled"
 
 
 async def spotify_update():
@@ -48,7 +41,7 @@ async def spotify_update():
         no_data_logged = False
         while spotify_task_running:
             try:
-                data = get_info()
+                data = await get_info()
             except Exception as e:
                 logger.warning(f"Error while getting info: {e}")
                 last_spotify = {
@@ -57,7 +50,7 @@ async def spotify_update():
                     "state": "error",
                     "error": str(e),
                 }
-                await asyncio.sleep(10)
+                await asyncio.sleep(spotify_poll_schedule.failed())
                 continue
 
             if not data or not data.get("item"):
@@ -70,9 +63,9 @@ async def spotify_update():
                     }
                     logger.debug("Updating about no data")
                     await main_processor.handle_spotify_update("", "", False, False, True)
-                    await broadcast_update()
+                    broadcast_update()
                     no_data_logged = True
-                await asyncio.sleep(10)
+                await asyncio.sleep(spotify_poll_schedule.observe(None))
                 continue
 
             no_data_logged = False
@@ -92,30 +85,43 @@ async def spotify_update():
                 logger.debug(f"New data: {last_spotify}")
                 old_artist, old_song = artist, song
                 await main_processor.handle_spotify_update(song, artist, is_playing, is_local)
-                await broadcast_update()
+                broadcast_update()
 
-            await asyncio.sleep(5)
+            interval = spotify_poll_schedule.observe(data)
+            logger.debug(f"Next Spotify poll in {interval:.1f} seconds")
+            await asyncio.sleep(interval)
     finally:
         spotify_task_running = False
-        last_spotify = {
-            "artist": None,
-            "song": None,
-            "state": "stopped",
-        }
-        logger.debug(f"No data")
-        await main_processor.handle_spotify_update("", "", False, False, True)
-        await broadcast_update()
-
-
-async def broadcast_update():
-    to_remove = set()
-    for ws in connected_clients:
-        try:
-            await ws.send_json(last_spotify)
-        except WebSocketDisconnect:
-            to_remove.add(ws)
-    for ws in to_remove:
-        connected_clients.remove(ws)
+        #cancelled by losing leadership: the playback goes on and the new leader reports it
+        if shared_state.is_leader:
+            last_spotify = {
+                "artist": None,
+                "song": None,
+                "state": "stopped",
+            }
+            logger.debug(f"No data")
+            await main_processor.handle_spotify_update("", "", False, False, True)
+            broadcast_update()
+
+
+def broadcast_update():
+    broadcast_hub.publish("spotify", last_spotify)
+
+
+def apply_spotify(data: dict) -> None:
+    global last_spotify
+    last_spotify = data
+
+
+def set_spotify_enabled(enabled: bool) -> None:
+    """Start or stop polling; the task only polls while this worker is the leader."""
+    global spotify_task, spotify_task_running
+    if enabled and spotify_task is None:
+        spotify_task = asyncio.create_task(shared_state.run_as_leader(spotify_update))
+    elif not enabled and spotify_task is not None:
+        spotify_task_running = False
+        spotify_task.cancel()
+        spotify_task = None
 
 
 class SpotifyModule(APIModule):
@@ -129,8 +135,12 @@ class SpotifyModule(APIModule):
         def get_spotify_status():
             return {
                 "running": spotify_task_running,
+                "enabled": shared_state.get(SPOTIFY_ENABLED_KEY, True),
                 "name": "Spotify",
                 "last_update": last_update or "never",
+                "client": spotify_client.stats,
+                "token": spotify_client.token_cache.stats,
+                "polling": spotify_poll_schedule.stats,
             }
 
         @router.post("/services/spotify/toggle")
@@ -139,32 +149,36 @@ class SpotifyModule(APIModule):
             if client_ip not in IP_WHITELIST:
                 logger.warning(f"POST on /piled from non-whitelisted IP: {client_ip}")
                 raise HTTPException(status_code=403, detail=f"Forbidden: IP {client_ip} not allowed")
-            global spotify_task, spotify_task_running
-
-            if spotify_task_running:
-                logger.info("Spotify stopping per request from POST")
-                spotify_task_running = False
-                if spotify_task:
-                    spotify_task.cancel()
-                    spotify_task = None
-                return {"status": "stopped"}
-            else:
-                logger.info("Spotify starting per request from POST")
-                spotify_task = asyncio.create_task(spotify_update())
-                return {"status": "started"}
+            enabled = not shared_state.get(SPOTIFY_ENABLED_KEY, True)
+            logger.info(f"Spotify {'starting' if enabled else 'stopping'} per request from POST")
+            shared_state.set(SPOTIFY_ENABLED_KEY, enabled)
+            set_spotify_enabled(enabled)
+            return {"status": "started" if enabled else "stopped"}
 
     def register_websockets(self, app: FastAPI):
+        broadcast_hub.register_topic("spotify", lambda: last_spotify, apply=apply_spotify)
+
         @app.websocket("/spotify")
         async def websocket_endpoint(websocket: WebSocket):
             logger.debug(f"GET on ws /spotify")
-            await websocket.accept()
-            connected_clients.add(websocket)
-            try:
-                await websocket.send_json(last_spotify)
-            except WebSocketDisconnect:
-                connected_clients.remove(websocket)
+            await broadcast_hub.serve(websocket, "spotify")
 
     def register_events(self, app: FastAPI) -> None:
+        shared_state.watch(SPOTIFY_ENABLED_KEY, set_spotify_enabled)
+
+        async def replay_spotify(leader: bool):
+            #shown right away instead of after the new leader's first poll
+            if leader and last_spotify.get("state") in ("playing", "paused"):
+                is_playing = last_spotify["state"] == "playing"
+                is_local = last_spotify.get("isLocal", False)
+                await main_processor.handle_spotify_update(last_spotify["song"], last_spotify["artist"], is_playing, is_local)
+
+        shared_state.on_leadership(replay_spotify)
+
         @app.on_event("startup")
         async def start_spotify_update():
-            asyncio.create_task(spotify_update())
+            set_spotify_enabled(shared_state.get(SPOTIFY_ENABLED_KEY, True))
+
+        @app.on_event("shutdown")
+        async def close_spotify_client():
+            await spotify_client.close()
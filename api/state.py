@@ -0,0 +1,25 @@
+from fastapi import APIRouter, FastAPI
+
+from .base import APIModule
+from core.shared_state import shared_state
+from core.logger import get_logger
+
+logger = get_logger("State")
+
+
+class StateModule(APIModule):
+    def register_routes(self, router: APIRouter) -> None:
+        @router.get("/services/state/status")
+        def get_state_status():
+            return shared_state.status()
+
+    def register_events(self, app: FastAPI) -> None:
+        @app.on_event("startup")
+        async def connect_shared_state():
+            if shared_state.enabled:
+                logger.info(f"Sharing state through {shared_state.path}")
+            await shared_state.start()
+
+        @app.on_event("shutdown")
+        async def close_shared_state():
+            await shared_state.close()
@@ -1,73 +1,49 @@
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect
-import requests
-import json
+from fastapi import APIRouter, FastAPI, WebSocket
 import datetime
 import pytz
 from time import sleep
 import asyncio
 import websockets
-from bs4 import BeautifulSoup
 
 from .base import APIModule
-from core.config import STEAM_PROFILE_LINK, STEAM_API, STEAM_USER
+from core.broadcast import broadcast_hub
 from core.main_processor import main_processor
+from core.shared_state import shared_state
+from core.steam import presence_state, steam_presence, steam_poll_interval
 from core.logger import get_logger
 
 logger = get_logger("Steam")
 
-connected_clients = set()
 status = {}
 
-async def send_update(data):
-    global connected_clients
-    disconnected = set()
-    message = json.dumps(data)
-    for ws in connected_clients:
-        try:
-            await ws.send_text(message)
-        except Exception:
-            disconnected.add(ws)
-    connected_clients -= disconnected
-
-
-def steam_info():
-  #response = requests.get(f'https://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/?key={STEAM_API}&steamids={STEAM_USER}')
-  #if response:
-  #  return response.json()
-  response = requests.get(STEAM_PROFILE_LINK)
-  soup = BeautifulSoup(response.text, 'html.parser')
-  element = soup.find(class_="profile_in_game_header")
-  text = ""
-  if element:
-    text = element.get_text()
-  if text == "Currently Offline":
-    logger.debug("User offline")
-    return {"status": "offline"}
-  elif text == "Currently Online":
-    logger.debug("User online")
-    return {"status": "online"}
-  elif text == "Currently In-Game":
-    game_name = soup.find(class_="profile_in_game_name").get_text().strip()
-    logger.debug(f"User playing {game_name}")
-    return {"status": "playing", "game_name": game_name}
-  else:
-    return {"status": "error"}
 
 async def steam_update():
     global status
     while True:
-        prev_status = status
-        status = steam_info()
-        if status == prev_status:
-          await asyncio.sleep(20)
+        new_status = await steam_presence.fetch()
+        delay = steam_poll_interval.observe(new_status)
+        #keep the last known state while Steam is unreachable, or when only the answering backend changed
+        if new_status is None or (status and presence_state(new_status) == presence_state(status)):
+          await asyncio.sleep(delay)
           continue
 
-        if status["status"] == "playing":
-            await main_processor.handle_steam_update(status["game_name"], True)
-        else:
-            await main_processor.handle_steam_update("", False)
+        status = new_status
+        broadcast_hub.publish("steam", status)
+        await process_status()
 
-        await asyncio.sleep(20)
+        await asyncio.sleep(delay)
+
+
+async def process_status():
+    if status["status"] == "playing":
+        await main_processor.handle_steam_update(status["game_name"], True, status.get("game_id"))
+    else:
+        await main_processor.handle_steam_update("", False)
+
+
+def apply_status(data: dict) -> None:
+    global status
+    status = data
 
 class SteamModule(APIModule):
     def register_routes(self, router: APIRouter) -> None:
@@ -77,19 +53,35 @@ class SteamModule(APIModule):
             logger.debug(f"GET on /steam")
             return status
 
+        @router.get("/services/steam/status")
+        def get_steam_service_status():
+            return {
+                "status": status,
+                "backend": steam_presence.last_backend,
+                "poll_interval": steam_poll_interval.current,
+                "stats": steam_presence.stats,
+            }
+
     def register_websockets(self, app: FastAPI):
+        broadcast_hub.register_topic("steam", lambda: status, apply=apply_status)
+
         @app.websocket("/steam")
         async def websocket_endpoint(websocket: WebSocket):
             logger.debug(f"GET on ws /steam")
-            await websocket.accept()
-            connected_clients.add(websocket)
-
-            try:
-                await websocket.send_json(status)
-            except WebSocketDisconnect:
-                connected_clients.remove(websocket)
+            await broadcast_hub.serve(websocket, "steam")
 
     def register_events(self, app: FastAPI) -> None:
+        async def replay_status(leader: bool):
+            #the poller only reports changes, so a new leader starts from the last published status
+            if leader and status:
+                await process_status()
+
+        shared_state.on_leadership(replay_status)
+
         @app.on_event("startup")
         async def start_steam_update():
-            asyncio.create_task(steam_update())
+            asyncio.create_task(shared_state.run_as_leader(steam_update))
+
+        @app.on_event("shutdown")
+        async def close_steam_client():
+            await steam_presence.close()
@@ -0,0 +1,31 @@
+from fastapi import APIRouter, FastAPI
+
+from .base import APIModule
+from core.shared_state import shared_state
+from core.telegram import TelegramAPI, TELEGRAM_SESSION_KEY
+from core.logger import get_logger
+
+logger = get_logger("TelegramStatus")
+
+
+class TelegramModule(APIModule):
+    def register_routes(self, router: APIRouter) -> None:
+        @router.get("/services/telegram/status")
+        async def get_telegram_status():
+            logger.debug("GET on /services/telegram/status")
+            return TelegramAPI.get_stats()
+
+    def register_events(self, app: FastAPI) -> None:
+        async def reload_session(_imported_at):
+            #a session file imported through another worker
+            if shared_state.is_leader:
+                await TelegramAPI.reload_session()
+
+        shared_state.watch(TELEGRAM_SESSION_KEY, reload_session)
+
+        async def leadership_changed(leader: bool):
+            #one client per session file: the new leader connects on its first update
+            if not leader:
+                await TelegramAPI.release()
+
+        shared_state.on_leadership(leadership_changed)
@@ -1,27 +1,24 @@
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect
-import requests
+from fastapi import APIRouter, FastAPI, WebSocket, Query, HTTPException
 import json
 import datetime
 import pytz
-from time import sleep
 import asyncio
 import websockets
-from os import path
 
-from .base import APIModule
-from core.config import ACCUWEATHER_API_KEY, ACCUWEATHER_LOCATION_CODE, WEATHER_API_KEY, WEATHER_COORDS
+from .base import APIModule, parse_time_window
+from core.config import WEATHER_TIMEZONE, WEATHER_RETRY_BASE
+from core.broadcast import broadcast_hub
+from core.data_paths import WEATHER_CACHE_FILE, ensure_data_dir
 from core.logger import get_logger
+from core.shared_state import shared_state
+from core.weather import fetch_current_conditions, sun_calendar, weather_client, weather_schedule
+from core.weather_history import weather_history, RESOLUTIONS
 
 logger = get_logger("Weather")
 
-url = f'http://dataservice.accuweather.com/currentconditions/v1/{ACCUWEATHER_LOCATION_CODE}?apikey={ACCUWEATHER_API_KEY}&details=true'
-
-connected_clients = set()
 last_weather = {}
 
-LAST_WEATHER_FILE = '/data/last_weather_fetch.txt'
-#FETCH_INTERVAL_SECONDS = 1800  #update once per 30 minutes
-FETCH_INTERVAL_SECONDS = 300 #update once per 5 minutes
+LAST_WEATHER_FILE = WEATHER_CACHE_FILE
 
 weather_colors = {
     1:  "#FFD700",  # Sunny - golden yellow
@@ -66,50 +63,66 @@ weather_colors = {
     44: "#DDEEFF",  # Mostly cloudy w/ snow night - cloudy white-blue
 }
 
-async def send_update(data):
-    logger.debug("Sending update to WS subscribers")
-    global connected_clients
-    disconnected = set()
-    message = json.dumps(data)
-    for ws in connected_clients:
+def save_weather_cache(fetched: bool) -> None:
+    """Persist last_weather and today's AccuWeather usage; ``fetched`` moves last_fetch_time forward."""
+    cache = {}
+    if not fetched and LAST_WEATHER_FILE.exists():
         try:
-            await ws.send_text(message)
+            with open(LAST_WEATHER_FILE, 'r') as f:
+                cache = json.load(f)
         except Exception as e:
-            logger.error(f"Exception while sending update to subscribers: {e}")
-            disconnected.add(ws)
-    connected_clients -= disconnected
+            logger.error(f"Failed to load weather cache: {e}")
+    if fetched:
+        cache["last_fetch_time"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    cache["last_weather"] = last_weather
+    cache["budget"] = weather_schedule.snapshot()
+    try:
+        ensure_data_dir()
+        with open(LAST_WEATHER_FILE, 'w') as f:
+            json.dump(cache, f)
+    except Exception as e:
+        logger.error(f"Failed to write weather cache: {e}")
+
 
 async def weather_update():
         global last_weather
 
-        if path.exists(LAST_WEATHER_FILE):
+        if LAST_WEATHER_FILE.exists():
             try:
                 with open(LAST_WEATHER_FILE, 'r') as f:
                     cache = json.load(f)
                     last_fetch_str = cache.get("last_fetch_time")
                     last_weather = cache.get("last_weather")
+                    if last_weather:
+                        #other workers only know what is published
+                        broadcast_hub.publish("weather", last_weather)
+                    weather_schedule.restore(cache.get("budget"))
                     if last_fetch_str:
                         last_fetch_time = datetime.datetime.fromisoformat(last_fetch_str)
                         now = datetime.datetime.now(datetime.timezone.utc)
                         elapsed = (now - last_fetch_time).total_seconds()
-                        if elapsed < FETCH_INTERVAL_SECONDS:
-                            wait_time = FETCH_INTERVAL_SECONDS - elapsed
+                        interval = weather_schedule.next_interval()
+                        if elapsed < interval:
+                            wait_time = interval - elapsed
                             logger.info(f"Last weather fetch was {elapsed:.0f} seconds ago. Waiting {wait_time:.0f} seconds.")
                             await asyncio.sleep(wait_time)
             except Exception as e:
                 logger.error(f"Failed to load weather cache: {e}")
 
+        local_tz = pytz.timezone(WEATHER_TIMEZONE)
+        failures = 0
         while True:
-          ### Send a GET request to the API endpoint and parse the JSON response
-          try:
-           response = requests.get(url)
-           weather_data = json.loads(response.content)[0]
-          except:
-           logger.error(f"Cant get [0], response.content: {response.content}")
-           sleep(FETCH_INTERVAL_SECONDS)
-           continue
-
-          #weather_data = json.loads('[{"LocalObservationDateTime":"2024-07-24T17:22:00+03:00","EpochTime":1721830920,"WeatherText":"Mostly cloudy","WeatherIcon":6,"HasPrecipitation":false,"PrecipitationType":null,"IsDayTime":true,"Temperature":{"Metric":{"Value":19.9,"Unit":"C","UnitType":17},"Imperial":{"Value":68.0,"Unit":"F","UnitType":18}},"RealFeelTemperature":{"Metric":{"Value":17.9,"Unit":"C","UnitType":17,"Phrase":"Pleasant"},"Imperial":{"Value":64.0,"Unit":"F","UnitType":18,"Phrase":"Pleasant"}},"RealFeelTemperatureShade":{"Metric":{"Value":16.7,"Unit":"C","UnitType":17,"Phrase":"Pleasant"},"Imperial":{"Value":62.0,"Unit":"F","UnitType":18,"Phrase":"Cool"}},"RelativeHumidity":78,"IndoorRelativeHumidity":77,"DewPoint":{"Metric":{"Value":15.9,"Unit":"C","UnitType":17},"Imperial":{"Value":61.0,"Unit":"F","UnitType":18}},"Wind":{"Direction":{"Degrees":338,"Localized":"NNW","English":"NNW"},"Speed":{"Metric":{"Value":24.8,"Unit":"km/h","UnitType":7},"Imperial":{"Value":15.4,"Unit":"mi/h","UnitType":9}}},"WindGust":{"Speed":{"Metric":{"Value":30.5,"Unit":"km/h","UnitType":7},"Imperial":{"Value":19.0,"Unit":"mi/h","UnitType":9}}},"UVIndex":2,"UVIndexText":"Low","Visibility":{"Metric":{"Value":24.1,"Unit":"km","UnitType":6},"Imperial":{"Value":15.0,"Unit":"mi","UnitType":2}},"ObstructionsToVisibility":"","CloudCover":76,"Ceiling":{"Metric":{"Value":12192.0,"Unit":"m","UnitType":5},"Imperial":{"Value":40000.0,"Unit":"ft","UnitType":0}},"Pressure":{"Metric":{"Value":1009.8,"Unit":"mb","UnitType":14},"Imperial":{"Value":29.82,"Unit":"inHg","UnitType":12}},"PressureTendency":{"LocalizedText":"Falling","Code":"F"},"Past24HourTemperatureDeparture":{"Metric":{"Value":-7.1,"Unit":"C","UnitType":17},"Imperial":{"Value":-13.0,"Unit":"F","UnitType":18}},"ApparentTemperature":{"Metric":{"Value":20.0,"Unit":"C","UnitType":17},"Imperial":{"Value":68.0,"Unit":"F","UnitType":18}},"WindChillTemperature":{"Metric":{"Value":20.0,"Unit":"C","UnitType":17},"Imperial":{"Value":68.0,"Unit":"F","UnitType":18}},"WetBulbTemperature":{"Metric":{"Value":17.5,"Unit":"C","UnitType":17},"Imperial":{"Value":63.0,"Unit":"F","UnitType":18}},"WetBulbGlobeTemperature":{"Metric":{"Value":19.6,"Unit":"C","UnitType":17},"Imperial":{"Value":67.0,"Unit":"F","UnitType":18}},"Precip1hr":{"Metric":{"Value":0.2,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.01,"Unit":"in","UnitType":1}},"PrecipitationSummary":{"Precipitation":{"Metric":{"Value":0.2,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.01,"Unit":"in","UnitType":1}},"PastHour":{"Metric":{"Value":0.2,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.01,"Unit":"in","UnitType":1}},"Past3Hours":{"Metric":{"Value":1.0,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.04,"Unit":"in","UnitType":1}},"Past6Hours":{"Metric":{"Value":8.8,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.35,"Unit":"in","UnitType":1}},"Past9Hours":{"Metric":{"Value":8.8,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.35,"Unit":"in","UnitType":1}},"Past12Hours":{"Metric":{"Value":8.8,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.35,"Unit":"in","UnitType":1}},"Past18Hours":{"Metric":{"Value":8.8,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.35,"Unit":"in","UnitType":1}},"Past24Hours":{"Metric":{"Value":9.0,"Unit":"mm","UnitType":3},"Imperial":{"Value":0.36,"Unit":"in","UnitType":1}}},"TemperatureSummary":{"Past6HourRange":{"Minimum":{"Metric":{"Value":19.2,"Unit":"C","UnitType":17},"Imperial":{"Value":66.0,"Unit":"F","UnitType":18}},"Maximum":{"Metric":{"Value":27.0,"Unit":"C","UnitType":17},"Imperial":{"Value":81.0,"Unit":"F","UnitType":18}}},"Past12HourRange":{"Minimum":{"Metric":{"Value":16.1,"Unit":"C","UnitType":17},"Imperial":{"Value":61.0,"Unit":"F","UnitType":18}},"Maximum":{"Metric":{"Value":27.0,"Unit":"C","UnitType":17},"Imperial":{"Value":81.0,"Unit":"F","UnitType":18}}},"Past24HourRange":{"Minimum":{"Metric":{"Value":14.8,"Unit":"C","UnitType":17},"Imperial":{"Value":59.0,"Unit":"F","UnitType":18}},"Maximum":{"Metric":{"Value":28.2,"Unit":"C","UnitType":17},"Imperial":{"Value":83.0,"Unit":"F","UnitType":18}}}},"MobileLink":"http://www.accuweather.com/en/ua/chernivtsi/322253/current-weather/322253?lang=en-us","Link":"http://www.accuweather.com/en/ua/chernivtsi/322253/current-weather/322253?lang=en-us"}]')[0]
+          weather_schedule.record_request()
+          weather_data = await fetch_current_conditions()
+
+          if weather_data is None:
+            failures += 1
+            retry_in = min(WEATHER_RETRY_BASE * 2 ** (failures - 1), weather_schedule.next_interval())
+            logger.error(f"Weather fetch failed ({failures} in a row), retrying in {retry_in:.0f} seconds")
+            save_weather_cache(fetched=False)
+            await asyncio.sleep(retry_in)
+            continue
+          failures = 0
 
           # Extract the temperature in Celsius and the weather icon ID from the response
           temp = weather_data['Temperature']['Metric']['Value']
@@ -118,35 +131,27 @@ async def weather_update():
           uv_index = weather_data['UVIndex']
           real_temp = weather_data['RealFeelTemperature']['Metric']['Value']
 
-          try:
-            response = requests.get(f"http://api.weatherapi.com/v1/astronomy.json?key={WEATHER_API_KEY}&q={WEATHER_COORDS}")
-            sunrise_data = json.loads(response.content)
-            sunrise = sunrise_data['astronomy']['astro']['sunrise']
-            sunset = sunrise_data['astronomy']['astro']['sunset']
-            # Parse the target time string into a datetime.time object
-            sunrise_time = datetime.datetime.strptime(sunrise, '%I:%M %p').time()
-            sunset_time = datetime.datetime.strptime(sunset, '%I:%M %p').time()
-          except:
-            logger.error(f"Cant get sunrise data, response.content: {response.content}")
-
-          kiev_tz = pytz.timezone('Europe/Kiev')
-          current_time = datetime.datetime.now(kiev_tz).time()
-          isDay = False
-          if current_time >= sunrise_time and current_time <= sunset_time:
-            isDay = True
+          now = datetime.datetime.now(local_tz)
+          if sun_calendar is not None:
+            sunrise, _ = sun_calendar.times(now.date())
+            sunrise_time = sunrise.strftime('%H:%M') if sunrise else None
+            isDay = sun_calendar.is_day(now)
           else:
-            isDay = False
+            #no usable WEATHER_COORDS, trust AccuWeather's own flag
+            sunrise_time = None
+            isDay = bool(weather_data.get('IsDayTime', False))
 
           logger.info(f"""Updated weather:
           Current temp: {temp}
           Real temp: {real_temp}
           Weather text: {weather_text}
           Weather icon id: {weather_icon}
-          Sunrise time: {sunrise}
+          Sunrise time: {sunrise_time}
           UV Index: {uv_index}
           Is day in Ukraine: {isDay}
-          Update time: {datetime.datetime.now(kiev_tz).strftime('%Y-%m-%d %H:%M:%S')}
+          Update time: {now.strftime('%Y-%m-%d %H:%M:%S')}
           Weather color: {weather_colors[weather_icon]}
+          AccuWeather requests today: {weather_schedule.used}/{weather_schedule.daily_budget}
           """)
 
           weather_dict = {
@@ -156,21 +161,25 @@ async def weather_update():
             'is_day': isDay,
             'weather_text': weather_text,
             'uv_index': uv_index,
-            'last_update_time': datetime.datetime.now(kiev_tz).strftime('%Y-%m-%d %H:%M:%S'),
+            'last_update_time': now.strftime('%Y-%m-%d %H:%M:%S'),
             'color': weather_colors[weather_icon]
           }
 
-          await send_update(weather_dict)
+          broadcast_hub.publish("weather", weather_dict)
           last_weather = weather_dict
+          save_weather_cache(fetched=True)
           try:
-              with open(LAST_WEATHER_FILE, 'w') as f:
-                  json.dump({
-                      "last_fetch_time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
-                      "last_weather": weather_dict
-                  }, f)
+              weather_history.append(weather_dict, now.timestamp())
           except Exception as e:
-              logger.error(f"Failed to write weather cache: {e}")
-          await asyncio.sleep(FETCH_INTERVAL_SECONDS)
+              logger.error(f"Failed to record weather history: {e}")
+          interval = weather_schedule.next_interval()
+          logger.debug(f"Next weather fetch in {interval:.0f} seconds")
+          await asyncio.sleep(interval)
+
+
+def apply_weather(data: dict) -> None:
+    global last_weather
+    last_weather = data
 
 
 class WeatherModule(APIModule):
@@ -181,27 +190,40 @@ class WeatherModule(APIModule):
             logger.debug("GET on /weather")
             return last_weather
 
+        @router.get("/weather/history")
+        def get_weather_history(
+            start: str | None = Query(None, alias="from", description="Unix seconds or ISO 8601, default 24 h before 'to'"),
+            end: str | None = Query(None, alias="to", description="Unix seconds or ISO 8601, default now"),
+            resolution: str = Query("auto", description="raw, hour, day or auto"),
+        ):
+            logger.debug(f"GET on /weather/history from={start} to={end} resolution={resolution}")
+            if resolution != "auto" and resolution not in RESOLUTIONS:
+                raise HTTPException(status_code=400, detail=f"resolution must be auto or one of {', '.join(RESOLUTIONS)}")
+            start_ts, end_ts = parse_time_window(start, end)
+            return weather_history.query(start_ts, end_ts, resolution)
+
+        @router.get("/services/weather/status")
+        def get_weather_service_status():
+            return {
+                "budget": weather_schedule.snapshot(),
+                "daily_budget": weather_schedule.daily_budget,
+                "next_interval": weather_schedule.next_interval(),
+                "is_day": sun_calendar.is_day() if sun_calendar else None,
+            }
+
     def register_websockets(self, app: FastAPI):
+        broadcast_hub.register_topic("weather", lambda: last_weather, apply=apply_weather)
+
         @app.websocket("/weather")
         async def websocket_endpoint(websocket: WebSocket):
             logger.debug("GET on ws /weather")
-            await websocket.accept()
-            connected_clients.add(websocket)
-            logger.debug(f"WS connected, connected clients now: {connected_clients}")
-            try:
-                await websocket.send_json(last_weather)
-                while True:
-                    await websocket.receive_text()
-            except WebSocketDisconnect:
-                logger.debug("Client disconnected gracefully")
-            except Exception as e:
-                logger.debug(f"WS connection dropped with error: {e}")
-            finally:
-                if websocket in connected_clients:
-                    connected_clients.remove(websocket)
-                logger.debug(f"WS disconnected, connected clients now: {connected_clients}")
+            await broadcast_hub.serve(websocket, "weather")
 
     def register_events(self, app: FastAPI) -> None:
         @app.on_event("startup")
         async def start_weather_update():
-            asyncio.create_task(weather_update())
+            asyncio.create_task(shared_state.run_as_leader(weather_update))
+
+        @app.on_event("shutdown")
+        async def close_weather_client():
+            await weather_client.close()
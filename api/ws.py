@@ -0,0 +1,41 @@
+from fastapi import APIRouter, FastAPI, WebSocket
+
+from .base import APIModule
+from core.broadcast import broadcast_hub
+from core.logger import get_logger
+
+logger = get_logger("WS")
+
+
+class WSModule(APIModule):
+    def register_routes(self, router: APIRouter) -> None:
+        @router.get("/services/ws/status")
+        def get_ws_status():
+            return {"topics": sorted(broadcast_hub.topics), **broadcast_hub.status()}
+
+    def register_websockets(self, app: FastAPI):
+        @app.websocket("/ws")
+        async def multiplexed_ws(websocket: WebSocket, topics: str = "", delta: bool = False, max_rate: float | None = None):
+            """One connection for any set of topics.
+
+            ``/ws?topics=weather,spotify`` subscribes on connect; afterwards the
+            client sends {"action": "subscribe" | "unsubscribe" | "snapshot",
+            "topics": [...]} ("*" for all). It receives
+            {"type": "snapshot" | "update", "topic": ..., "data": ...} per topic,
+            plus {"type": "subscribed", "topics": [...]} or {"type": "error", ...}
+            after each control message.
+
+            With ``delta=1`` (or "delta": true in a subscribe) the sensors,
+            activity and osu topics send a versioned snapshot followed by
+            {"type": "delta", "version": ..., "data": <merge patch>} messages.
+
+            ``max_rate`` (updates per second) caps each topic for slow clients;
+            they get the newest state at most that often.
+            """
+            logger.debug(f"GET on ws /ws, topics: {topics}")
+            await broadcast_hub.serve_many(websocket, [topic for topic in topics.split(",") if topic], delta, max_rate)
+
+    def register_events(self, app: FastAPI) -> None:
+        @app.on_event("shutdown")
+        async def close_ws_clients():
+            await broadcast_hub.close()
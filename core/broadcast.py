@@ -0,0 +1,477 @@
+import asyncio
+import copy
+import json
+from collections import Counter, deque
+from typing import Any, Callable
+
+from .config import WS_CLIENT_QUEUE, WS_SEND_TIMEOUT
+from .logger import get_logger
+from .shared_state import shared_state
+
+logger = get_logger("Broadcast")
+
+#close code for clients dropped for not keeping up ("try again later")
+SLOW_CLIENT_CLOSE_CODE = 1013
+CONTROL_ACTIONS = ("subscribe", "unsubscribe", "snapshot")
+CONTROL_HELP = 'expected {"action": "subscribe" | "unsubscribe" | "snapshot", "topics": [...]}'
+#queue key of control replies, so they collapse like a topic of their own
+CONTROL_KEY = "#control"
+_MISSING = object()
+
+
+def encode(data) -> str:
+    #same wire format as WebSocket.send_json
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def envelope(kind: str, text: str, topic: str | None = None, version: int | None = None, since: int | None = None) -> str:
+    """Wrap an already encoded payload as {"type", ["topic",] ["version",] ["since",] "data"} without serializing it again."""
+    fields = [f'"type":"{kind}"']
+    if topic is not None:
+        fields.append(f'"topic":{encode(topic)}')
+    if version is not None:
+        fields.append(f'"version":{version}')
+    if since is not None:
+        fields.append(f'"since":{since}')
+    fields.append(f'"data":{text}')
+    return "{" + ",".join(fields) + "}"
+
+
+def merge_patch(old, new) -> dict:
+    """RFC 7386 merge patch turning ``old`` into ``new`` (both dicts); removed keys map to None."""
+    patch = {}
+    for key, value in new.items():
+        previous = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = merge_patch(previous, value)
+            if nested:
+                patch[key] = nested
+        elif previous is _MISSING or previous != value:
+            patch[key] = value
+    for key in old.keys() - new.keys():
+        patch[key] = None
+    return patch
+
+
+class Subscriber:
+    """One WebSocket with its own bounded send queue, drained by a writer task.
+
+    ``push`` never waits. When the queue is full, every topic's pending
+    messages collapse to its newest one (each message carries the topic's
+    full state, so only the newest matters); a delta that loses its
+    predecessors that way is replaced by the snapshot of the same version.
+    If collapsing frees nothing the client is evicted.
+
+    A client with a ``max_rate`` (updates per second) gets each topic at
+    most that often: an update arriving sooner is held, a newer one
+    replaces it (latest wins), and the held one is queued once the
+    interval has passed. Where a delta replaces a held delta, the release
+    sends one delta from the state the client last got instead, marked
+    with the version it applies on ("since"). Control replies are never
+    held.
+    """
+
+    def __init__(
+        self,
+        hub: "BroadcastHub",
+        websocket,
+        max_queue: int,
+        send_timeout: float,
+        tagged: bool = False,
+        max_rate: float | None = None,
+    ):
+        self.hub = hub
+        self.websocket = websocket
+        #multiplexed clients get {"type", "topic", "data"} envelopes instead of the bare state
+        self.tagged = tagged
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.topics: set[str] = set()
+        #topics this client follows as versioned merge patches
+        self.delta_topics: set[str] = set()
+        #(queue key, text, snapshot text to fall back to if the text is a delta)
+        self.pending: deque[tuple[str, str, str | None]] = deque()
+        self.min_interval = 1 / max_rate if max_rate and max_rate > 0 else 0.0
+        #per topic: when its last message was queued, and the update held back since
+        self.last_queued: dict[str, float] = {}
+        #a held text of None means "catch up from bases[topic]" on release
+        self.held: dict[str, tuple[str, str | None, str | None]] = {}
+        self._release_timers: dict[str, asyncio.TimerHandle] = {}
+        #per delta topic under max_rate: (version, state) the client's last queued message leaves it at
+        self.bases: dict[str, tuple[int, Any]] = {}
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        #release timers run on the connection's loop, whichever loop published
+        self._loop = asyncio.get_running_loop()
+        self._writer = asyncio.create_task(self._write())
+
+    def push(self, key: str, text: str, snapshot: str | None = None) -> bool:
+        """Queue a message (or hold it, under max_rate); False if the client had to be evicted."""
+        if self.closed:
+            return False
+        if self.min_interval and key != CONTROL_KEY:
+            due = self.last_queued.get(key, float("-inf")) + self.min_interval
+            if key in self.held or self._loop.time() < due:
+                if key in self.held:
+                    self.hub.stats["sampled"] += 1
+                    _, held_text, held_snapshot = self.held[key]
+                    if snapshot is not None:
+                        #the held delta is skipped, so this one can't apply on its own: send the
+                        #combined change on release, or the snapshot if the held message was one
+                        if held_text is None or held_snapshot is not None:
+                            text = snapshot = None
+                        else:
+                            text, snapshot = snapshot, None
+                else:
+                    self._release_timers[key] = self._loop.call_at(due, self._release, key)
+                self.held[key] = (key, text, snapshot)
+                return True
+            self.last_queued[key] = self._loop.time()
+        return self._enqueue((key, text, snapshot))
+
+    def _release(self, key: str) -> None:
+        self._release_timers.pop(key, None)
+        item = self.held.pop(key, None)
+        if item is not None and item[1] is None:
+            item = self.hub.catch_up(self, key)
+        if item is not None and not self.closed:
+            self.last_queued[key] = self._loop.time()
+            self._enqueue(item)
+
+    def _enqueue(self, item: tuple[str, str, str | None]) -> bool:
+        if self.min_interval and item[0] in self.delta_topics:
+            self.bases[item[0]] = (self.hub.versions[item[0]], self.hub._state(item[0]))
+        self.pending.append(item)
+        if len(self.pending) > self.max_queue:
+            self._collapse()
+            if len(self.pending) > self.max_queue:
+                self.hub.evict(self, "send queue full")
+                return False
+        self._wakeup.set()
+        return True
+
+    def _collapse(self) -> None:
+        counts = Counter(item[0] for item in self.pending)
+        newest = {item[0]: item for item in self.pending}
+        collapsed = deque()
+        for key, item in newest.items():
+            if counts[key] > 1 and item[2] is not None:
+                item = (key, item[2], None)
+            collapsed.append(item)
+        self.hub.stats["collapsed"] += len(self.pending) - len(collapsed)
+        self.pending = collapsed
+
+    async def _write(self) -> None:
+        #also stops on 'closed': wait_for() can swallow a cancel that lands as the send completes
+        try:
+            while not self.closed:
+                if not self.pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, text, _ = self.pending.popleft()
+                await asyncio.wait_for(self.websocket.send_text(text), self.send_timeout)
+                self.hub.stats["sent"] += 1
+        except asyncio.CancelledError:
+            pass
+        except asyncio.TimeoutError:
+            self.hub.evict(self, f"send blocked for {self.send_timeout}s")
+        except Exception as e:
+            logger.debug(f"WS send failed: {e.__class__.__name__}")
+            self.hub.unsubscribe(self)
+
+    def cancel_held(self, key: str | None = None) -> None:
+        """Drop the held update of ``key``, or of every topic."""
+        for key in [key] if key is not None else list(self._release_timers):
+            timer = self._release_timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self.held.pop(key, None)
+            self.bases.pop(key, None)
+
+    async def close(self, code: int = 1000) -> None:
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
+
+class BroadcastHub:
+    """Topic fan-out for WebSocket clients.
+
+    ``publish`` serializes a message once and appends the text to each
+    subscriber's queue without awaiting, so the publisher's cost doesn't
+    depend on how many clients there are or how fast they read.
+
+    Modules register their topics with a snapshot callable, used for the
+    first message a client gets on a topic. Topics registered with
+    ``delta=True`` also keep a version counter and the last published
+    state, so clients may opt into {"type": "delta", "version", "data"}
+    messages carrying only the changed fields (a JSON merge patch) after a
+    {"type": "snapshot", "version", "data"} one.
+
+    Under several workers each publish is also sent through
+    ``shared_state``; a topic registered with ``apply`` gets the other
+    workers' updates passed to it (to refresh the module's copy that GETs
+    and snapshots read) and fanned out to this worker's clients.
+    """
+
+    def __init__(self, max_queue: int = WS_CLIENT_QUEUE, send_timeout: float = WS_SEND_TIMEOUT):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.topics: dict[str, Callable[[], Any]] = {}
+        self.subscribers: dict[str, set[Subscriber]] = {}
+        #every connected client, including multiplexed ones with no topics
+        self.clients: set[Subscriber] = set()
+        self.versions: dict[str, int] = {}
+        self._states: dict[str, Any] = {}
+        self.stats = {"published": 0, "sent": 0, "collapsed": 0, "sampled": 0, "evicted": 0}
+        #writer and close tasks stay referenced until they finish, even once their subscriber is gone
+        self._tasks: set[asyncio.Task] = set()
+
+    def register_topic(
+        self,
+        topic: str,
+        snapshot: Callable[[], Any],
+        delta: bool = False,
+        apply: Callable[[Any], None] | None = None,
+    ) -> None:
+        self.topics[topic] = snapshot
+        if delta:
+            self.versions.setdefault(topic, 0)
+        if apply is not None:
+            shared_state.watch(topic, lambda data: self._apply_remote(topic, apply, data))
+
+    def _apply_remote(self, topic: str, apply: Callable[[Any], None], data) -> None:
+        apply(data)
+        self.publish(topic, data, relay=False)
+
+    def _state(self, topic: str):
+        #the state the current version refers to; taken from the module until the first publish
+        if topic not in self._states:
+            self._states[topic] = copy.deepcopy(self.topics[topic]())
+        return self._states[topic]
+
+    def snapshot(self, topic: str) -> str:
+        if topic in self.versions:
+            return encode(self._state(topic))
+        return encode(self.topics[topic]())
+
+    def snapshot_message(self, subscriber: Subscriber, topic: str) -> str:
+        topic_field = topic if subscriber.tagged else None
+        if topic in subscriber.delta_topics:
+            return envelope("snapshot", self.snapshot(topic), topic_field, self.versions[topic])
+        if subscriber.tagged:
+            return envelope("snapshot", self.snapshot(topic), topic)
+        return self.snapshot(topic)
+
+    def catch_up(self, subscriber: Subscriber, topic: str) -> tuple[str, str, str | None] | None:
+        """One delta taking a rate-limited client from its base version to the current one; None if nothing changed."""
+        if topic not in subscriber.delta_topics or topic not in subscriber.bases:
+            return topic, self.snapshot_message(subscriber, topic), None
+        since, base = subscriber.bases[topic]
+        state = self._state(topic)
+        patch = merge_patch(base, state)
+        if not patch:
+            return None
+        topic_field = topic if subscriber.tagged else None
+        #"since" marks where the patch applies, as the versions of the sampled-out updates are skipped
+        return (
+            topic,
+            envelope("delta", encode(patch), topic_field, self.versions[topic], since),
+            envelope("snapshot", encode(state), topic_field, self.versions[topic]),
+        )
+
+    def subscribe(self, websocket, topics, tagged: bool = False, delta: bool = False, max_rate: float | None = None) -> Subscriber:
+        subscriber = Subscriber(self, websocket, self.max_queue, self.send_timeout, tagged, max_rate)
+        self.clients.add(subscriber)
+        self.add_topics(subscriber, topics, delta)
+        return subscriber
+
+    def add_topics(self, subscriber: Subscriber, topics, delta: bool = False) -> None:
+        for topic in topics:
+            subscriber.topics.add(topic)
+            if delta and topic in self.versions:
+                subscriber.delta_topics.add(topic)
+            else:
+                subscriber.delta_topics.discard(topic)
+            self.subscribers.setdefault(topic, set()).add(subscriber)
+
+    def remove_topics(self, subscriber: Subscriber, topics) -> None:
+        for topic in topics:
+            subscriber.topics.discard(topic)
+            subscriber.delta_topics.discard(topic)
+            subscriber.cancel_held(topic)
+            self.subscribers.get(topic, set()).discard(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        if subscriber.closed:
+            return
+        subscriber.closed = True
+        self.clients.discard(subscriber)
+        subscriber.cancel_held()
+        subscriber._wakeup.set()
+        subscriber._writer.cancel()
+        self._keep(subscriber._writer)
+        for topic in subscriber.topics:
+            self.subscribers.get(topic, set()).discard(subscriber)
+
+    def evict(self, subscriber: Subscriber, reason: str) -> None:
+        if subscriber.closed:
+            return
+        logger.warning(f"Dropping slow WS client on {', '.join(sorted(subscriber.topics))}: {reason}")
+        self.stats["evicted"] += 1
+        self.unsubscribe(subscriber)
+        self._keep(asyncio.create_task(subscriber.close(SLOW_CLIENT_CLOSE_CODE)))
+
+    def _keep(self, task: asyncio.Task) -> None:
+        if not task.done():
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def publish(self, topic: str, data, relay: bool = True) -> None:
+        self.stats["published"] += 1
+        if relay and shared_state.enabled:
+            shared_state.set(topic, data)
+        patch = None
+        if topic in self.versions:
+            patch = merge_patch(self._state(topic), data)
+            if patch:
+                self.versions[topic] += 1
+                self._states[topic] = copy.deepcopy(data)
+        subscribers = self.subscribers.get(topic)
+        if not subscribers:
+            return
+
+        text = encode(data)
+        version = self.versions.get(topic)
+        messages = {}
+        for subscriber in list(subscribers):
+            kind = (topic in subscriber.delta_topics, subscriber.tagged)
+            if kind not in messages:
+                topic_field = topic if subscriber.tagged else None
+                if kind[0]:
+                    #an unchanged state means nothing to send to delta clients
+                    messages[kind] = patch and (
+                        envelope("delta", encode(patch), topic_field, version),
+                        envelope("snapshot", text, topic_field, version),
+                    )
+                elif subscriber.tagged:
+                    messages[kind] = (envelope("update", text, topic), None)
+                else:
+                    messages[kind] = (text, None)
+            if messages[kind]:
+                subscriber.push(topic, *messages[kind])
+
+    @staticmethod
+    def _parse(text: str):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text.strip()
+
+    async def serve(self, websocket, topic: str, delta: bool = False, max_rate: float | None = None) -> None:
+        """Run a single-topic WebSocket: send the topic's snapshot, then its updates until the client leaves.
+
+        ``websocket`` is a Starlette/FastAPI WebSocket. With ``delta`` (on a
+        delta topic) the client gets versioned snapshot/delta messages and may
+        send "snapshot" or {"action": "snapshot"} to get a new snapshot;
+        anything else it sends is ignored. ``max_rate`` caps the updates per
+        second this client gets, latest wins.
+        """
+        await websocket.accept()
+        subscriber = self.subscribe(websocket, [topic], delta=delta, max_rate=max_rate)
+        subscriber.push(topic, self.snapshot_message(subscriber, topic))
+        try:
+            while True:
+                message = self._parse(await websocket.receive_text())
+                if topic in subscriber.delta_topics and message in ("snapshot", {"action": "snapshot"}):
+                    subscriber.push(topic, self.snapshot_message(subscriber, topic))
+        except Exception as e:
+            #WebSocketDisconnect on a normal close
+            logger.debug(f"WS client on {topic} left: {e.__class__.__name__}")
+        finally:
+            self.unsubscribe(subscriber)
+
+    def _reply(self, subscriber: Subscriber, message: dict) -> None:
+        subscriber.push(CONTROL_KEY, encode(message))
+
+    def control(self, subscriber: Subscriber, message) -> None:
+        """Apply one control message from a multiplexed client.
+
+        ``{"action": "subscribe" | "unsubscribe" | "snapshot", "topics": [...]}``,
+        where "*" stands for every topic; a subscribe with ``"delta": true``
+        follows the delta-capable topics as versioned merge patches.
+        Subscribing (and "snapshot") sends a snapshot of each topic; every
+        action is answered with the current subscription list, or with an
+        error.
+        """
+        if not isinstance(message, dict) or message.get("action") not in CONTROL_ACTIONS:
+            self._reply(subscriber, {"type": "error", "error": CONTROL_HELP})
+            return
+        action = message["action"]
+        topics = message.get("topics", [])
+        if isinstance(topics, str):
+            topics = [topics]
+        if not isinstance(topics, list) or not all(isinstance(topic, str) for topic in topics):
+            self._reply(subscriber, {"type": "error", "error": "topics must be a list of strings"})
+            return
+        if "*" in topics:
+            topics = list(self.topics)
+        unknown = [topic for topic in topics if topic not in self.topics]
+        if unknown:
+            self._reply(subscriber, {"type": "error", "error": f"unknown topics: {unknown}", "topics": sorted(self.topics)})
+        topics = [topic for topic in topics if topic in self.topics]
+
+        if action == "subscribe":
+            self.add_topics(subscriber, topics, bool(message.get("delta")))
+        elif action == "unsubscribe":
+            self.remove_topics(subscriber, topics)
+        self._reply(subscriber, {
+            "type": "subscribed",
+            "topics": sorted(subscriber.topics),
+            "delta": sorted(subscriber.delta_topics),
+        })
+        if action != "unsubscribe":
+            for topic in topics:
+                if topic in subscriber.topics:
+                    subscriber.push(topic, self.snapshot_message(subscriber, topic))
+
+    async def serve_many(self, websocket, topics=(), delta: bool = False, max_rate: float | None = None) -> None:
+        """Run a multiplexed WebSocket: ``topics`` subscribed on connect, the rest driven by control messages.
+
+        ``max_rate`` applies to each topic separately.
+        """
+        await websocket.accept()
+        subscriber = self.subscribe(websocket, [], tagged=True, max_rate=max_rate)
+        try:
+            if topics:
+                self.control(subscriber, {"action": "subscribe", "topics": list(topics), "delta": delta})
+            while True:
+                self.control(subscriber, self._parse(await websocket.receive_text()))
+        except Exception as e:
+            logger.debug(f"Multiplexed WS client left: {e.__class__.__name__}")
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def close(self) -> None:
+        """Close every client (1001, going away) and wait for the writer tasks to finish."""
+        subscribers = list(self.clients)
+        for subscriber in subscribers:
+            self.unsubscribe(subscriber)
+        await asyncio.gather(*(subscriber.close(1001) for subscriber in subscribers), *self._tasks, return_exceptions=True)
+
+    def status(self) -> dict:
+        return {
+            "connections": len(self.clients),
+            "clients": {topic: len(subscribers) for topic, subscribers in self.subscribers.items()},
+            "rate_limited_clients": {
+                topic: sum(1 for subscriber in subscribers if subscriber.min_interval)
+                for topic, subscribers in self.subscribers.items()
+            },
+            "versions": self.versions,
+            **self.stats,
+        }
+
+
+broadcast_hub = BroadcastHub()
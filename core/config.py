@@ -8,28 +8,100 @@ HOSTNAME = os.getenv("HOSTNAME", "*")
 DIGEST_BEARER = os.getenv("DIGEST_BEARER", "")
 IP_WHITELIST = os.getenv("IP_WHITELIST", "").split(",")
 
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+
+#pending WebSocket messages per client; when full, a topic's pending updates collapse to the newest,
+#and a client still over the limit, or stuck in one send for WS_SEND_TIMEOUT seconds, is dropped
+WS_CLIENT_QUEUE = int(os.getenv("WS_CLIENT_QUEUE", 16))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", 5))
+
+#unix socket of the state service shared by gunicorn workers (gunicorn.conf.py starts it and sets this);
+#empty runs single-process with all state in memory
+STATE_SOCKET = os.getenv("STATE_SOCKET", "")
+#seconds between reconnect attempts to the state service, doubling up to STATE_RECONNECT_MAX
+STATE_RECONNECT_MIN = float(os.getenv("STATE_RECONNECT_MIN", 0.2))
+STATE_RECONNECT_MAX = float(os.getenv("STATE_RECONNECT_MAX", 5))
+
 ACCUWEATHER_API_KEY = os.getenv("ACCUWEATHER_API_KEY", "")
 ACCUWEATHER_LOCATION_CODE = os.getenv("ACCUWEATHER_LOCATION_CODE", "")
 
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY", "")
 WEATHER_COORDS = os.getenv("WEATHER_COORDS", "")
+WEATHER_TIMEZONE = os.getenv("WEATHER_TIMEZONE", "Europe/Kiev")
+WEATHER_HTTP_TIMEOUT = float(os.getenv("WEATHER_HTTP_TIMEOUT", 10))
+#AccuWeather calls per day (the free tier allows 50); the poll interval is derived from what is left of it
+ACCUWEATHER_DAILY_BUDGET = int(os.getenv("ACCUWEATHER_DAILY_BUDGET", 50))
+ACCUWEATHER_BUDGET_RESERVE = int(os.getenv("ACCUWEATHER_BUDGET_RESERVE", 2))
+WEATHER_MIN_INTERVAL = float(os.getenv("WEATHER_MIN_INTERVAL", 300))
+WEATHER_MAX_INTERVAL = float(os.getenv("WEATHER_MAX_INTERVAL", 3 * 3600))
+#local hours (start-end) polled WEATHER_NIGHT_WEIGHT times as often as the rest of the day
+WEATHER_NIGHT_HOURS = os.getenv("WEATHER_NIGHT_HOURS", "0-7")
+WEATHER_NIGHT_WEIGHT = float(os.getenv("WEATHER_NIGHT_WEIGHT", 0.25))
+#first retry after a failed fetch, doubled on each further failure
+WEATHER_RETRY_BASE = float(os.getenv("WEATHER_RETRY_BASE", 30))
 
 STEAM_API = os.getenv("STEAM_API", "")
 STEAM_USER = os.getenv("STEAM_USER", "")
 STEAM_PROFILE_LINK = os.getenv("STEAM_PROFILE_LINK", "")
+STEAM_API_URL = os.getenv("STEAM_API_URL", "https://api.steampowered.com")
+#"auto" uses the Web API when STEAM_API and STEAM_USER are set and falls back to the profile page
+STEAM_PRESENCE_BACKEND = os.getenv("STEAM_PRESENCE_BACKEND", "auto").lower()
+STEAM_HTTP_TIMEOUT = float(os.getenv("STEAM_HTTP_TIMEOUT", 10))
+#poll every STEAM_POLL_FAST seconds while online or for STEAM_FAST_WINDOW after a change,
+#every STEAM_POLL_SLOW once offline for STEAM_OFFLINE_SLOW_AFTER, otherwise every STEAM_POLL_INTERVAL
+STEAM_POLL_FAST = float(os.getenv("STEAM_POLL_FAST", 10))
+STEAM_POLL_INTERVAL = float(os.getenv("STEAM_POLL_INTERVAL", 20))
+STEAM_POLL_SLOW = float(os.getenv("STEAM_POLL_SLOW", 120))
+STEAM_FAST_WINDOW = float(os.getenv("STEAM_FAST_WINDOW", 120))
+STEAM_OFFLINE_SLOW_AFTER = float(os.getenv("STEAM_OFFLINE_SLOW_AFTER", 1800))
 
 SPOTIPY_CLIENT_ID = os.getenv("SPOTIPY_CLIENT_ID", "")
 SPOTIPY_CLIENT_SECRET = os.getenv("SPOTIPY_CLIENT_SECRET", "")
+SPOTIFY_HTTP_TIMEOUT = float(os.getenv("SPOTIFY_HTTP_TIMEOUT", 10))
+#while playing, poll SPOTIFY_END_MARGIN after the predicted end of the track but at least every SPOTIFY_POLL_MAX;
+#every SPOTIFY_POLL_FAST for SPOTIFY_FAST_WINDOW after a change; paused/stopped backs off from SPOTIFY_IDLE_MIN to SPOTIFY_IDLE_MAX
+SPOTIFY_END_MARGIN = float(os.getenv("SPOTIFY_END_MARGIN", 1.0))
+SPOTIFY_POLL_MAX = float(os.getenv("SPOTIFY_POLL_MAX", 15))
+SPOTIFY_POLL_FAST = float(os.getenv("SPOTIFY_POLL_FAST", 2))
+SPOTIFY_FAST_WINDOW = float(os.getenv("SPOTIFY_FAST_WINDOW", 10))
+SPOTIFY_IDLE_MIN = float(os.getenv("SPOTIFY_IDLE_MIN", 5))
+SPOTIFY_IDLE_MAX = float(os.getenv("SPOTIFY_IDLE_MAX", 120))
+SPOTIFY_POLL_ERROR = float(os.getenv("SPOTIFY_POLL_ERROR", 10))
 
 TG_API_KEY = os.getenv("TG_API_KEY", "")
 TG_API_HASH = os.getenv("TG_API_HASH", "")
 TG_IS_PREMIUM = os.getenv("TG_IS_PREMIUM", False) == "True"
+TG_BIO_LIMIT = 140 if TG_IS_PREMIUM else 70
 TG_DEFAULT_STATUS = os.getenv("TG_DEFAULT_STATUS", "")
 TG_DEFAULT_EMOJI=os.getenv("TG_DEFAULT_EMOJI", 5260623257224110661)
 TG_DEFAULT_GAME_EMOJI=os.getenv("TG_DEFAULT_GAME_EMOJI", 5244764300937011946)
 TG_CYCLING_EMOJI=os.getenv("TG_CYCLING_EMOJI", 5316848390628187649)
 TG_LOWBATTERY_EMOJI=os.getenv("TG_LOWBATTERY_EMOJI", 5778270101765624354)
+#profile updates are debounced for this long (seconds), but never delayed past the max delay
+TG_COALESCE_WINDOW = float(os.getenv("TG_COALESCE_WINDOW", 0.75))
+TG_COALESCE_MAX_DELAY = float(os.getenv("TG_COALESCE_MAX_DELAY", 3.0))
+#proactive RPC pacing: bucket size and refill rate (tokens per minute)
+TG_RPC_BUCKET_SIZE = int(os.getenv("TG_RPC_BUCKET_SIZE", 5))
+TG_RPC_PER_MINUTE = float(os.getenv("TG_RPC_PER_MINUTE", 6))
+
+#sensor history ring buffers: raw samples and per-minute rollups (fixed size files under /data, 24 and 88 bytes per entry)
+SENSOR_HISTORY_SAMPLES = int(os.getenv("SENSOR_HISTORY_SAMPLES", 200000))
+SENSOR_HISTORY_MINUTES = int(os.getenv("SENSOR_HISTORY_MINUTES", 30 * 24 * 60))
+#GET /sensors/history?resolution=auto returns raw samples up to this many points, minute rollups beyond
+SENSOR_HISTORY_MAX_POINTS = int(os.getenv("SENSOR_HISTORY_MAX_POINTS", 2000))
+#most readings accepted by one POST /sensors/batch
+SENSOR_BATCH_MAX = int(os.getenv("SENSOR_BATCH_MAX", 1000))
+#how far (seconds) a batch reading's "ts" may lie ahead of the server clock
+SENSOR_BATCH_MAX_SKEW = float(os.getenv("SENSOR_BATCH_MAX_SKEW", 60))
 
 PILED_SHARED_SECRET=os.getenv("PILED_SHARED_SECRET", "")
 PILED_DEFAULT_COLOR=os.getenv("PILED_DEFAULT_COLOR", "#ffffff")
-PILED_ADDRESS=os.getenv("PILED_ADDRESS", "")
\ No newline at end of file
+PILED_ADDRESS=os.getenv("PILED_ADDRESS", "")
+#keep the set-color connection open between packets (only if the controller supports it)
+PILED_KEEPALIVE=os.getenv("PILED_KEEPALIVE", "False") == "True"
+PILED_CONNECT_TIMEOUT=float(os.getenv("PILED_CONNECT_TIMEOUT", 1.5))
+PILED_READ_TIMEOUT=float(os.getenv("PILED_READ_TIMEOUT", 2.0))
+#minimal gap between two color commands, on top of waiting for the previous fade
+PILED_MIN_INTERVAL=float(os.getenv("PILED_MIN_INTERVAL", 0.25))
+#GET /piled answers from the shadow color and asks the device only when it is older than this
+PILED_SHADOW_MAX_AGE=float(os.getenv("PILED_SHADOW_MAX_AGE", 60))
@@ -0,0 +1,281 @@
+import ctypes
+import ctypes.util
+import os
+import random
+import sqlite3
+import struct
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Hashable
+
+from .logger import get_logger
+
+logger = get_logger("ContentStore")
+
+#how often (seconds) a pool may check a store whose signature isn't free (mtime, SQLite)
+MTIME_CHECK_INTERVAL = 2.0
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_WATCH_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class DirectoryWatcher:
+    """Non-blocking inotify watch on one directory.
+
+    Events are drained lazily whenever a pool asks whether its file changed,
+    so there is no background thread and no I/O besides a failed ``read`` when
+    nothing happened. ``available`` is False when inotify cannot be used
+    (non-Linux, missing directory, watch limit), in which case callers fall
+    back to mtime checks.
+    """
+
+    _libc = None
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.available = False
+        self._fd = -1
+        self._versions: dict[str, int] = {}
+        self._overflows = 0
+        try:
+            libc = self._load_libc()
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if libc.inotify_add_watch(fd, os.fsencode(str(directory)), _WATCH_MASK) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self._fd = fd
+            self.available = True
+        except (OSError, AttributeError) as e:
+            logger.debug(f"inotify unavailable for {directory}, using mtime checks: {e}")
+
+    @classmethod
+    def _load_libc(cls):
+        if cls._libc is None:
+            cls._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        return cls._libc
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.warning(f"inotify read failed for {self.directory}, using mtime checks: {e}")
+                self.available = False
+                return
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buf):
+                _, mask, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + name_len].rstrip(b"\0").decode(errors="replace")
+                offset += name_len
+                if mask & _IN_Q_OVERFLOW:
+                    self._overflows += 1
+                elif name:
+                    self._versions[name] = self._versions.get(name, 0) + 1
+
+    def version(self, name: str) -> int:
+        """Monotonic counter that moves whenever ``name`` may have changed."""
+        self._drain()
+        return self._versions.get(name, 0) + self._overflows
+
+
+_watchers: dict[Path, DirectoryWatcher] = {}
+
+
+def get_directory_watcher(directory: Path) -> DirectoryWatcher | None:
+    watcher = _watchers.get(directory)
+    if watcher is None:
+        if not directory.is_dir():
+            return None
+        watcher = DirectoryWatcher(directory)
+        _watchers[directory] = watcher
+    return watcher if watcher.available else None
+
+
+def _decrement(counts: Counter, item) -> None:
+    counts[item] -= 1
+    if counts[item] <= 0:
+        del counts[item]
+
+
+class ShuffleBag:
+    """Random sampling without repeats until every item has been drawn once.
+
+    A bag built with ``previous`` continues that bag's round: items it has
+    already drawn stay out until the round is exhausted, so reloading the
+    list doesn't start the sampling over. Items are kept as counts, so
+    ``add`` and ``remove`` don't scan the list; a removed item that is still
+    in the shuffled round is skipped when it comes up.
+    """
+
+    def __init__(self, items: list, previous: "ShuffleBag | None" = None):
+        self._counts = Counter(items)
+        self._size = len(items)
+        self._bag: list = []
+        #what the current round still holds, and bag entries whose item has since been removed
+        self._remaining: Counter = Counter()
+        self._skip: Counter = Counter()
+        self._last = None
+        if previous is not None:
+            self._last = previous._last
+            if previous._remaining:
+                drawn = previous._counts - previous._remaining
+                self._remaining = self._counts - drawn
+                self._bag = list(self._remaining.elements())
+                random.shuffle(self._bag)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, item) -> None:
+        self._counts[item] += 1
+        self._size += 1
+        if self._remaining:
+            #joins the current round at a random place
+            self._remaining[item] += 1
+            self._bag.append(item)
+            position = random.randrange(len(self._bag))
+            self._bag[position], self._bag[-1] = self._bag[-1], self._bag[position]
+
+    def remove(self, item) -> None:
+        _decrement(self._counts, item)
+        self._size -= 1
+        if self._remaining[item] > 0:
+            _decrement(self._remaining, item)
+            self._skip[item] += 1
+
+    def draw(self):
+        while self._size:
+            if not self._bag:
+                self._bag = list(self._counts.elements())
+                random.shuffle(self._bag)
+                self._remaining = self._counts.copy()
+                self._skip.clear()
+                #don't let the first draw of a new round repeat the last one of the previous
+                if len(self._bag) > 1 and self._bag[-1] == self._last:
+                    self._bag[0], self._bag[-1] = self._bag[-1], self._bag[0]
+            item = self._bag.pop()
+            if self._skip[item] > 0:
+                _decrement(self._skip, item)
+                continue
+            _decrement(self._remaining, item)
+            self._last = item
+            return item
+        return None
+
+
+class ContentPool:
+    """Cached list from a core.storage list store with shuffle-bag sampling.
+
+    The list is loaded on first use and re-read only after the store's
+    signature changes: an inotify counter for JSON files, otherwise an mtime
+    or revision check throttled to once per MTIME_CHECK_INTERVAL. Writes made
+    through ``apply`` update the list and bags in place instead.
+    ``partitions`` maps a key to a predicate; each key gets its own bag
+    holding only the items that satisfy it.
+    """
+
+    def __init__(self, store, partitions: dict[Hashable, Callable[[object], bool]] | None = None):
+        self.store = store
+        self.partitions = partitions or {}
+        self._items: list = []
+        self._bags: dict[Hashable, ShuffleBag] = {}
+        self._loaded = False
+        self._version = None
+        self._last_check = 0.0
+
+    def _build(self, items: list) -> None:
+        bags = {None: ShuffleBag(items, self._bags.get(None))}
+        for key, predicate in self.partitions.items():
+            bags[key] = ShuffleBag([item for item in items if predicate(item)], self._bags.get(key))
+        self._items, self._bags = items, bags
+        self._loaded = True
+
+    def reload(self) -> None:
+        self._version = self.store.signature()
+        self._last_check = time.monotonic()
+        try:
+            items = self.store.load()
+        except (OSError, ValueError, sqlite3.Error) as e:
+            logger.error(f"Failed to load {self.store}: {e}")
+            items = self._items
+        self._build(items)
+        logger.debug(f"Loaded {len(items)} entries from {self.store}")
+
+    def replace(self, items: list) -> None:
+        """Swap in a list that was just written to the store, skipping the re-read."""
+        self._version = self.store.signature()
+        self._last_check = time.monotonic()
+        self._build(list(items))
+
+    def invalidate(self) -> None:
+        self._loaded = False
+
+    def current(self) -> bool:
+        """Whether the cached list still matches the store, so a write can be mirrored into it."""
+        return self._loaded and self.store.signature() == self._version
+
+    def apply(self, operations: list[tuple]) -> None:
+        """Write core.storage operations to the store and mirror them into the cache."""
+        current = self.current()
+        self.mirror(self.store.apply(operations), current)
+
+    def mirror(self, changes: list[tuple], current: bool) -> None:
+        """Apply the (index, old, new) changes a store write reported; ``current`` is from before the write."""
+        if not current:
+            self.invalidate()
+            return
+        for index, old, new in changes:
+            if old is None:
+                self._items.append(new)
+            else:
+                old = self._items[index]
+                if new is None:
+                    self._items.pop(index)
+                else:
+                    self._items[index] = new
+            for key, bag in self._bags.items():
+                predicate = self.partitions.get(key)
+                if old is not None and (predicate is None or predicate(old)):
+                    bag.remove(old)
+                if new is not None and (predicate is None or predicate(new)):
+                    bag.add(new)
+        self._version = self.store.signature()
+        self._last_check = time.monotonic()
+
+    def _ensure_fresh(self) -> None:
+        if not self._loaded:
+            self.reload()
+            return
+        if not self.store.cheap_signature:
+            now = time.monotonic()
+            if now - self._last_check < MTIME_CHECK_INTERVAL:
+                return
+            self._last_check = now
+        if self.store.signature() != self._version:
+            self.reload()
+
+    @property
+    def items(self) -> list:
+        self._ensure_fresh()
+        return self._items
+
+    def sample(self, partition: Hashable = None):
+        """Draw the next item from ``partition`` (None for the whole list), or None if empty."""
+        self._ensure_fresh()
+        bag = self._bags.get(partition)
+        if bag is None:
+            return None
+        return bag.draw()
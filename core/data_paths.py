@@ -10,6 +10,9 @@ SPOTIFY_TOKEN_FILE = DATA_DIR / "sp_token"
 TELEGRAM_SESSION_FILE = DATA_DIR / "Stitch.session"
 USERBOT_SESSION_FILE = DATA_DIR / "userbot.session"
 WEATHER_CACHE_FILE = DATA_DIR / "last_weather_fetch.txt"
+WEATHER_HISTORY_DIR = DATA_DIR / "weather_history"
+SENSOR_HISTORY_DIR = DATA_DIR / "sensor_history"
+DATABASE_FILE = DATA_DIR / "stitch.db"
 
 EMOJI_FILES = {
     "default": DATA_DIR / "default_emojis.json",
@@ -1,11 +1,11 @@
-import json
-import random
 from pathlib import Path
 from datetime import date
 
 from .config import TG_DEFAULT_EMOJI
-from .data_paths import EMOJI_FILES, ensure_data_dir
+from .content_store import ContentPool
+from .data_paths import EMOJI_FILES
 from .enums import EmojiKind
+from .storage import OP_ADD, OP_DELETE, OP_EDIT, get_list_store
 
 EMOJI_FILE_BY_KIND = {
     EmojiKind.DEFAULT: EMOJI_FILES["default"],
@@ -14,6 +14,11 @@ EMOJI_FILE_BY_KIND = {
     EmojiKind.WALK: EMOJI_FILES["walk"],
 }
 
+EMOJI_STORE_BY_KIND = {
+    kind: get_list_store(f"emojis:{kind.value}", path) for kind, path in EMOJI_FILE_BY_KIND.items()
+}
+EMOJI_POOL_BY_KIND = {kind: ContentPool(store) for kind, store in EMOJI_STORE_BY_KIND.items()}
+
 
 def is_winter(today: date | None = None) -> bool:
     today = today or date.today()
@@ -31,46 +36,49 @@ def get_emoji_file_path(kind: EmojiKind) -> Path:
     return EMOJI_FILE_BY_KIND.get(kind, EMOJI_FILE_BY_KIND[EmojiKind.DEFAULT])
 
 
+def get_emoji_store(kind: EmojiKind):
+    kind = normalize_emoji_kind(kind)
+    return EMOJI_STORE_BY_KIND.get(kind, EMOJI_STORE_BY_KIND[EmojiKind.DEFAULT])
+
+
+def get_emoji_pool(kind: EmojiKind) -> ContentPool:
+    kind = normalize_emoji_kind(kind)
+    return EMOJI_POOL_BY_KIND.get(kind, EMOJI_POOL_BY_KIND[EmojiKind.DEFAULT])
+
+
 def load_emojis(kind: EmojiKind = EmojiKind.DEFAULT):
-    path = get_emoji_file_path(kind)
-    if not path.exists():
-        return []
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return get_emoji_store(kind).load()
 
 
 def save_emojis(emojis, kind: EmojiKind = EmojiKind.DEFAULT):
-    path = get_emoji_file_path(kind)
-    ensure_data_dir()
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(emojis, f, ensure_ascii=False, indent=2)
+    get_emoji_store(kind).save(emojis)
+    get_emoji_pool(kind).replace(emojis)
 
 
 def get_random_emoji(kind: EmojiKind = EmojiKind.DEFAULT):
-    emojis = load_emojis(kind)
-    if not emojis:
+    emoji = get_emoji_pool(kind).sample()
+    if not emoji:
         return TG_DEFAULT_EMOJI
-    return int(random.choice(emojis))
+    return int(emoji)
+
+
+def _apply_emoji_operation(operation: tuple, kind: EmojiKind) -> None:
+    try:
+        get_emoji_pool(kind).apply([operation])
+    except IndexError:
+        return
 
 
 def append_emoji(emoji: str, kind: EmojiKind = EmojiKind.DEFAULT):
-    emojis = load_emojis(kind)
-    emojis.append(emoji)
-    save_emojis(emojis, kind)
+    _apply_emoji_operation((OP_ADD, None, emoji), kind)
 
 
 def update_emoji(index: int, emoji: str, kind: EmojiKind = EmojiKind.DEFAULT):
-    emojis = load_emojis(kind)
-    if 0 <= index < len(emojis):
-        emojis[index] = emoji
-        save_emojis(emojis, kind)
+    _apply_emoji_operation((OP_EDIT, index, emoji), kind)
 
 
 def remove_emoji(index: int, kind: EmojiKind = EmojiKind.DEFAULT):
-    emojis = load_emojis(kind)
-    if 0 <= index < len(emojis):
-        emojis.pop(index)
-        save_emojis(emojis, kind)
+    _apply_emoji_operation((OP_DELETE, index, None), kind)
 
 
 def parse_emoji_kind(kind_str: str) -> EmojiKind:
@@ -1,7 +1,12 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 class EmojiKind(Enum):
     DEFAULT = "default"
     NY = "ny"
     SLEEP = "sleep"
     WALK = "walk"
+
+class StatusPriority(IntEnum):
+    LOW = 0      # random quote / random default emoji
+    NORMAL = 1   # Spotify text, activity and battery emoji
+    HIGH = 2     # game status (Steam, osu!), outage messages
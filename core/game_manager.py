@@ -1,8 +1,318 @@
 import json
+import re
+import time
+import unicodedata
+from collections import Counter
 from typing import List
 
+import numpy as np
+
 from .config import TG_DEFAULT_GAME_EMOJI, PILED_DEFAULT_COLOR
 from .data_paths import GAMES_FILE, ensure_data_dir
+from .storage import OP_ADD, OP_DELETE, OP_EDIT, get_list_store
+
+DEFAULT_GAME_NAME = "default game icon"
+#how often (seconds) lookups are allowed to check the store for external edits
+CATALOG_CHECK_INTERVAL = 2.0
+#minimal Dice similarity over name trigrams for a fuzzy hit to count as a match
+FUZZY_MATCH_THRESHOLD = 0.6
+FUZZY_CACHE_SIZE = 1024
+
+_TRADEMARK_RE = re.compile(r"[\u2122\u00ae\u00a9]|\(tm\)|\(r\)", re.IGNORECASE)
+_NON_ALNUM_RE = re.compile(r"[\W_]+")
+
+
+def normalize_game_name(name: str) -> str:
+    return " ".join(str(name).split()).casefold()
+
+
+def fuzzy_game_key(name: str) -> str:
+    """Fold a display name for fuzzy matching: "Counter-Strike™ 2" -> "counter strike 2"."""
+    name = _TRADEMARK_RE.sub("", str(name))
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(ch for ch in name if not unicodedata.combining(ch))
+    return " ".join(_NON_ALNUM_RE.sub(" ", name.casefold()).split())
+
+
+def name_trigrams(key: str) -> set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class GameCatalog:
+    """In-memory view of the games list with O(1) lookups by steam_id and name.
+
+    The store is read once and only re-read when its signature (file mtime or
+    SQLite revision) changes; the signature itself is checked at most once per
+    ``check_interval`` seconds, so lookups normally never touch the disk.
+    Writers in this module push a new list straight into the catalog via
+    ``replace``; single adds, edits and deletes go through ``apply`` and only
+    re-index the games they touch.
+
+    Names that miss the exact indexes fall through to a trigram index scored
+    with the Dice coefficient; results are memoized per query until the next
+    change.
+    """
+
+    def __init__(self, store, check_interval: float = CATALOG_CHECK_INTERVAL):
+        self.store = store
+        self.check_interval = check_interval
+        self._games: List[dict] = []
+        self._by_steam_id: dict[str, dict] = {}
+        self._by_name: dict[str, dict] = {}
+        self._by_fuzzy_key: dict[str, dict] = {}
+        #how many games share each (index, key), so removing the indexed one knows whether another takes over
+        self._key_counts: Counter = Counter()
+        self._trigrams: dict[str, np.ndarray] = {}
+        #one slot per fuzzy game; removed slots keep a None game and an infinite count until the next rebuild
+        self._trigram_counts = np.zeros(0, dtype=np.float64)
+        self._fuzzy_games: list[dict | None] = []
+        self._fuzzy_slots: dict[str, int] = {}
+        self._fuzzy_cache: dict[tuple, list[tuple[dict, float]]] = {}
+        self._default: dict = self._fallback_default()
+        self._version = None
+        self._last_check = 0.0
+        self._loaded = False
+
+    @staticmethod
+    def _fallback_default() -> dict:
+        return {
+            "name": "Default",
+            "color": PILED_DEFAULT_COLOR,
+            "emoji_id": TG_DEFAULT_GAME_EMOJI,
+        }
+
+    @staticmethod
+    def _index_keys(game: dict) -> list[tuple[str, str]]:
+        """The (index, key) pairs a game is found under: steam_id, name and, except the default, fuzzy."""
+        keys = []
+        steam_id = game.get("steam_id")
+        if steam_id not in (None, ""):
+            keys.append(("steam_id", str(steam_id)))
+        name = game.get("name")
+        if name:
+            normalized = normalize_game_name(name)
+            keys.append(("name", normalized))
+            key = fuzzy_game_key(name)
+            if key and normalized != normalize_game_name(DEFAULT_GAME_NAME):
+                keys.append(("fuzzy", key))
+        return keys
+
+    def _build(self, games: List[dict]) -> None:
+        indexes = {"steam_id": {}, "name": {}, "fuzzy": {}}
+        key_counts = Counter()
+        trigrams: dict[str, list[int]] = {}
+        trigram_counts = []
+        fuzzy_games = []
+        fuzzy_slots = {}
+        for game in games:
+            for kind, key in self._index_keys(game):
+                key_counts[(kind, key)] += 1
+                if key in indexes[kind]:
+                    continue
+                indexes[kind][key] = game
+                if kind != "fuzzy":
+                    continue
+                grams = name_trigrams(key)
+                for gram in grams:
+                    trigrams.setdefault(gram, []).append(len(fuzzy_games))
+                fuzzy_slots[key] = len(fuzzy_games)
+                trigram_counts.append(len(grams))
+                fuzzy_games.append(game)
+
+        #posting lists as int32 arrays so scoring is a single bincount per query
+        postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in trigrams.items()}
+        counts = np.asarray(trigram_counts, dtype=np.float64)
+
+        default = indexes["name"].get(normalize_game_name(DEFAULT_GAME_NAME)) or self._fallback_default()
+        #swap everything at once so readers never see a half-built index
+        (
+            self._games, self._by_steam_id, self._by_name, self._by_fuzzy_key, self._key_counts,
+            self._trigrams, self._trigram_counts, self._fuzzy_games, self._fuzzy_slots, self._fuzzy_cache,
+            self._default,
+        ) = (
+            games, indexes["steam_id"], indexes["name"], indexes["fuzzy"], key_counts,
+            postings, counts, fuzzy_games, fuzzy_slots, {},
+            default,
+        )
+        self._loaded = True
+
+    def _index(self, kind: str) -> dict[str, dict]:
+        return {"steam_id": self._by_steam_id, "name": self._by_name, "fuzzy": self._by_fuzzy_key}[kind]
+
+    def _unindex_game(self, game: dict) -> bool:
+        """Drop ``game`` from the indexes; False if a duplicate key now needs a rebuild to pick its game."""
+        for kind, key in self._index_keys(game):
+            self._key_counts[(kind, key)] -= 1
+            index = self._index(kind)
+            if index.get(key) is not game:
+                continue
+            if self._key_counts[(kind, key)] > 0:
+                return False
+            del self._key_counts[(kind, key)]
+            del index[key]
+            if kind == "fuzzy":
+                slot = self._fuzzy_slots.pop(key)
+                self._fuzzy_games[slot] = None
+                self._trigram_counts[slot] = np.inf
+        return True
+
+    def _index_game(self, game: dict, last: bool) -> bool:
+        """Index ``game``; False if it shares a key with another game and isn't ``last`` in the list."""
+        for kind, key in self._index_keys(game):
+            self._key_counts[(kind, key)] += 1
+            index = self._index(kind)
+            if key in index:
+                #the earlier game keeps the key; only an appended game is known to come after it
+                if last:
+                    continue
+                return False
+            index[key] = game
+            if kind == "fuzzy":
+                slot = len(self._fuzzy_games)
+                grams = name_trigrams(key)
+                for gram in grams:
+                    posting = self._trigrams.get(gram, np.zeros(0, dtype=np.int32))
+                    self._trigrams[gram] = np.append(posting, np.int32(slot))
+                self._trigram_counts = np.append(self._trigram_counts, float(len(grams)))
+                self._fuzzy_games.append(game)
+                self._fuzzy_slots[key] = slot
+        return True
+
+    def reload(self) -> None:
+        self._version = self.store.signature()
+        self._last_check = time.monotonic()
+        self._build(self.store.load())
+
+    def replace(self, games: List[dict]) -> None:
+        """Rebuild indexes from a list that was just written to the store."""
+        self._version = self.store.signature()
+        self._last_check = time.monotonic()
+        self._build(list(games))
+
+    def invalidate(self) -> None:
+        self._loaded = False
+
+    def current(self) -> bool:
+        """Whether the catalog still matches the store, so a write can be mirrored into it."""
+        return self._loaded and self.store.signature() == self._version
+
+    def apply(self, operations: list[tuple]) -> None:
+        """Write core.storage operations to the store and mirror them into the catalog."""
+        current = self.current()
+        self.mirror(self.store.apply(operations), current)
+
+    def mirror(self, changes: list[tuple], current: bool) -> None:
+        """Apply the (index, old, new) changes a store write reported; ``current`` is from before the write."""
+        if not current:
+            self.invalidate()
+            return
+        for index, old, new in changes:
+            if old is None:
+                self._games.append(new)
+                indexed = self._index_game(new, last=True)
+            else:
+                #the indexes hold the cached object, not the copy the store read back
+                old = self._games[index]
+                if new is None:
+                    self._games.pop(index)
+                    indexed = self._unindex_game(old)
+                else:
+                    self._games[index] = new
+                    indexed = self._unindex_game(old) and self._index_game(new, last=index == len(self._games) - 1)
+            if not indexed:
+                self._build(self._games)
+        removed = len(self._fuzzy_games) - len(self._fuzzy_slots)
+        if removed > len(self._fuzzy_games) // 2:
+            self._build(self._games)
+        self._default = self._by_name.get(normalize_game_name(DEFAULT_GAME_NAME)) or self._fallback_default()
+        self._fuzzy_cache = {}
+        self._version = self.store.signature()
+        self._last_check = time.monotonic()
+
+    def _ensure_fresh(self) -> None:
+        if not self._loaded:
+            self.reload()
+            return
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        if self.store.signature() != self._version:
+            self.reload()
+
+    @property
+    def games(self) -> List[dict]:
+        self._ensure_fresh()
+        return self._games
+
+    @property
+    def default(self) -> dict:
+        self._ensure_fresh()
+        return self._default
+
+    def find_exact(self, query: str) -> dict | None:
+        self._ensure_fresh()
+        if query is None:
+            return None
+        game = self._by_steam_id.get(str(query))
+        if game is None:
+            game = self._by_name.get(normalize_game_name(query))
+        return game
+
+    def match(self, query: str, limit: int = 1, threshold: float = FUZZY_MATCH_THRESHOLD) -> list[tuple[dict, float]]:
+        """Return up to ``limit`` (game, score) pairs scoring at least ``threshold``, best first."""
+        self._ensure_fresh()
+        key = fuzzy_game_key(query or "")
+        if not key or limit < 1:
+            return []
+
+        cache_key = (key, limit, threshold)
+        cached = self._fuzzy_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        exact = self._by_fuzzy_key.get(key)
+        if exact is not None and limit == 1:
+            result = [(exact, 1.0)]
+        else:
+            result = self._score(key, limit, threshold)
+
+        if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+            self._fuzzy_cache.clear()
+        self._fuzzy_cache[cache_key] = result
+        return result
+
+    def _score(self, key: str, limit: int, threshold: float) -> list[tuple[dict, float]]:
+        grams = name_trigrams(key)
+        postings = [self._trigrams[gram] for gram in grams if gram in self._trigrams]
+        if not postings:
+            return []
+
+        counts = self._trigram_counts
+        shared = np.bincount(np.concatenate(postings), minlength=len(counts))
+        scores = 2.0 * shared / (len(grams) + counts)
+        hits = np.flatnonzero((scores >= threshold) & np.isfinite(counts))
+        if len(hits) > limit:
+            hits = hits[np.argpartition(-scores[hits], limit - 1)[:limit]]
+        best = sorted(hits.tolist(), key=lambda idx: (-scores[idx], idx))
+        return [(self._fuzzy_games[idx], round(float(scores[idx]), 4)) for idx in best]
+
+    def find(self, query: str) -> dict | None:
+        game = self.find_exact(query)
+        if game is None:
+            matches = self.match(query)
+            if matches:
+                game = matches[0][0]
+        return game
+
+    def __len__(self) -> int:
+        self._ensure_fresh()
+        return len(self._games)
+
+
+games_store = get_list_store("games", GAMES_FILE)
+game_catalog = GameCatalog(games_store)
 
 
 def ensure_data_file():
@@ -13,52 +323,27 @@ def ensure_data_file():
 
 
 def load_games() -> List[dict]:
-    ensure_data_file()
-    with open(GAMES_FILE, "r") as f:
-        return json.load(f)
+    if games_store.backend == "json":
+        ensure_data_file()
+    return games_store.load()
 
 
 def save_games(games: List[dict]) -> None:
-    ensure_data_dir()
-    with open(GAMES_FILE, "w") as f:
-        json.dump(games, f, indent=2)
+    games_store.save(games)
+    game_catalog.replace(games)
 
 
 def append_game(game: dict) -> None:
-    games = load_games()
-    games.append(game)
-    save_games(games)
+    game_catalog.apply([(OP_ADD, None, game)])
 
 
 def update_game(index: int, game: dict) -> None:
-    games = load_games()
-    if index < 0 or index >= len(games):
-        raise IndexError("Game index out of range")
-    games[index] = game
-    save_games(games)
+    game_catalog.apply([(OP_EDIT, index, game)])
 
 
 def remove_game(index: int) -> None:
-    games = load_games()
-    if index < 0 or index >= len(games):
-        raise IndexError("Game index out of range")
-    games.pop(index)
-    save_games(games)
-
-
-def find_game_by_query(query: str) -> dict | None:
-    games = load_games()
-
-    for game in games:
-        if game.get("steam_id") == query or game.get("name") == query:
-            return game
+    game_catalog.apply([(OP_DELETE, index, None)])
 
-    for game in games:
-        if game.get("name") == "default game icon":
-            return game
 
-    return {
-        "game": "Default",
-        "color": PILED_DEFAULT_COLOR,
-        "emoji": TG_DEFAULT_GAME_EMOJI
-    }
+def find_game_by_query(query: str) -> dict:
+    return game_catalog.find(query) or game_catalog.default
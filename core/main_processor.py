@@ -2,12 +2,12 @@ from typing import Optional
 import asyncio
 import httpx
 
-from .config import TG_IS_PREMIUM, HOSTNAME, TG_DEFAULT_EMOJI, TG_CYCLING_EMOJI, TG_LOWBATTERY_EMOJI
+from .config import TG_BIO_LIMIT, HOSTNAME, TG_DEFAULT_EMOJI, TG_CYCLING_EMOJI, TG_LOWBATTERY_EMOJI
 from .telegram import TelegramAPI
 from .piled import send_color_request, set_default_color
-from .game_manager import find_game_by_query
+from .game_manager import find_game_by_query, game_catalog
 from .logger import get_logger
-from .enums import EmojiKind
+from .enums import EmojiKind, StatusPriority
 from .emoji_manager import get_random_emoji
 
 logger = get_logger("MainProcessor")
@@ -18,7 +18,7 @@ class MainProcessor:
         self.current_spotify_song = None
         self.is_playing_game = False
         self.is_playing_osu = False
-        self.bio_limit = 140 if TG_IS_PREMIUM else 70
+        self.bio_limit = TG_BIO_LIMIT
         self.wearos_activity = None
         self.phone_activity = None
         self.phone_low = False
@@ -31,7 +31,7 @@ class MainProcessor:
         #from any game state to default
         if self.current_spotify_song:
             logger.debug("Setting Spotify song status")
-            await TelegramAPI.set_status_text(self.current_spotify_song)
+            await TelegramAPI.set_status_text(self.current_spotify_song, StatusPriority.NORMAL)
         else:
             logger.debug("Setting default TG status")
             await TelegramAPI.set_default_status()
@@ -74,12 +74,12 @@ class MainProcessor:
     async def set_current_color(self):
         if not self.is_someone_at_room:
              logger.debug("No one at room, turning off lights")
-             send_color_request(0, 0, 0)
+             await send_color_request(0, 0, 0)
              return
 
         if self.wearos_activity == "SLEEPING" or self.phone_activity == "SLEEPING":
             logger.debug("User is sleeping, turning off lights")
-            send_color_request(0, 0, 0)
+            await send_color_request(0, 0, 0)
             return
 
         if self.is_playing_game or self.is_playing_osu:
@@ -93,18 +93,18 @@ class MainProcessor:
                 r = int(r * 0.1)
                 g = int(g * 0.1)
                 b = int(b * 0.1)
-            send_color_request(r, g, b)
+            await send_color_request(r, g, b)
             return
 
         if not self.pc_on:
-            send_color_request(0, 0, 0)
+            await send_color_request(0, 0, 0)
             return
 
         #TODO: spotify song color
         if self.current_spotify_song:
             return
 
-        set_default_color()
+        await set_default_color()
 
     async def handle_spotify_update(self, song: str, artist: str, is_playing: bool, is_local: bool, is_stopped: bool = False):
         """Called by the Spotify API module on new song/event."""
@@ -139,11 +139,11 @@ class MainProcessor:
 
         self.current_spotify_song = status
         logger.debug(f"Sending status to TG: {status}")
-        await TelegramAPI.set_status_text(status)
+        await TelegramAPI.set_status_text(status, StatusPriority.NORMAL)
 
 
-    async def handle_steam_update(self, game_name: str, is_playing_game: bool):
-        """Called by the Steam API module."""
+    async def handle_steam_update(self, game_name: str, is_playing_game: bool, game_id: str | None = None):
+        """Called by the Steam API module. ``game_id`` is the Steam app id when the backend knows it."""
         logger.debug(f"Steam update called")
         self.is_playing_game = is_playing_game
 
@@ -151,12 +151,16 @@ class MainProcessor:
             return
 
         if is_playing_game:
-            await TelegramAPI.set_status_text("🎮: " + game_name)
-
-            game = find_game_by_query(game_name)
-            emoji_id = game["emoji_id"] if game else find_game_by_query("default game icon")["emoji_id"]
+            game = game_catalog.find_exact(game_id) if game_id else None
+            if game is None:
+                game = find_game_by_query(game_name)
+            elif not game_name:
+                game_name = game["name"]
+            await TelegramAPI.set_status_text("🎮: " + game_name, StatusPriority.HIGH)
+
+            emoji_id = game["emoji_id"]
             logger.debug(f"Emoji_id: {emoji_id}")
-            await TelegramAPI.set_status_emoji(emoji_id)
+            await TelegramAPI.set_status_emoji(emoji_id, StatusPriority.HIGH)
             self.game_color = game["color"]
             logger.debug(f"Game: {game}, emoji: {emoji_id}, color: {self.game_color}")
             await self.set_current_color()
@@ -188,16 +192,16 @@ class MainProcessor:
             self.game_color = None
             await self.set_default_status()
             await self.set_current_emoji()
-            set_default_color()
+            await set_default_color()
             return
         else:
             gameBio = f"🎮osu!: Chilling in main menu"
-        await TelegramAPI.set_status_text(gameBio)
+        await TelegramAPI.set_status_text(gameBio, StatusPriority.HIGH)
         if not self.is_playing_osu:
             self.is_playing_osu = True
             game = find_game_by_query("osu")
-            emoji_id = game["emoji_id"] if game else find_game_by_query("default game icon")["emoji_id"]
-            await TelegramAPI.set_status_emoji(emoji_id)
+            emoji_id = game["emoji_id"]
+            await TelegramAPI.set_status_emoji(emoji_id, StatusPriority.HIGH)
             self.game_color = game["color"]
             await self.set_current_color()
 
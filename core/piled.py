@@ -1,90 +1,338 @@
+import asyncio
 import hmac
 import hashlib
 import random
-import socket
-from time import time
+from time import time, monotonic
 import struct
-import threading
 
-from core.config import PILED_SHARED_SECRET, PILED_ADDRESS, PILED_DEFAULT_COLOR
+from core.config import (
+    PILED_SHARED_SECRET,
+    PILED_ADDRESS,
+    PILED_DEFAULT_COLOR,
+    PILED_KEEPALIVE,
+    PILED_CONNECT_TIMEOUT,
+    PILED_READ_TIMEOUT,
+    PILED_MIN_INTERVAL,
+    PILED_SHADOW_MAX_AGE,
+)
 from .logger import get_logger
 
 logger = get_logger("PiLED-back")
 
-def hmac_sha256(secret, data):
-    secret_key = bytes(secret, "utf-8")
-    return hmac.new(secret_key, data, hashlib.sha256).digest()
-
-
-def send_tcp_packet(host, port, data):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((host, port))
-            sock.sendall(data)
-            logger.debug(f"Data sent to {host}:{port}")
-    except Exception as e:
-        logger.debug(f"An error occurred: {e}")
-
-
-def send_color_request(red, green, blue, duration = 3, steps = 150):
-    logger.debug(f"Send color request called with: {red}, {green}, {blue}")
-    current_timestamp = int(time())
-    nonce = random.getrandbits(64)
-    timestamp_bytes = struct.pack(">Q", current_timestamp)
-    nonce_bytes = struct.pack(">Q", nonce)
-    version = 2
-    HEADER = timestamp_bytes + nonce_bytes + struct.pack(">B", version)
-    PAYLOAD = bytes([red, green, blue, duration])
-    header_with_payload = HEADER + PAYLOAD
-    hex_string = " ".join(f"{b:02X}" for b in header_with_payload)
-    hmac_result = hmac_sha256(PILED_SHARED_SECRET, header_with_payload)
-    hex_string = "".join(f"{b:02X}" for b in hmac_result)
-    tcp_package = HEADER + hmac_result + PAYLOAD
-    thread = threading.Thread(target=send_tcp_packet, args=(PILED_ADDRESS, 3384, tcp_package), daemon=True)
-    thread.start()
-
-def get_current_color():
-    logger.debug("Get current color called")
-    current_timestamp = int(time())
-    nonce = random.getrandbits(64)
-    timestamp_bytes = struct.pack(">Q", current_timestamp)
-    nonce_bytes = struct.pack(">Q", nonce)
-    version = 4
-    OP = 1  # LED_GET_CURRENT_COLOR
-    HEADER = timestamp_bytes + nonce_bytes + struct.pack(">B", version) + struct.pack(">B", OP)
-
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((PILED_ADDRESS, 3384))
-            sock.sendall(HEADER)
-            logger.debug(f"Data sent to {PILED_ADDRESS}:3384")
-            response = sock.recv(1024)
+PILED_PORT = 3384
+VERSION_SET_COLOR = 2
+VERSION_OP = 4
+OP_GET_CURRENT_COLOR = 1
+#get-current-color replies are at least this long; the color sits in the last three bytes
+COLOR_RESPONSE_LENGTH = 0x35
+#shared_state keys, see api/piled.py: followers hand colors and the default to the leader, the leader reports its shadow
+PILED_COLOR_KEY = "piled.color"
+PILED_DEFAULT_KEY = "piled.default"
+PILED_SHADOW_KEY = "piled.shadow"
+
+
+class PiLEDClient:
+    """asyncio client for the PiLED controller.
+
+    The HMAC key schedule for the shared secret is computed once and copied
+    per packet. Set-color packets are written under a lock so fades go out
+    one at a time and in order; with ``keepalive`` the connection is kept
+    and reused, reconnecting once if the controller closed it meanwhile.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = PILED_PORT,
+        secret: str = PILED_SHARED_SECRET,
+        keepalive: bool = PILED_KEEPALIVE,
+        connect_timeout: float = PILED_CONNECT_TIMEOUT,
+        read_timeout: float = PILED_READ_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._mac = hmac.new(bytes(secret, "utf-8"), digestmod=hashlib.sha256)
+        self._send_lock = asyncio.Lock()
+        self._writer: asyncio.StreamWriter | None = None
+
+    def sign(self, data: bytes) -> bytes:
+        mac = self._mac.copy()
+        mac.update(data)
+        return mac.digest()
+
+    @staticmethod
+    def _header(version: int) -> bytes:
+        return struct.pack(">QQB", int(time()), random.getrandbits(64), version)
+
+    def build_color_packet(self, red: int, green: int, blue: int, duration: int = 3) -> bytes:
+        header = self._header(VERSION_SET_COLOR)
+        payload = bytes([red, green, blue, duration])
+        return header + self.sign(header + payload) + payload
+
+    def build_get_color_packet(self) -> bytes:
+        return self._header(VERSION_OP) + struct.pack(">B", OP_GET_CURRENT_COLOR)
+
+    async def _open(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.connect_timeout)
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter | None) -> None:
+        if writer is None:
+            return
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), 1.0)
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+    async def send_packet(self, packet: bytes) -> bool:
+        async with self._send_lock:
+            for attempt in range(2):
+                reused = self._writer is not None
+                try:
+                    if self._writer is None:
+                        _, self._writer = await self._open()
+                    self._writer.write(packet)
+                    await asyncio.wait_for(self._writer.drain(), self.read_timeout)
+                    logger.debug(f"Data sent to {self.host}:{self.port}")
+                    if not self.keepalive:
+                        writer, self._writer = self._writer, None
+                        await self._close(writer)
+                    return True
+                except (OSError, asyncio.TimeoutError) as e:
+                    writer, self._writer = self._writer, None
+                    await self._close(writer)
+                    if reused and attempt == 0:
+                        logger.debug(f"Kept-alive PiLED connection went stale ({e!r}), reconnecting")
+                        continue
+                    logger.debug(f"An error occurred: {e!r}")
+                    return False
+        return False
+
+    async def send_color(self, red: int, green: int, blue: int, duration: int = 3, steps: int = 150) -> bool:
+        logger.debug(f"Send color request called with: {red}, {green}, {blue}")
+        return await self.send_packet(self.build_color_packet(red, green, blue, duration))
+
+    async def get_current_color(self) -> dict:
+        logger.debug("Get current color called")
+        writer = None
+        try:
+            reader, writer = await self._open()
+            writer.write(self.build_get_color_packet())
+            await asyncio.wait_for(writer.drain(), self.read_timeout)
+            logger.debug(f"Data sent to {self.host}:{self.port}")
+            response = await asyncio.wait_for(reader.readexactly(COLOR_RESPONSE_LENGTH), self.read_timeout)
             logger.debug(f"Received response: {response.hex()}")
+        except asyncio.IncompleteReadError:
+            return {"status": "error", "reason": "Incomplete response"}
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out talking to PiLED at {self.host}:{self.port}")
+            return {"status": "error", "reason": "timeout"}
+        except Exception as e:
+            logger.error(f"An error occurred: {e}")
+            return {"status": "error", "reason": str(e)}
+        finally:
+            await self._close(writer)
+
+        red = response[0x32]
+        green = response[0x33]
+        blue = response[0x34]
+        return {
+            "status": "ok",
+            "color": f"{red:02x}{green:02x}{blue:02x}",
+            "red": red,
+            "green": green,
+            "blue": blue
+        }
+
+
+class ColorShadow:
+    """Last known color of the device, kept so reads don't have to ask it.
+
+    Recorded whenever ColorCommandQueue gets a color out (the fade target) and
+    whenever the device is queried. ``get`` answers from memory while the
+    value is younger than ``max_age``; otherwise, or with ``refresh``, it asks
+    the device, and concurrent callers share that one query.
+    """
+
+    def __init__(self, client: PiLEDClient, max_age: float = PILED_SHADOW_MAX_AGE):
+        self.client = client
+        self.max_age = max_age
+        self.color: tuple[int, int, int] | None = None
+        self.source: str | None = None
+        self.updated_at = 0.0
+        #called with the color the device reported, see ColorCommandQueue.observe
+        self.on_refresh = None
+        #called with (color, source) on every record and (None, None) on invalidate
+        self.on_change = None
+        self._stale = True
+        self._refresh_task: asyncio.Task | None = None
+        self.stats = {"hits": 0, "refreshes": 0, "shared": 0, "refresh_failures": 0}
+
+    def record(self, color: tuple[int, int, int], source: str = "sent", age: float = 0.0) -> None:
+        self.color = color
+        self.source = source
+        self.updated_at = monotonic() - age
+        self._stale = False
+        if self.on_change is not None:
+            self.on_change(color, source)
+
+    def invalidate(self) -> None:
+        """Force the next read to ask the device (e.g. after a failed send)."""
+        self._stale = True
+        if self.on_change is not None:
+            self.on_change(None, None)
+
+    @property
+    def age(self) -> float | None:
+        return monotonic() - self.updated_at if self.color is not None else None
+
+    def _response(self, **extra) -> dict:
+        red, green, blue = self.color
+        return {
+            "status": "ok",
+            "color": f"{red:02x}{green:02x}{blue:02x}",
+            "red": red,
+            "green": green,
+            "blue": blue,
+            "age": round(self.age, 3),
+            "source": self.source,
+            **extra,
+        }
 
-            if len(response) >= 0x35:
-                red = response[0x32]
-                green = response[0x33]
-                blue = response[0x34]
-                color = f"{red:02x}{green:02x}{blue:02x}"
+    async def _refresh(self) -> dict:
+        self.stats["refreshes"] += 1
+        started = monotonic()
+        result = await self.client.get_current_color()
+        if result["status"] != "ok":
+            self.stats["refresh_failures"] += 1
+            return result
+        #a send that finished while we were asking is newer than the device's answer
+        if self.updated_at <= started or self._stale:
+            color = (result["red"], result["green"], result["blue"])
+            self.record(color, "device")
+            if self.on_refresh is not None:
+                self.on_refresh(color)
+        return result
 
-                return {
-                    "status": "ok",
-                    "color": color,
-                    "red": red,
-                    "green": green,
-                    "blue": blue
-                }
+    async def get(self, refresh: bool = False) -> dict:
+        if not refresh and not self._stale and self.color is not None and self.age < self.max_age:
+            self.stats["hits"] += 1
+            return self._response()
 
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+        else:
+            self.stats["shared"] += 1
+        result = await asyncio.shield(self._refresh_task)
+
+        if result["status"] == "ok":
+            return self._response()
+        if self.color is not None:
+            logger.warning(f"PiLED color refresh failed ({result.get('reason')}), serving the shadow copy")
+            return self._response(stale=True, reason=result.get("reason"))
+        return result
+
+
+class ColorCommandQueue:
+    """Latest-wins command slot for one PiLED device.
+
+    ``submit`` returns immediately. At most one command waits to be sent and
+    a newer one replaces it; a color equal to what the device was last sent
+    (or is being sent) is dropped. The worker sends one fade at a time and
+    waits for it to finish (``duration`` seconds, at least ``min_interval``)
+    before the next, so fades never overlap or arrive out of order.
+    """
+
+    def __init__(self, client: PiLEDClient, min_interval: float = PILED_MIN_INTERVAL, shadow: ColorShadow | None = None):
+        self.client = client
+        self.min_interval = min_interval
+        self.shadow = shadow
+        self.last_sent: tuple[int, int, int] | None = None
+        self._in_flight: tuple[int, int, int] | None = None
+        self._pending: tuple | None = None
+        self._next_allowed = 0.0
+        self._task: asyncio.Task | None = None
+        self.stats = {"submitted": 0, "duplicates": 0, "replaced": 0, "sent": 0, "failed": 0}
+
+    def submit(self, red: int, green: int, blue: int, duration: int = 3, steps: int = 150, force: bool = False) -> bool:
+        """Queue a color; returns False if it was dropped as a duplicate."""
+        self.stats["submitted"] += 1
+        color = (red, green, blue)
+        if self._pending is not None:
+            self.stats["replaced"] += 1
+            self._pending = None
+
+        current = self._in_flight if self._in_flight is not None else self.last_sent
+        if color == current and not force:
+            self.stats["duplicates"] += 1
+            logger.debug(f"Color {color} already sent, dropping")
+            return False
+
+        self._pending = (red, green, blue, duration, steps)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return True
+
+    def observe(self, color: tuple[int, int, int]) -> None:
+        """Adopt a color read from the device as ``last_sent`` while nothing is queued."""
+        if self._in_flight is None and self._pending is None:
+            self.last_sent = color
+
+    async def _run(self) -> None:
+        while self._pending is not None:
+            delay = self._next_allowed - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            command, self._pending = self._pending, None
+            red, green, blue, duration, steps = command
+            self._in_flight = (red, green, blue)
+            try:
+                ok = await self.client.send_color(red, green, blue, duration, steps)
+            finally:
+                self._in_flight = None
+
+            if ok:
+                self.stats["sent"] += 1
+                self.last_sent = (red, green, blue)
+                if self.shadow is not None:
+                    self.shadow.record(self.last_sent)
+                self._next_allowed = monotonic() + max(self.min_interval, duration)
             else:
-                return {"status": "error", "reason": "Incomplete response"}
+                #the device state is unknown now, so don't drop the next command as a duplicate
+                self.stats["failed"] += 1
+                self.last_sent = None
+                if self.shadow is not None:
+                    self.shadow.invalidate()
+                self._next_allowed = monotonic() + self.min_interval
+
+    async def drain(self) -> None:
+        """Wait until every queued command has been sent."""
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+
+piled_client = PiLEDClient(PILED_ADDRESS)
+color_shadow = ColorShadow(piled_client)
+color_queue = ColorCommandQueue(piled_client, shadow=color_shadow)
+color_shadow.on_refresh = color_queue.observe
+
 
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
-        return {"status": "error", "reason": str(e)}
+async def send_color_request(red, green, blue, duration = 3, steps = 150):
+    return color_queue.submit(red, green, blue, duration, steps)
+
+
+async def get_current_color(refresh: bool = False):
+    return await color_shadow.get(refresh)
 
 CURRENT_DEFAULT_COLOR = PILED_DEFAULT_COLOR
 
-def set_default_color():
+async def set_default_color():
     logger.debug(f"Set default color called. Current default: {CURRENT_DEFAULT_COLOR}")
     color = CURRENT_DEFAULT_COLOR
     if color.startswith("#"):
@@ -93,13 +341,16 @@ def set_default_color():
     r = int(color[0:2], 16)
     g = int(color[2:4], 16)
     b = int(color[4:6], 16)
-    send_color_request(r, g, b, 3, 50)
+    await send_color_request(r, g, b, 3, 50)
 
-def update_default_color(new_color: str):
+def store_default_color(new_color: str):
     global CURRENT_DEFAULT_COLOR
-    logger.debug(f"Updating default color to: {new_color}")
     CURRENT_DEFAULT_COLOR = new_color
-    set_default_color()
+
+async def update_default_color(new_color: str):
+    logger.debug(f"Updating default color to: {new_color}")
+    store_default_color(new_color)
+    await set_default_color()
 
 def get_default_color():
-    return CURRENT_DEFAULT_COLOR
\ No newline at end of file
+    return CURRENT_DEFAULT_COLOR
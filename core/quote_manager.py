@@ -1,45 +1,56 @@
-import json
 import random
 
 from .config import TG_DEFAULT_STATUS
-from .data_paths import QUOTES_FILE, ensure_data_dir
+from .content_store import ContentPool
+from .data_paths import QUOTES_FILE
+from .storage import OP_ADD, OP_DELETE, OP_EDIT, get_list_store
 
+#Telegram bio length limits for regular and premium accounts
+BIO_LIMITS = (70, 140)
 
-def load_quotes():
-    if not QUOTES_FILE.exists():
-        return []
-    with open(QUOTES_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+quote_store = get_list_store("quotes", QUOTES_FILE)
+quote_pool = ContentPool(
+    quote_store,
+    partitions={limit: (lambda quote, limit=limit: len(quote) <= limit) for limit in BIO_LIMITS},
+)
 
 
-def save_quotes(quotes):
-    ensure_data_dir()
-    with open(QUOTES_FILE, "w", encoding="utf-8") as f:
-        json.dump(quotes, f, ensure_ascii=False, indent=2)
+def load_quotes():
+    return quote_store.load()
 
 
-def get_random_quote():
-    quotes = load_quotes()
-    if not quotes:
+def save_quotes(quotes):
+    quote_store.save(quotes)
+    quote_pool.replace(quotes)
+
+
+def get_random_quote(max_length: int | None = None):
+    """Next quote from the shuffle bag; with ``max_length`` only quotes that fit it are drawn."""
+    if max_length is None:
+        quote = quote_pool.sample()
+    elif max_length in BIO_LIMITS:
+        quote = quote_pool.sample(max_length)
+    else:
+        fitting = [q for q in quote_pool.items if len(q) <= max_length]
+        quote = random.choice(fitting) if fitting else None
+    if not quote:
         return TG_DEFAULT_STATUS
-    return random.choice(quotes)
+    return quote
 
 
 def append_quote(quote: str):
-    quotes = load_quotes()
-    quotes.append(quote)
-    save_quotes(quotes)
+    quote_pool.apply([(OP_ADD, None, quote)])
 
 
 def remove_quote(index: int):
-    quotes = load_quotes()
-    if 0 <= index < len(quotes):
-        quotes.pop(index)
-        save_quotes(quotes)
+    try:
+        quote_pool.apply([(OP_DELETE, index, None)])
+    except IndexError:
+        return
 
 
 def update_quote(index: int, quote: str):
-    quotes = load_quotes()
-    if 0 <= index < len(quotes):
-        quotes[index] = quote
-        save_quotes(quotes)
+    try:
+        quote_pool.apply([(OP_EDIT, index, quote)])
+    except IndexError:
+        return
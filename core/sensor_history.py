@@ -0,0 +1,341 @@
+import fcntl
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .config import SENSOR_HISTORY_SAMPLES, SENSOR_HISTORY_MINUTES, SENSOR_HISTORY_MAX_POINTS
+from .data_paths import SENSOR_HISTORY_DIR
+from .logger import get_logger
+
+logger = get_logger("SensorHistory")
+
+FIELDS = ("temperature", "pressure", "humidity", "co2")
+
+#missing readings are stored as NaN
+SAMPLE_DTYPE = np.dtype([("ts", "<f8")] + [(field, "<f4") for field in FIELDS])
+
+#sums and counts rather than means so the open minute can be extended in place
+MINUTE_DTYPE = np.dtype([("ts", "<i8")] + [
+    (f"{field}_{part}", kind)
+    for field in FIELDS
+    for part, kind in (("min", "<f4"), ("max", "<f4"), ("sum", "<f8"), ("n", "<u4"))
+])
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("itemsize", "<u4"),
+    ("capacity", "<u8"),
+    ("head", "<u8"),
+    ("count", "<u8"),
+])
+MAGIC = b"SRB1"
+
+RESOLUTIONS = ("raw", "minute")
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+class RingFile:
+    """Fixed-capacity ring of numpy records in a memory-mapped file.
+
+    A 32-byte header (capacity, head, count) precedes the records, so the
+    file never grows and the ring picks up where it was after a restart.
+    Records are expected in ``ts`` order; the two halves of the ring are
+    each sorted, so a time range is a binary search on each.
+    """
+
+    def __init__(self, path: Path, dtype: np.dtype, capacity: int):
+        self.path = path
+        self.dtype = dtype
+        size = HEADER_DTYPE.itemsize + dtype.itemsize * capacity
+        if path.exists() and not self._matches(path, dtype, capacity, size):
+            logger.warning(f"{path} has a different layout or capacity, starting it over")
+            path.unlink()
+        if not path.exists():
+            with open(path, "wb") as f:
+                f.truncate(size)
+            header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+            header[0] = (MAGIC, dtype.itemsize, capacity, 0, 0)
+            header.flush()
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self.data = np.memmap(path, dtype=dtype, mode="r+", offset=HEADER_DTYPE.itemsize, shape=(capacity,))
+        self.capacity = capacity
+
+    @staticmethod
+    def _matches(path: Path, dtype: np.dtype, capacity: int, size: int) -> bool:
+        if path.stat().st_size != size:
+            return False
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+        return header["magic"] == MAGIC and header["itemsize"] == dtype.itemsize and header["capacity"] == capacity
+
+    @property
+    def head(self) -> int:
+        return int(self.header[0]["head"])
+
+    def __len__(self) -> int:
+        return int(self.header[0]["count"])
+
+    def last(self):
+        if not len(self):
+            return None
+        return self.data[(self.head - 1) % self.capacity]
+
+    def append(self, record: np.ndarray) -> None:
+        head = self.head
+        self.data[head] = record
+        self.header[0]["head"] = (head + 1) % self.capacity
+        self.header[0]["count"] = min(len(self) + 1, self.capacity)
+
+    def replace_last(self, record: np.ndarray) -> None:
+        self.data[(self.head - 1) % self.capacity] = record
+
+    def segments(self) -> list[np.ndarray]:
+        """The stored records, oldest first, as at most two views."""
+        count = len(self)
+        if count < self.capacity:
+            return [self.data[:count]]
+        head = self.head
+        return [self.data[head:], self.data[:head]]
+
+    def oldest_ts(self) -> float | None:
+        segments = [segment for segment in self.segments() if len(segment)]
+        return float(segments[0]["ts"][0]) if segments else None
+
+    def count_between(self, start: float, end: float) -> int:
+        return sum(
+            int(np.searchsorted(segment["ts"], end, side="right") - np.searchsorted(segment["ts"], start, side="left"))
+            for segment in self.segments()
+        )
+
+    def between(self, start: float, end: float) -> np.ndarray:
+        parts = []
+        for segment in self.segments():
+            ts = segment["ts"]
+            lo = np.searchsorted(ts, start, side="left")
+            hi = np.searchsorted(ts, end, side="right")
+            if hi > lo:
+                parts.append(segment[lo:hi])
+        if not parts:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(parts)
+
+    def flush(self) -> None:
+        self.data.flush()
+        self.header.flush()
+
+
+def _nullable(values: np.ndarray, digits: int = 2) -> list:
+    return [None if value != value else round(value, digits) for value in values.tolist()]
+
+
+class SensorHistory:
+    """Bounded sensor history: every sample in one ring, per-minute rollups in another.
+
+    Both rings are fixed-size memory-mapped files under ``directory``, so
+    memory and disk use don't grow however long the process runs, and the
+    history survives restarts. Queries are vectorized over the columns of
+    the window they touch. The raw ring holds the recent past at full
+    resolution; the minute ring holds a longer span, and windows older than
+    the raw ring are answered from it.
+
+    The maps are shared, so several worker processes can append and query
+    the same files; an flock on ``.lock`` keeps appends whole.
+    """
+
+    def __init__(
+        self,
+        directory: Path = SENSOR_HISTORY_DIR,
+        samples: int = SENSOR_HISTORY_SAMPLES,
+        minutes: int = SENSOR_HISTORY_MINUTES,
+        max_points: int = SENSOR_HISTORY_MAX_POINTS,
+    ):
+        self.directory = directory
+        self.sample_capacity = samples
+        self.minute_capacity = minutes
+        self.max_points = max_points
+        self._rings: tuple[RingFile, RingFile] | None = None
+        self._lock_file = None
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        if self._lock_file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._lock_file = open(self.directory / ".lock", "a")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    @property
+    def rings(self) -> tuple[RingFile, RingFile]:
+        if self._rings is None:
+            with self._locked(exclusive=True):
+                self._rings = (
+                    RingFile(self.directory / "samples.ring", SAMPLE_DTYPE, self.sample_capacity),
+                    RingFile(self.directory / "minutes.ring", MINUTE_DTYPE, self.minute_capacity),
+                )
+        return self._rings
+
+    def append(self, reading: dict, ts: float | None = None) -> bool:
+        """Record the sensor state at ``ts`` (unix seconds); False if it isn't newer than the last sample or not finite."""
+        sample = np.zeros(1, dtype=SAMPLE_DTYPE)
+        for field in FIELDS:
+            value = reading.get(field)
+            try:
+                sample[field] = np.nan if value is None else float(value)
+            except (TypeError, ValueError):
+                sample[field] = np.nan
+
+        samples, minutes = self.rings
+        with self._locked(exclusive=True):
+            #stamped under the lock, so appends from several workers stay in order
+            ts = time.time() if ts is None else float(ts)
+            sample["ts"] = ts
+            last = samples.last()
+            #one sample per timestamp, so a batch posted again doesn't repeat its newest reading
+            if not np.isfinite(ts) or (last is not None and ts <= last["ts"]):
+                return False
+            samples.append(sample)
+            self._roll_up(minutes, sample[0])
+        return True
+
+    @staticmethod
+    def _roll_up(minutes: RingFile, sample) -> None:
+        minute = int(sample["ts"] // 60 * 60)
+        last = minutes.last()
+        if last is not None and int(last["ts"]) == minute:
+            bucket = np.array(last, dtype=MINUTE_DTYPE)
+            extend = True
+        else:
+            bucket = np.zeros((), dtype=MINUTE_DTYPE)
+            bucket["ts"] = minute
+            extend = False
+        for field in FIELDS:
+            value = sample[field]
+            if np.isnan(value):
+                continue
+            if bucket[f"{field}_n"]:
+                bucket[f"{field}_min"] = min(bucket[f"{field}_min"], value)
+                bucket[f"{field}_max"] = max(bucket[f"{field}_max"], value)
+            else:
+                bucket[f"{field}_min"] = bucket[f"{field}_max"] = value
+            bucket[f"{field}_sum"] += value
+            bucket[f"{field}_n"] += 1
+        if extend:
+            minutes.replace_last(bucket)
+        else:
+            minutes.append(bucket)
+
+    def _raw_covers(self, start: float) -> bool:
+        oldest = self.rings[0].oldest_ts()
+        #a ring that hasn't wrapped yet holds everything there is
+        return oldest is not None and (oldest <= start or len(self.rings[0]) < self.sample_capacity)
+
+    def pick_resolution(self, start: float, end: float) -> str:
+        if not self._raw_covers(start):
+            return "minute"
+        return "raw" if self.rings[0].count_between(start, end) <= self.max_points else "minute"
+
+    @staticmethod
+    def _check_window(start: float, end: float) -> None:
+        #a nan or inf bound would end up in the JSON reply, which can't carry it
+        if not (np.isfinite(start) and np.isfinite(end)):
+            raise ValueError(f"from and to must be finite, got {start} and {end}")
+
+    def history(self, start: float, end: float, resolution: str = "auto") -> dict:
+        self._check_window(start, end)
+        #opening the rings locks exclusively, so it can't happen under the shared lock
+        self.rings
+        with self._locked():
+            return self._history(start, end, resolution)
+
+    def _history(self, start: float, end: float, resolution: str) -> dict:
+        if resolution == "auto":
+            resolution = self.pick_resolution(start, end)
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+
+        if resolution == "raw":
+            count = self.rings[0].count_between(start, end)
+            if count > self.max_points:
+                raise ValueError(f"{count} raw samples in this window, more than {self.max_points}; use minute or auto")
+            records = self.rings[0].between(start, end)
+            columns = {field: _nullable(records[field]) for field in FIELDS}
+            points = [
+                {"time": round(ts, 3), **{field: columns[field][i] for field in FIELDS}}
+                for i, ts in enumerate(records["ts"].tolist())
+            ]
+        else:
+            records = self.rings[1].between(start // 60 * 60, end)
+            columns = {}
+            for field in FIELDS:
+                n = records[f"{field}_n"]
+                empty = n == 0
+                columns[f"{field}_min"] = _nullable(np.where(empty, np.nan, records[f"{field}_min"]))
+                columns[f"{field}_max"] = _nullable(np.where(empty, np.nan, records[f"{field}_max"]))
+                columns[f"{field}_avg"] = _nullable(np.where(empty, np.nan, records[f"{field}_sum"] / np.maximum(n, 1)))
+            points = [
+                {"time": ts, **{key: values[i] for key, values in columns.items()}}
+                for i, ts in enumerate(records["ts"].tolist())
+            ]
+        return {"resolution": resolution, "from": start, "to": end, "points": points}
+
+    def stats(self, start: float, end: float, percentiles=DEFAULT_PERCENTILES) -> dict:
+        """min/max/mean/count and percentiles per field over [start, end].
+
+        Exact from the raw samples while the raw ring reaches back to
+        ``start``; otherwise from the minute rollups, where min/max/mean stay
+        exact and percentiles are taken over the per-minute means.
+        """
+        self._check_window(start, end)
+        self.rings
+        with self._locked():
+            return self._stats(start, end, [float(p) for p in percentiles])
+
+    def _stats(self, start: float, end: float, percentiles: list[float]) -> dict:
+        result = {}
+        if self._raw_covers(start):
+            source = "raw"
+            records = self.rings[0].between(start, end)
+            for field in FIELDS:
+                values = records[field][~np.isnan(records[field])].astype(np.float64)
+                result[field] = self._summary(values, values, len(values), percentiles)
+        else:
+            source = "minute"
+            records = self.rings[1].between(start // 60 * 60, end)
+            for field in FIELDS:
+                n = records[f"{field}_n"]
+                present = n > 0
+                means = records[f"{field}_sum"][present] / n[present]
+                summary = self._summary(means, None, int(n.sum()), percentiles)
+                if present.any():
+                    summary["min"] = round(float(records[f"{field}_min"][present].min()), 2)
+                    summary["max"] = round(float(records[f"{field}_max"][present].max()), 2)
+                    summary["mean"] = round(float(records[f"{field}_sum"][present].sum() / n.sum()), 2)
+                result[field] = summary
+        return {"source": source, "from": start, "to": end, "fields": result}
+
+    @staticmethod
+    def _summary(values: np.ndarray, exact: np.ndarray | None, count: int, percentiles: list[float]) -> dict:
+        if not len(values):
+            return {"count": count, "min": None, "max": None, "mean": None, "percentiles": {}}
+        summary = {"count": count}
+        if exact is not None:
+            summary.update(
+                min=round(float(exact.min()), 2),
+                max=round(float(exact.max()), 2),
+                mean=round(float(exact.mean()), 2),
+            )
+        quantiles = np.percentile(values, percentiles) if percentiles else []
+        summary["percentiles"] = {f"p{p:g}": round(float(q), 2) for p, q in zip(percentiles, quantiles)}
+        return summary
+
+    def flush(self) -> None:
+        if self._rings is not None:
+            for ring in self._rings:
+                ring.flush()
+
+
+sensor_history = SensorHistory()
@@ -0,0 +1,292 @@
+"""State shared between gunicorn workers.
+
+A small service owns the shared values and listens on a unix socket;
+every worker keeps a connection to it through ``shared_state``. Run it
+with ``python -m core.shared_state`` (gunicorn.conf.py does that and
+exports STATE_SOCKET to the workers).
+"""
+import asyncio
+import copy
+import inspect
+import json
+import os
+from typing import Any, Awaitable, Callable
+
+from .config import STATE_SOCKET, STATE_RECONNECT_MIN, STATE_RECONNECT_MAX
+from .logger import get_logger
+
+logger = get_logger("SharedState")
+
+#values are whole topic states, far below this, but the default 64 KiB line limit is close enough to matter
+LINE_LIMIT = 16 * 1024 * 1024
+#a connection with this much unsent data isn't reading; it is dropped rather than buffered without bound
+MAX_BUFFERED = 8 * 1024 * 1024
+#lane (and log label) for leadership callbacks; not a key anyone sets
+LEADERSHIP_LANE = "(leadership)"
+
+
+def encode_line(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False).encode() + b"\n"
+
+
+class StateService:
+    """The process every worker connects to.
+
+    Newline-delimited JSON over a unix socket. A worker sends
+    {"op": "set", "key", "value"}; the service stores it and forwards it
+    to every other worker. A new connection first gets
+    {"op": "hello", "values": {...}, "leader": bool}. The oldest
+    connection is the leader, the one worker that runs the pollers and
+    talks to Telegram; when it goes away the next oldest gets
+    {"op": "leader"}.
+    """
+
+    def __init__(self, path: str = STATE_SOCKET):
+        self.path = path
+        self.values: dict[str, Any] = {}
+        #connection order decides the leader
+        self.clients: list[asyncio.StreamWriter] = []
+        self.stats = {"connections": 0, "sets": 0, "forwarded": 0, "dropped": 0}
+
+    async def run(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._handle, path=self.path, limit=LINE_LIMIT)
+        logger.info(f"State service listening on {self.path}")
+        async with server:
+            await server.serve_forever()
+
+    def _send(self, writer: asyncio.StreamWriter, line: bytes) -> None:
+        if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            logger.warning("Dropping a worker that stopped reading state updates")
+            self.stats["dropped"] += 1
+            writer.close()
+            return
+        writer.write(line)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.stats["connections"] += 1
+        self.clients.append(writer)
+        self._send(writer, encode_line({"op": "hello", "values": self.values, "leader": self.clients[0] is writer}))
+        try:
+            while line := await reader.readline():
+                try:
+                    message = json.loads(line)
+                    key = message["key"]
+                except (ValueError, KeyError, TypeError):
+                    logger.warning("Ignoring a malformed state message")
+                    continue
+                self.values[key] = message.get("value")
+                self.stats["sets"] += 1
+                for client in self.clients:
+                    if client is not writer and not client.is_closing():
+                        self._send(client, line)
+                        self.stats["forwarded"] += 1
+        except Exception as e:
+            logger.debug(f"Worker connection failed: {e.__class__.__name__}")
+        finally:
+            was_leader = self.clients and self.clients[0] is writer
+            self.clients.remove(writer)
+            writer.close()
+            if was_leader and self.clients:
+                self._send(self.clients[0], encode_line({"op": "leader"}))
+
+
+class SharedState:
+    """This worker's view of the shared values.
+
+    Reads come from an in-process copy, so ``get`` never leaves the
+    process. ``set`` updates that copy and sends the value to the service,
+    which passes it on to the other workers; their watchers for the key
+    are then called with it. With no STATE_SOCKET it is a plain dict and
+    this process is the leader.
+    """
+
+    def __init__(self, path: str = STATE_SOCKET):
+        self.path = path
+        self.enabled = bool(path)
+        self.values: dict[str, Any] = {}
+        self.watchers: dict[str, list[Callable[[Any], Any]]] = {}
+        self.leadership_watchers: list[Callable[[bool], Any]] = []
+        self.leader = asyncio.Event()
+        #set while this worker is not the leader, so leader-only tasks can wait for either
+        self._follower = asyncio.Event()
+        if self.enabled:
+            self._follower.set()
+        else:
+            self.leader.set()
+        self.connected = False
+        #keys set while not connected; they are newer than whatever the service has
+        self._unsent: set[str] = set()
+        self._writer: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+        #async watcher calls run in order per key without holding up the connection
+        self._lanes: dict[str, asyncio.Task] = {}
+        self.stats = {"sent": 0, "received": 0, "connects": 0}
+
+    @property
+    def is_leader(self) -> bool:
+        return self.leader.is_set()
+
+    def get(self, key: str, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key: str, value) -> None:
+        value = copy.deepcopy(value)
+        self.values[key] = value
+        if not self._write({"op": "set", "key": key, "value": value}) and self.enabled:
+            self._unsent.add(key)
+
+    def watch(self, key: str, callback: Callable[[Any], Any]) -> None:
+        """Call ``callback(value)`` whenever another worker sets ``key``; it may be a coroutine function."""
+        self.watchers.setdefault(key, []).append(callback)
+
+    def on_leadership(self, callback: Callable[[bool], Any]) -> None:
+        """Call ``callback(is_leader)`` whenever this worker becomes or stops being the leader; it may be a coroutine function."""
+        self.leadership_watchers.append(callback)
+
+    def _write(self, message: dict) -> bool:
+        #until the hello arrives the service's values would overwrite this one, so it waits for the hello too
+        if not self.connected or self._writer is None or self._writer.is_closing():
+            return False
+        self._writer.write(encode_line(message))
+        self.stats["sent"] += 1
+        if self._writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            logger.warning("State service isn't reading, reconnecting")
+            self._writer.close()
+        return True
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        #losing the connection above notified the leadership watchers; let them finish
+        await asyncio.gather(*self._lanes.values(), return_exceptions=True)
+
+    async def _run(self) -> None:
+        delay = STATE_RECONNECT_MIN
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+            except OSError as e:
+                logger.warning(f"State service unreachable ({e.__class__.__name__}), retrying in {delay:.1f} seconds")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STATE_RECONNECT_MAX)
+                continue
+            delay = STATE_RECONNECT_MIN
+            self.stats["connects"] += 1
+            try:
+                await self._read(reader)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"State service connection failed: {e.__class__.__name__}")
+            finally:
+                self.connected = False
+                self._writer.close()
+                self._writer = None
+                self._set_leader(False)
+            logger.warning("Lost the state service connection, reconnecting")
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        while line := await reader.readline():
+            message = json.loads(line)
+            op = message.get("op")
+            if op == "hello":
+                self.connected = True
+                values = message.get("values", {})
+                #what was set while disconnected wins over the service's copy, and a restarted service has lost the rest
+                for key, value in self.values.items():
+                    if key in self._unsent or key not in values:
+                        self._write({"op": "set", "key": key, "value": value})
+                for key, value in values.items():
+                    if key not in self._unsent and (key not in self.values or self.values[key] != value):
+                        self._changed(key, value)
+                self._unsent.clear()
+                self._set_leader(bool(message.get("leader")))
+            elif op == "set":
+                self.stats["received"] += 1
+                self._changed(message["key"], message.get("value"))
+            elif op == "leader":
+                self._set_leader(True)
+
+    def _changed(self, key: str, value) -> None:
+        self.values[key] = value
+        self._notify(key, self.watchers.get(key, []), value)
+
+    def _notify(self, lane: str, callbacks: list[Callable[[Any], Any]], value) -> None:
+        for callback in callbacks:
+            try:
+                result = callback(value)
+            except Exception as e:
+                logger.error(f"Watcher for {lane} failed: {e}")
+                continue
+            if inspect.isawaitable(result):
+                self._lanes[lane] = asyncio.create_task(self._after(self._lanes.get(lane), lane, result))
+
+    async def _after(self, previous: asyncio.Task | None, key: str, awaitable: Awaitable) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await awaitable
+        except Exception as e:
+            logger.error(f"Watcher for {key} failed: {e}")
+
+    def _set_leader(self, leader: bool) -> None:
+        if leader == self.is_leader:
+            return
+        logger.info(f"Worker {os.getpid()} is {'now' if leader else 'no longer'} the leader")
+        if leader:
+            self._follower.clear()
+            self.leader.set()
+        else:
+            self.leader.clear()
+            self._follower.set()
+        self._notify(LEADERSHIP_LANE, self.leadership_watchers, leader)
+
+    async def run_as_leader(self, factory: Callable[[], Awaitable]) -> None:
+        """Run ``factory()`` while this worker is the leader; cancel it on losing that and start over on regaining it."""
+        while True:
+            await self.leader.wait()
+            task = asyncio.ensure_future(factory())
+            lost = asyncio.create_task(self._follower.wait())
+            try:
+                done, _ = await asyncio.wait({task, lost}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                lost.cancel()
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            if task in done:
+                return task.result()
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "connected": self.connected,
+            "leader": self.is_leader,
+            "worker": os.getpid(),
+            "keys": sorted(self.values),
+            **self.stats,
+        }
+
+
+shared_state = SharedState()
+
+
+def main():
+    if not STATE_SOCKET:
+        raise SystemExit("STATE_SOCKET is not set")
+    try:
+        asyncio.run(StateService(STATE_SOCKET).run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import datetime
+import math
+
+import pytz
+
+from .logger import get_logger
+
+logger = get_logger("Solar")
+
+#sun's upper limb on the horizon, including atmospheric refraction
+SUNRISE_ZENITH = 90.833
+
+
+def parse_coords(value: str) -> tuple[float, float] | None:
+    """"lat,lon" (the WEATHER_COORDS format) as floats, or None if it isn't one."""
+    try:
+        latitude, longitude = (float(part) for part in value.split(","))
+    except (AttributeError, ValueError):
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def _solar_terms(julian_century: float) -> tuple[float, float]:
+    """(declination in degrees, equation of time in minutes), NOAA solar calculator formulas."""
+    t = julian_century
+    mean_long = (280.46646 + t * (36000.76983 + t * 0.0003032)) % 360
+    mean_anom = 357.52911 + t * (35999.05029 - 0.0001537 * t)
+    eccent = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    m = math.radians(mean_anom)
+    center = (
+        math.sin(m) * (1.914602 - t * (0.004817 + 0.000014 * t))
+        + math.sin(2 * m) * (0.019993 - 0.000101 * t)
+        + math.sin(3 * m) * 0.000289
+    )
+    true_long = mean_long + center
+    omega = math.radians(125.04 - 1934.136 * t)
+    app_long = true_long - 0.00569 - 0.00478 * math.sin(omega)
+    mean_obliq = 23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+    obliq = math.radians(mean_obliq + 0.00256 * math.cos(omega))
+    declination = math.degrees(math.asin(math.sin(obliq) * math.sin(math.radians(app_long))))
+
+    y = math.tan(obliq / 2) ** 2
+    l0 = math.radians(mean_long)
+    eq_time = 4 * math.degrees(
+        y * math.sin(2 * l0)
+        - 2 * eccent * math.sin(m)
+        + 4 * eccent * y * math.sin(m) * math.cos(2 * l0)
+        - 0.5 * y * y * math.sin(4 * l0)
+        - 1.25 * eccent * eccent * math.sin(2 * m)
+    )
+    return declination, eq_time
+
+
+def _julian_century(moment: datetime.datetime) -> float:
+    julian_day = moment.timestamp() / 86400 + 2440587.5
+    return (julian_day - 2451545) / 36525
+
+
+def _event_minutes(moment: datetime.datetime, latitude: float, longitude: float, sign: int) -> float | None:
+    """Minutes after UTC midnight of sunrise (sign -1) or sunset (sign 1), with the sun's position taken at ``moment``.
+
+    Returns +inf/-inf when the sun stays above/below the horizon all day.
+    """
+    declination, eq_time = _solar_terms(_julian_century(moment))
+    lat = math.radians(latitude)
+    dec = math.radians(declination)
+    cos_hour_angle = math.cos(math.radians(SUNRISE_ZENITH)) / (math.cos(lat) * math.cos(dec)) - math.tan(lat) * math.tan(dec)
+    if cos_hour_angle > 1:
+        return -math.inf
+    if cos_hour_angle < -1:
+        return math.inf
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+    return 720 - 4 * longitude - eq_time + sign * 4 * hour_angle
+
+
+def sun_times(day: datetime.date, latitude: float, longitude: float) -> tuple[datetime.datetime | None, datetime.datetime | None]:
+    """UTC (sunrise, sunset) for ``day`` at the given place.
+
+    During polar day the whole UTC day is returned, during polar night
+    (None, None). Within a minute or two of the published tables.
+    """
+    midnight = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+    noon_estimate = midnight + datetime.timedelta(minutes=720 - 4 * longitude)
+
+    events = []
+    for sign in (-1, 1):
+        #first pass with the sun's position at solar noon, second at the event itself
+        minutes = _event_minutes(noon_estimate, latitude, longitude, sign)
+        if math.isfinite(minutes):
+            minutes = _event_minutes(midnight + datetime.timedelta(minutes=minutes), latitude, longitude, sign)
+        events.append(minutes)
+
+    sunrise, sunset = events
+    if not (math.isfinite(sunrise) and math.isfinite(sunset)):
+        if sunrise == math.inf or sunset == math.inf:
+            return midnight, midnight + datetime.timedelta(days=1)
+        return None, None
+    return midnight + datetime.timedelta(minutes=sunrise), midnight + datetime.timedelta(minutes=sunset)
+
+
+class SunCalendar:
+    """Sunrise and sunset for one place, computed once per local calendar day."""
+
+    def __init__(self, latitude: float, longitude: float, timezone: str):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.tz = pytz.timezone(timezone)
+        self._day: datetime.date | None = None
+        self._times: tuple = (None, None)
+
+    def times(self, day: datetime.date) -> tuple[datetime.datetime | None, datetime.datetime | None]:
+        """Local (sunrise, sunset) for ``day``; see sun_times for polar cases."""
+        if day != self._day:
+            sunrise, sunset = sun_times(day, self.latitude, self.longitude)
+            self._times = (
+                sunrise.astimezone(self.tz) if sunrise else None,
+                sunset.astimezone(self.tz) if sunset else None,
+            )
+            self._day = day
+            logger.debug(f"Sun times for {day}: {self._times}")
+        return self._times
+
+    def is_day(self, now: datetime.datetime | None = None) -> bool:
+        now = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(self.tz)
+        sunrise, sunset = self.times(now.date())
+        return sunrise is not None and sunrise <= now <= sunset
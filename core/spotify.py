@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import threading
+from pathlib import Path
+from time import monotonic
+
+import requests
+import spotipy
+from requests.adapters import HTTPAdapter
+from spotipy.cache_handler import CacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
+
+from .config import (
+    SPOTIFY_HTTP_TIMEOUT,
+    SPOTIFY_END_MARGIN,
+    SPOTIFY_POLL_MAX,
+    SPOTIFY_POLL_FAST,
+    SPOTIFY_FAST_WINDOW,
+    SPOTIFY_IDLE_MIN,
+    SPOTIFY_IDLE_MAX,
+    SPOTIFY_POLL_ERROR,
+)
+from .data_paths import SPOTIFY_TOKEN_FILE
+from .logger import get_logger
+
+logger = get_logger("Spotify-back")
+
+SCOPE = "user-read-playback-state"
+
+
+class TokenFileCache(CacheHandler):
+    """Token kept in memory, written back to the cache file only when spotipy saves a refreshed one.
+
+    The file is read once, and again only if its mtime changes (e.g. a token
+    imported through the configurator), so a poll costs a stat instead of a
+    read and JSON parse.
+    """
+
+    def __init__(self, path: Path = SPOTIFY_TOKEN_FILE):
+        self.path = path
+        self._token: dict | None = None
+        self._mtime: float | None = None
+        self.stats = {"loads": 0, "saves": 0}
+
+    def _file_mtime(self) -> float | None:
+        try:
+            return self.path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def get_cached_token(self) -> dict | None:
+        mtime = self._file_mtime()
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._token = None
+            if mtime is not None:
+                try:
+                    self._token = json.loads(self.path.read_text(encoding="utf-8"))
+                    self.stats["loads"] += 1
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Cant read Spotify token from {self.path}: {e.__class__.__name__}")
+        return self._token
+
+    def save_token_to_cache(self, token_info: dict) -> None:
+        self._token = token_info
+        try:
+            self.path.write_text(json.dumps(token_info), encoding="utf-8")
+            os.chmod(self.path, 0o600)
+            self._mtime = self._file_mtime()
+            self.stats["saves"] += 1
+            logger.debug("Refreshed Spotify token saved")
+        except OSError as e:
+            logger.warning(f"Cant save Spotify token to {self.path}: {e.__class__.__name__}")
+
+
+class SpotifyClient:
+    """One long-lived spotipy client, called from a worker thread.
+
+    spotipy is blocking, so each call runs through asyncio.to_thread. The
+    API and the token endpoint share one requests session that this client
+    owns, so the TLS connection stays open between polls. Calls and
+    ``close`` are serialized by a lock since a requests session is not meant
+    to be shared between threads.
+    """
+
+    def __init__(self, token_cache: TokenFileCache | None = None, timeout: float = SPOTIFY_HTTP_TIMEOUT):
+        self.token_cache = token_cache or TokenFileCache()
+        self.timeout = timeout
+        self._sp: spotipy.Spotify | None = None
+        self._session: requests.Session | None = None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0}
+
+    @property
+    def sp(self) -> spotipy.Spotify:
+        if self._sp is None:
+            session = requests.Session()
+            #the retries spotipy mounts on a session it creates itself
+            retry = Retry(
+                total=spotipy.Spotify.max_retries,
+                connect=None,
+                read=False,
+                allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+                status=spotipy.Spotify.max_retries,
+                backoff_factor=0.3,
+            )
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            auth_manager = SpotifyOAuth(
+                scope=SCOPE,
+                cache_handler=self.token_cache,
+                requests_session=session,
+                requests_timeout=self.timeout,
+                open_browser=False,
+            )
+            sp = spotipy.Spotify(
+                auth_manager=auth_manager,
+                requests_session=session,
+                requests_timeout=self.timeout,
+            )
+            self._sp, self._session = sp, session
+        return self._sp
+
+    def _call(self, method: str, *args, **kwargs):
+        with self._lock:
+            self.stats["calls"] += 1
+            try:
+                return getattr(self.sp, method)(*args, **kwargs)
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+
+    async def current_playback(self) -> dict | None:
+        return await asyncio.to_thread(self._call, "current_playback")
+
+    def _close(self) -> None:
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._sp = self._session = None
+
+    async def close(self) -> None:
+        #waits for a call still running in its thread rather than closing the session under it
+        await asyncio.to_thread(self._close)
+
+
+class SpotifyPollSchedule:
+    """Delay before the next playback poll, predicted from the track position.
+
+    While playing, the next poll lands ``end_margin`` seconds after the
+    predicted end of the track (progress_ms/duration_ms), but no later than
+    ``max_playing`` so skips and pauses made elsewhere are still noticed.
+    For ``fast_window`` seconds after any change (track, play/pause) it
+    polls every ``fast`` seconds to catch a quick skip. Paused or stopped
+    backs off exponentially from ``idle_min`` to ``idle_max``.
+
+    ``stats`` counts polls per track next to ``legacy_polls``, the polls the
+    old fixed schedule (5 s playing, 10 s otherwise) would have made over
+    the same time.
+    """
+
+    LEGACY_PLAYING = 5
+    LEGACY_IDLE = 10
+
+    def __init__(
+        self,
+        fast: float = SPOTIFY_POLL_FAST,
+        fast_window: float = SPOTIFY_FAST_WINDOW,
+        end_margin: float = SPOTIFY_END_MARGIN,
+        max_playing: float = SPOTIFY_POLL_MAX,
+        idle_min: float = SPOTIFY_IDLE_MIN,
+        idle_max: float = SPOTIFY_IDLE_MAX,
+        error: float = SPOTIFY_POLL_ERROR,
+    ):
+        self.fast = fast
+        self.fast_window = fast_window
+        self.end_margin = end_margin
+        self.max_playing = max_playing
+        self.idle_min = idle_min
+        self.idle_max = idle_max
+        self.error = error
+        self.state = None
+        self.changed_at = monotonic()
+        self.idle_polls = 0
+        self.current = idle_min
+        self._last_poll: float | None = None
+        self._playing = False
+        self._legacy = 0.0
+        self.polls = 0
+        self.tracks = 0
+
+    @staticmethod
+    def track_key(playback: dict | None):
+        item = (playback or {}).get("item")
+        if not item:
+            return None
+        return item.get("id") or (item.get("name"), tuple(a.get("name") for a in item.get("artists", [])))
+
+    def _count_poll(self, now: float, playing: bool) -> None:
+        if self._last_poll is None:
+            self._legacy += 1
+        else:
+            self._legacy += (now - self._last_poll) / (self.LEGACY_PLAYING if self._playing else self.LEGACY_IDLE)
+        self._last_poll = now
+        self._playing = playing
+        self.polls += 1
+
+    def observe(self, playback: dict | None, now: float | None = None) -> float:
+        """Interval after a successful poll; ``playback`` is current_playback() (None when nothing plays)."""
+        now = monotonic() if now is None else now
+        track = self.track_key(playback)
+        playing = track is not None and bool(playback.get("is_playing"))
+        self._count_poll(now, playing)
+
+        state = (track, playing)
+        if state != self.state:
+            if track is not None and (self.state is None or track != self.state[0]):
+                self.tracks += 1
+            self.state = state
+            self.changed_at = now
+            self.idle_polls = 0
+        in_fast_window = now - self.changed_at < self.fast_window
+
+        if playing:
+            item = playback["item"]
+            remaining = (item.get("duration_ms") or 0) - (playback.get("progress_ms") or 0)
+            interval = min(max(remaining / 1000, 0) + self.end_margin, self.max_playing)
+        else:
+            interval = min(self.idle_min * 2 ** self.idle_polls, self.idle_max)
+            self.idle_polls += 1
+        if in_fast_window:
+            interval = min(interval, self.fast)
+        self.current = interval
+        return interval
+
+    def failed(self, now: float | None = None) -> float:
+        """Interval after a failed poll; the last known state is kept."""
+        self._count_poll(monotonic() if now is None else now, self._playing)
+        self.current = self.error
+        return self.current
+
+    @property
+    def stats(self) -> dict:
+        tracks = max(self.tracks, 1)
+        return {
+            "polls": self.polls,
+            "tracks": self.tracks,
+            "polls_per_track": round(self.polls / tracks, 2),
+            "legacy_polls": round(self._legacy),
+            "legacy_polls_per_track": round(self._legacy / tracks, 2),
+            "next_poll": self.current,
+        }
+
+
+spotify_client = SpotifyClient()
+spotify_poll_schedule = SpotifyPollSchedule()
@@ -0,0 +1,301 @@
+import hashlib
+import html
+import re
+from time import monotonic
+
+import httpx
+
+from .config import (
+    STEAM_API,
+    STEAM_USER,
+    STEAM_API_URL,
+    STEAM_PROFILE_LINK,
+    STEAM_PRESENCE_BACKEND,
+    STEAM_HTTP_TIMEOUT,
+    STEAM_POLL_FAST,
+    STEAM_POLL_INTERVAL,
+    STEAM_POLL_SLOW,
+    STEAM_FAST_WINDOW,
+    STEAM_OFFLINE_SLOW_AFTER,
+)
+from .logger import get_logger
+
+logger = get_logger("Steam-back")
+
+HEADER_MARKER = b'class="profile_in_game_header"'
+NAME_MARKER = b'class="profile_in_game_name"'
+#the game name follows the header within a few hundred bytes
+FRAGMENT_WINDOW = 2048
+_FIELD = re.compile(r'profile_in_game_(header|name)"[^>]*>(.*?)</div>', re.S)
+_TAG = re.compile(r"<[^>]+>")
+
+STATUS_BY_HEADER = {
+    "Currently Offline": "offline",
+    "Currently Online": "online",
+    "Currently In-Game": "playing",
+}
+
+
+def extract_fragment(page: bytes) -> bytes | None:
+    """Bytes from the in-game header to the end of the game name div (or the header div)."""
+    start = page.find(HEADER_MARKER)
+    if start < 0:
+        return None
+    window_end = start + FRAGMENT_WINDOW
+    name = page.find(NAME_MARKER, start, window_end)
+    end = page.find(b"</div>", name if name >= 0 else start, window_end)
+    if end < 0:
+        return None
+    return page[start:end + len(b"</div>")]
+
+
+def presence_state(status: dict) -> tuple:
+    """The fields every backend reports; ``game_id`` only comes from the Web API, so it isn't compared."""
+    return (status["status"], status.get("game_name", ""))
+
+
+def parse_fragment(fragment: bytes | None) -> dict:
+    if fragment is None:
+        return {"status": "error"}
+    fields = {
+        key: html.unescape(_TAG.sub("", value)).strip()
+        for key, value in _FIELD.findall(fragment.decode("utf-8", "replace"))
+    }
+    state = STATUS_BY_HEADER.get(fields.get("header"))
+    if state is None:
+        return {"status": "error"}
+    if state == "playing":
+        return {"status": "playing", "game_name": fields.get("name", "")}
+    return {"status": state}
+
+
+class SteamProfileScraper:
+    """Presence read from the public profile page.
+
+    Fetches return ``{"status": "offline" | "online" | "playing" | "error"}``
+    plus ``game_name`` while playing, or None when Steam can't be reached.
+
+    Uses one keep-alive AsyncClient and sends If-None-Match/If-Modified-Since
+    when Steam handed out validators. Only the in-game header fragment is
+    looked at, and when its hash matches the previous poll the last result is
+    returned without parsing.
+    """
+
+    name = "scrape"
+
+    def __init__(self, url: str = STEAM_PROFILE_LINK, timeout: float = STEAM_HTTP_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._client: httpx.AsyncClient | None = None
+        self._validators: dict[str, str] = {}
+        self._fragment_hash: bytes | None = None
+        self._last = {"status": "error"}
+        self.stats = {"polls": 0, "not_modified": 0, "unchanged": 0, "parsed": 0, "errors": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=True)
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _remember_validators(self, response: httpx.Response) -> None:
+        self._validators = {}
+        if etag := response.headers.get("ETag"):
+            self._validators["If-None-Match"] = etag
+        if last_modified := response.headers.get("Last-Modified"):
+            self._validators["If-Modified-Since"] = last_modified
+
+    async def fetch(self) -> dict | None:
+        """Current presence, or None if Steam could not be reached."""
+        self.stats["polls"] += 1
+        try:
+            response = await self.client.get(self.url, headers=self._validators)
+            if response.status_code == 304:
+                self.stats["not_modified"] += 1
+                return self._last
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Steam profile request failed: {e!r}")
+            return None
+
+        self._remember_validators(response)
+        fragment = extract_fragment(response.content)
+        digest = hashlib.blake2b(fragment or b"", digest_size=16).digest()
+        if digest == self._fragment_hash:
+            self.stats["unchanged"] += 1
+            return self._last
+
+        self._fragment_hash = digest
+        self.stats["parsed"] += 1
+        self._last = parse_fragment(fragment)
+        logger.debug(f"Steam profile parsed: {self._last}")
+        return self._last
+
+
+class SteamWebAPIPresence:
+    """Presence from ISteamUser/GetPlayerSummaries.
+
+    Same result shape as SteamProfileScraper, plus ``game_id`` (the Steam app
+    id) while playing so the game catalog can be matched by steam_id. An
+    empty player list (bad key or steam id) counts as a failure, letting
+    SteamPresence fall back to the next backend.
+    """
+
+    name = "webapi"
+
+    def __init__(
+        self,
+        key: str = STEAM_API,
+        steam_id: str = STEAM_USER,
+        base_url: str = STEAM_API_URL,
+        timeout: float = STEAM_HTTP_TIMEOUT,
+    ):
+        self.key = key
+        self.steam_id = steam_id
+        self.url = f"{base_url.rstrip('/')}/ISteamUser/GetPlayerSummaries/v0002/"
+        self.timeout = timeout
+        self._client: httpx.AsyncClient | None = None
+        self.stats = {"polls": 0, "errors": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def parse_player(player: dict) -> dict:
+        if player.get("gameid"):
+            return {
+                "status": "playing",
+                "game_name": player.get("gameextrainfo", ""),
+                "game_id": str(player["gameid"]),
+            }
+        #personastate: 0 offline, 1 online, 2 busy, 3 away, 4 snooze, 5 looking to trade, 6 looking to play
+        if player.get("personastate", 0) == 0:
+            return {"status": "offline"}
+        return {"status": "online"}
+
+    async def fetch(self) -> dict | None:
+        self.stats["polls"] += 1
+        try:
+            response = await self.client.get(self.url, params={"key": self.key, "steamids": self.steam_id})
+            response.raise_for_status()
+            players = response.json()["response"]["players"]
+        except httpx.HTTPStatusError as e:
+            #the message would include the request URL, and with it the API key
+            self.stats["errors"] += 1
+            logger.warning(f"Steam Web API answered {e.response.status_code}")
+            return None
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Steam Web API request failed: {e.__class__.__name__}")
+            return None
+        if not players:
+            self.stats["errors"] += 1
+            logger.warning(f"Steam Web API returned no player for {self.steam_id}")
+            return None
+        return self.parse_player(players[0])
+
+
+class SteamPresence:
+    """Asks each backend in turn and returns the first answer."""
+
+    def __init__(self, backends: list):
+        self.backends = backends
+        self.last_backend: str | None = None
+
+    async def fetch(self) -> dict | None:
+        for backend in self.backends:
+            status = await backend.fetch()
+            if status is not None:
+                if backend.name != self.last_backend:
+                    logger.info(f"Steam presence now served by '{backend.name}'")
+                self.last_backend = backend.name
+                return status
+        return None
+
+    async def close(self) -> None:
+        for backend in self.backends:
+            await backend.close()
+
+    @property
+    def stats(self) -> dict:
+        return {backend.name: backend.stats for backend in self.backends}
+
+
+class AdaptivePollInterval:
+    """Delay before the next presence poll, given the latest result.
+
+    Fast for ``fast_window`` seconds after the state (or game) changed and
+    whenever the user is online, since that's when a game is about to start.
+    Slow once they have been offline for ``slow_after`` seconds; the normal
+    interval otherwise, including while a backend is failing.
+    """
+
+    def __init__(
+        self,
+        fast: float = STEAM_POLL_FAST,
+        normal: float = STEAM_POLL_INTERVAL,
+        slow: float = STEAM_POLL_SLOW,
+        fast_window: float = STEAM_FAST_WINDOW,
+        slow_after: float = STEAM_OFFLINE_SLOW_AFTER,
+    ):
+        self.fast = fast
+        self.normal = normal
+        self.slow = slow
+        self.fast_window = fast_window
+        self.slow_after = slow_after
+        self.state = None
+        self.changed_at = monotonic()
+        self.current = normal
+
+    def observe(self, status: dict | None, now: float | None = None) -> float:
+        now = monotonic() if now is None else now
+        if status is None:
+            self.current = self.normal
+            return self.current
+
+        state = presence_state(status)
+        if state != self.state:
+            self.state = state
+            self.changed_at = now
+        since_change = now - self.changed_at
+
+        if since_change < self.fast_window or status["status"] == "online":
+            self.current = self.fast
+        elif status["status"] == "offline" and since_change >= self.slow_after:
+            self.current = self.slow
+        else:
+            self.current = self.normal
+        return self.current
+
+
+def make_presence(backend: str = STEAM_PRESENCE_BACKEND) -> SteamPresence:
+    webapi = SteamWebAPIPresence()
+    scraper = SteamProfileScraper()
+    if backend == "api":
+        return SteamPresence([webapi])
+    if backend == "scrape":
+        return SteamPresence([scraper])
+    backends = []
+    if STEAM_API and STEAM_USER:
+        backends.append(webapi)
+    if STEAM_PROFILE_LINK or not backends:
+        backends.append(scraper)
+    return SteamPresence(backends)
+
+
+steam_presence = make_presence()
+steam_poll_interval = AdaptivePollInterval()
@@ -0,0 +1,355 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+from .config import STORAGE_BACKEND
+from .content_store import get_directory_watcher
+from .data_paths import DATABASE_FILE, ensure_data_dir
+from .logger import get_logger
+
+logger = get_logger("Storage")
+
+#operations understood by the stores' apply() and by apply_batch():
+#("add", None, value), ("edit", index, value), ("delete", index, None)
+#apply() reports each one back as an (index, old, new) change, old None for an add and new None for a delete
+OP_ADD = "add"
+OP_EDIT = "edit"
+OP_DELETE = "delete"
+
+
+def _apply_in_memory(items: list, operations: list[tuple]) -> list[tuple]:
+    changes = []
+    for op, index, value in operations:
+        if op == OP_ADD:
+            changes.append((len(items), None, value))
+            items.append(value)
+            continue
+        if index is None or index < 0 or index >= len(items):
+            raise IndexError(f"Index {index} out of range")
+        if op == OP_EDIT:
+            changes.append((index, items[index], value))
+            items[index] = value
+        elif op == OP_DELETE:
+            changes.append((index, items.pop(index), None))
+        else:
+            raise ValueError(f"Unknown operation: {op}")
+    return changes
+
+
+class JsonListStore:
+    """A JSON array in one file. Writes go through a temp file and ``os.replace``."""
+
+    #signature() is an inotify counter (free) or an mtime stat (throttled by callers)
+    backend = "json"
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f"JsonListStore({self.path})"
+
+    @property
+    def cheap_signature(self) -> bool:
+        return get_directory_watcher(self.path.parent) is not None
+
+    def signature(self):
+        watcher = get_directory_watcher(self.path.parent)
+        if watcher is not None:
+            return ("inotify", watcher.version(self.path.name))
+        try:
+            return ("mtime", self.path.stat().st_mtime_ns)
+        except FileNotFoundError:
+            return ("mtime", None)
+
+    def load(self) -> list:
+        if not self.path.exists():
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, items: list) -> None:
+        ensure_data_dir()
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def apply(self, operations: list[tuple]) -> list[tuple]:
+        items = self.load()
+        changes = _apply_in_memory(items, operations)
+        self.save(items)
+        return changes
+
+
+class SqliteDatabase:
+    """Process-wide WAL-mode connection holding every list collection."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.RLock()
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            ensure_data_dir()
+            conn = sqlite3.connect(str(self.path), isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS list_items (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    collection TEXT NOT NULL,
+                    value TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS list_items_collection ON list_items (collection, id);
+                CREATE TABLE IF NOT EXISTS collections (
+                    name TEXT PRIMARY KEY,
+                    revision INTEGER NOT NULL
+                );
+                """
+            )
+            self._conn = conn
+            logger.info(f"Opened SQLite storage at {self.path}")
+        return self._conn
+
+    def transaction(self):
+        return _Transaction(self)
+
+
+class _Transaction:
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.db.lock.acquire()
+        try:
+            conn = self.db.conn
+            conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.db.lock.release()
+            raise
+        return conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.lock.release()
+        return False
+
+
+class SqliteListStore:
+    """One collection in the shared SQLite database.
+
+    Items are rows ordered by their autoincrement id, so positional indexes
+    stay what the JSON API exposes. The row ids are kept in list order in
+    memory, so an edit or delete finds its row without scanning; they are
+    re-read only when the collection's revision shows a write from elsewhere.
+    The first time a collection is opened it is seeded from its legacy JSON
+    file.
+    """
+
+    backend = "sqlite"
+    cheap_signature = False
+
+    def __init__(self, db: SqliteDatabase, collection: str, legacy_path: Path | None = None):
+        self.db = db
+        self.collection = collection
+        self.legacy_path = legacy_path
+        self._ready = False
+        self._ids: list[int] | None = None
+        #revision the cached ids match, and the one they will match once the open transaction commits
+        self._ids_revision = None
+        self._pending_revision = None
+
+    def __repr__(self) -> str:
+        return f"SqliteListStore({self.db.path}:{self.collection})"
+
+    def prepare(self) -> None:
+        """Create the collection, importing the legacy JSON file, on first use."""
+        if self._ready:
+            return
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT 1 FROM collections WHERE name = ?", (self.collection,)).fetchone()
+            if row is None:
+                items = []
+                if self.legacy_path is not None and self.legacy_path.exists():
+                    items = JsonListStore(self.legacy_path).load()
+                    logger.info(f"Importing {len(items)} entries into '{self.collection}' from {self.legacy_path}")
+                self._insert_all(conn, items)
+                conn.execute("INSERT INTO collections (name, revision) VALUES (?, 1)", (self.collection,))
+        self._ready = True
+
+    def _insert_all(self, conn: sqlite3.Connection, items: list) -> None:
+        conn.executemany(
+            "INSERT INTO list_items (collection, value) VALUES (?, ?)",
+            ((self.collection, json.dumps(item, ensure_ascii=False)) for item in items),
+        )
+
+    def _bump(self, conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE collections SET revision = revision + 1 WHERE name = ?", (self.collection,))
+
+    def _row_ids(self, conn: sqlite3.Connection) -> list[int]:
+        revision = conn.execute("SELECT revision FROM collections WHERE name = ?", (self.collection,)).fetchone()[0]
+        if self._ids is None or revision not in (self._ids_revision, self._pending_revision):
+            rows = conn.execute("SELECT id FROM list_items WHERE collection = ? ORDER BY id", (self.collection,))
+            self._ids = [row_id for (row_id,) in rows]
+        self._ids_revision = None
+        self._pending_revision = revision + 1
+        return self._ids
+
+    def _settle(self, committed: bool) -> None:
+        """Called once the transaction that ran ``apply_in`` is over; a rollback drops the cached ids."""
+        if committed:
+            self._ids_revision = self._pending_revision
+        else:
+            self._ids = None
+        self._pending_revision = None
+
+    def _old_value(self, conn: sqlite3.Connection, row_id: int):
+        (value,) = conn.execute("SELECT value FROM list_items WHERE id = ?", (row_id,)).fetchone()
+        return json.loads(value)
+
+    def apply_in(self, conn: sqlite3.Connection, operations: list[tuple]) -> list[tuple]:
+        """Apply operations inside an open transaction; ``prepare`` must have run.
+
+        The caller reports the end of the transaction through ``_settle``.
+        """
+        ids = self._row_ids(conn)
+        changes = []
+        for op, index, value in operations:
+            if op == OP_ADD:
+                cursor = conn.execute(
+                    "INSERT INTO list_items (collection, value) VALUES (?, ?)",
+                    (self.collection, json.dumps(value, ensure_ascii=False)),
+                )
+                changes.append((len(ids), None, value))
+                ids.append(cursor.lastrowid)
+                continue
+            if op not in (OP_EDIT, OP_DELETE):
+                raise ValueError(f"Unknown operation: {op}")
+            if index is None or index < 0 or index >= len(ids):
+                raise IndexError(f"Index {index} out of range")
+            row_id = ids[index]
+            old = self._old_value(conn, row_id)
+            if op == OP_EDIT:
+                conn.execute(
+                    "UPDATE list_items SET value = ? WHERE id = ?",
+                    (json.dumps(value, ensure_ascii=False), row_id),
+                )
+                changes.append((index, old, value))
+            else:
+                conn.execute("DELETE FROM list_items WHERE id = ?", (row_id,))
+                ids.pop(index)
+                changes.append((index, old, None))
+        self._bump(conn)
+        return changes
+
+    def signature(self):
+        self.prepare()
+        with self.db.lock:
+            conn = self.db.conn
+            row = conn.execute("SELECT revision FROM collections WHERE name = ?", (self.collection,)).fetchone()
+        return ("sqlite", row[0] if row else None)
+
+    def load(self) -> list:
+        self.prepare()
+        with self.db.lock:
+            rows = self.db.conn.execute(
+                "SELECT value FROM list_items WHERE collection = ? ORDER BY id", (self.collection,)
+            ).fetchall()
+        return [json.loads(value) for (value,) in rows]
+
+    def save(self, items: list) -> None:
+        self.prepare()
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM list_items WHERE collection = ?", (self.collection,))
+            self._insert_all(conn, items)
+            self._bump(conn)
+
+    def apply(self, operations: list[tuple]) -> list[tuple]:
+        self.prepare()
+        try:
+            with self.db.transaction() as conn:
+                changes = self.apply_in(conn, operations)
+        except BaseException:
+            self._settle(False)
+            raise
+        self._settle(True)
+        return changes
+
+
+_database: SqliteDatabase | None = None
+
+
+def get_database() -> SqliteDatabase:
+    global _database
+    if _database is None:
+        _database = SqliteDatabase(DATABASE_FILE)
+    return _database
+
+
+def get_list_store(collection: str, json_path: Path):
+    """Store for one list, backed by STORAGE_BACKEND ("json" or "sqlite")."""
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteListStore(get_database(), collection, legacy_path=json_path)
+    return JsonListStore(json_path)
+
+
+def apply_batch(operations: list[tuple]) -> list[tuple]:
+    """Apply (store, (op, index, value)) tuples in order, all or nothing.
+
+    On SQLite everything runs in one transaction. JSON stores are edited in
+    memory first, so a bad index aborts before any file is touched; each file
+    is then replaced atomically. Returns (store, change) pairs in the same
+    order as the operations.
+    """
+    by_store: dict[int, tuple] = {}
+    for store, operation in operations:
+        by_store.setdefault(id(store), (store, []))[1].append(operation)
+
+    sqlite_stores = [entry for entry in by_store.values() if isinstance(entry[0], SqliteListStore)]
+    json_stores = [entry for entry in by_store.values() if not isinstance(entry[0], SqliteListStore)]
+
+    changes: list = [None] * len(operations)
+    if sqlite_stores:
+        for store, _ in sqlite_stores:
+            store.prepare()
+        try:
+            with get_database().transaction() as conn:
+                for position, (store, operation) in enumerate(operations):
+                    if isinstance(store, SqliteListStore):
+                        changes[position] = (store, store.apply_in(conn, [operation])[0])
+        except BaseException:
+            for store, _ in sqlite_stores:
+                store._settle(False)
+            raise
+        for store, _ in sqlite_stores:
+            store._settle(True)
+
+    pending = []
+    for store, store_operations in json_stores:
+        items = store.load()
+        store_changes = iter(_apply_in_memory(items, store_operations))
+        for position, (other, _) in enumerate(operations):
+            if other is store:
+                changes[position] = (store, next(store_changes))
+        pending.append((store, items))
+    for store, items in pending:
+        store.save(items)
+    return changes
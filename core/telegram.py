@@ -6,6 +6,7 @@ from telethon.tl.types import EmojiStatus
 
 import asyncio
 import logging
+import time
 from random import choice
 import httpx
 from typing import Optional
@@ -14,22 +15,214 @@ import re
 from io import BytesIO
 import numpy as np
 
-from .config import TG_API_KEY, TG_API_HASH
+from .config import (
+    TG_API_KEY,
+    TG_API_HASH,
+    TG_BIO_LIMIT,
+    TG_COALESCE_WINDOW,
+    TG_COALESCE_MAX_DELAY,
+    TG_RPC_BUCKET_SIZE,
+    TG_RPC_PER_MINUTE,
+)
 from .quote_manager import get_random_quote
 from .emoji_manager import get_random_emoji
 from .data_paths import TELEGRAM_SESSION_FILE
+from .enums import StatusPriority
 from .logger import get_logger
 
 logger = get_logger("Telegram")
 
+_UNSET = object()
+
+#tokens that must stay in the bucket after an update of this priority is sent,
+#so a stream of quotes can never starve Spotify or game updates
+PRIORITY_RESERVE = {
+    StatusPriority.HIGH: 0,
+    StatusPriority.NORMAL: 1,
+    StatusPriority.LOW: 2,
+}
+MESSAGE_RETRIES = 3
+#shared_state key a worker without the client sets after importing a new session file
+TELEGRAM_SESSION_KEY = "telegram.session"
+
+
+class TokenBucket:
+    def __init__(self, capacity: int = TG_RPC_BUCKET_SIZE, per_minute: float = TG_RPC_PER_MINUTE):
+        self.capacity = max(1, capacity)
+        self.rate = max(per_minute, 0.001) / 60.0
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay_for(self, needed: float) -> float:
+        """Seconds until ``needed`` tokens are available (0 if they already are)."""
+        self._refill()
+        needed = min(needed, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+
+class RpcScheduler:
+    """Flood-wait deadlines per RPC type plus a shared token bucket.
+
+    ``acquire`` parks the caller until the RPC type is out of its flood wait
+    and the bucket holds one token plus the reserve for the caller's
+    priority, then consumes the token.
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.flood_until: dict[str, float] = {}
+        self.stats = {"flood_waits": 0, "retries": 0, "paced": 0}
+
+    def record_flood_wait(self, rpc: str, seconds: int) -> None:
+        self.stats["flood_waits"] += 1
+        deadline = time.monotonic() + seconds
+        self.flood_until[rpc] = max(self.flood_until.get(rpc, 0.0), deadline)
+        logger.warning(f"Flood wait on {rpc}: parking updates for {seconds} seconds")
+
+    def delay(self, rpc: str, priority: StatusPriority) -> float:
+        flood_delay = self.flood_until.get(rpc, 0.0) - time.monotonic()
+        return max(flood_delay, self.bucket.delay_for(1 + PRIORITY_RESERVE[priority]))
+
+    async def acquire(self, rpc: str, priority) -> None:
+        """``priority`` may be a callable, re-read after every wait."""
+        paced = False
+        while True:
+            current = priority() if callable(priority) else priority
+            delay = self.delay(rpc, current)
+            if delay <= 0:
+                break
+            paced = True
+            await asyncio.sleep(delay)
+        if paced:
+            self.stats["paced"] += 1
+        self.bucket.take()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            **self.stats,
+            "tokens": round(self.bucket.available(), 2),
+            "flood_wait_remaining": {
+                rpc: round(deadline - now, 1) for rpc, deadline in self.flood_until.items() if deadline > now
+            },
+        }
+
+
+class CoalescingChannel:
+    """Latest-wins slot for one profile field.
+
+    ``submit`` only records the desired value and returns. A background task
+    waits until no new value arrived for ``window`` seconds (but at most
+    ``max_delay`` after the first one), then for the scheduler to clear the
+    RPC, and hands only the final value to ``sender``; everything submitted
+    in between is counted as coalesced. If the sender hits a flood wait the
+    value is parked and retried after the deadline unless a newer value
+    replaced it meanwhile.
+    """
+
+    def __init__(self, name: str, sender, scheduler: RpcScheduler,
+                 window: float = TG_COALESCE_WINDOW, max_delay: float = TG_COALESCE_MAX_DELAY):
+        self.name = name
+        self.window = window
+        self.max_delay = max_delay
+        self.scheduler = scheduler
+        self._sender = sender
+        self._pending = _UNSET
+        self._priority = StatusPriority.NORMAL
+        self._first_submit = 0.0
+        self._last_submit = 0.0
+        self._task: asyncio.Task | None = None
+        self.stats = {"requested": 0, "coalesced": 0, "flushed": 0}
+
+    @property
+    def pending(self):
+        return None if self._pending is _UNSET else self._pending
+
+    def submit(self, value, priority: StatusPriority = StatusPriority.NORMAL) -> None:
+        now = time.monotonic()
+        self.stats["requested"] += 1
+        if self._pending is _UNSET:
+            self._first_submit = now
+        else:
+            self.stats["coalesced"] += 1
+            logger.debug(f"Coalescing {self.name} update, replacing {self._pending!r}")
+        self._pending = value
+        self._priority = priority
+        self._last_submit = now
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._pending is not _UNSET:
+            delay = min(self._last_submit + self.window, self._first_submit + self.max_delay) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self.scheduler.acquire(self.name, lambda: self._priority)
+            await self._send_pending()
+
+    async def _send_pending(self) -> None:
+        if self._pending is _UNSET:
+            return
+        value, priority, self._pending = self._pending, self._priority, _UNSET
+        self.stats["flushed"] += 1
+        try:
+            await self._sender(value)
+        except FloodWaitError as e:
+            self.scheduler.record_flood_wait(self.name, e.seconds)
+            if self._pending is _UNSET:
+                self.scheduler.stats["retries"] += 1
+                self._pending, self._priority = value, priority
+                self._first_submit = self._last_submit = 0.0
+        except Exception as e:
+            logger.error(f"Failed to send {self.name} update: {e}")
+
+    def clear(self) -> None:
+        """Drop the pending value and stop the task waiting to send it."""
+        self._pending = _UNSET
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
 
 class TelegramAPI:
     _client = None
-    _telegram_lock = asyncio.Lock()
+    #connect/disconnect are serialized on their own; each RPC kind has its own lock so
+    #a slow bio update doesn't hold up the emoji status or outage messages
+    _connection_lock = asyncio.Lock()
+    _rpc_locks = {
+        "status_text": asyncio.Lock(),
+        "status_emoji": asyncio.Lock(),
+        "send_message": asyncio.Lock(),
+    }
     _enabled = True
 
     current_status = None
     current_emoji_status = None
+    skipped_unchanged = 0
+
+    _scheduler = RpcScheduler(TokenBucket())
+    _status_channel = CoalescingChannel(
+        "status_text", lambda status: TelegramAPI._update_status_text(status), _scheduler
+    )
+    _emoji_channel = CoalescingChannel(
+        "status_emoji", lambda emoji_id: TelegramAPI._update_status_emoji(emoji_id), _scheduler
+    )
 
     @classmethod
     async def connect(cls):
@@ -38,7 +231,7 @@ class TelegramAPI:
             cls._enabled = False
             return
 
-        async with cls._telegram_lock:
+        async with cls._connection_lock:
             if cls._client is not None and cls._client.is_connected():
                 return
 
@@ -55,104 +248,174 @@ class TelegramAPI:
             await register_outage_listener(cls._client)
 
     @classmethod
-    async def reload_session(cls):
-        async with cls._telegram_lock:
-            if cls._client is not None:
-                try:
-                    await cls._client.disconnect()
-                except Exception as e:
-                    logger.warning(f"Failed to disconnect old Telegram client cleanly: {e}")
-            cls._client = None
-            cls._enabled = True
-            cls.current_status = None
-            cls.current_emoji_status = None
+    async def _disconnect(cls):
+        async with cls._connection_lock:
+            #wait for in-flight RPCs so none of them runs on a client being torn down
+            for lock in cls._rpc_locks.values():
+                await lock.acquire()
+            try:
+                await cls._drop_client()
+            finally:
+                for lock in cls._rpc_locks.values():
+                    lock.release()
 
+    @classmethod
+    async def reload_session(cls):
+        await cls._disconnect()
         await cls.connect()
 
     @classmethod
-    async def set_status_text(cls, status: str):
+    async def release(cls):
+        """Give up the session for another worker: drop queued bio/emoji updates and disconnect."""
+        cls._status_channel.clear()
+        cls._emoji_channel.clear()
+        await cls._disconnect()
+        logger.info("Released the Telegram session")
+
+    @classmethod
+    async def _drop_client(cls):
+        if cls._client is not None:
+            try:
+                await cls._client.disconnect()
+            except Exception as e:
+                logger.warning(f"Failed to disconnect old Telegram client cleanly: {e}")
+        cls._client = None
+        cls._enabled = True
+        cls.current_status = None
+        cls.current_emoji_status = None
+
+    @classmethod
+    async def _with_client(cls, rpc: str, action):
+        """Run ``action(client)`` holding only the lock for ``rpc``.
+
+        Connecting happens before the lock is taken, so reload_session (which
+        holds the connection lock while it waits for every RPC lock) can't
+        deadlock with us; if the client was dropped while we waited, reconnect.
+        """
+        while True:
+            if cls._client is None:
+                await cls.connect()
+            if not cls._enabled:
+                return None
+            async with cls._rpc_locks[rpc]:
+                if cls._client is not None:
+                    return await action(cls._client)
+
+    @classmethod
+    async def set_status_text(cls, status: str, priority: StatusPriority = StatusPriority.NORMAL):
+        """Queue a bio update; only the latest value within the coalescing window is sent."""
         logger.debug(f"Trying to set status text: {status}")
         if not cls._enabled:
             logger.debug("Telegram is disabled due to missing session.")
             return
-        if cls._client is None:
-            await cls.connect()
+        cls._status_channel.submit(status, priority)
+
+    @classmethod
+    async def set_status_emoji(cls, emoji_id: int, priority: StatusPriority = StatusPriority.NORMAL):
+        """Queue an emoji status update; only the latest value within the coalescing window is sent."""
+        logger.debug(f"Trying to set status emoji: {emoji_id}")
         if not cls._enabled:
+            logger.debug("Telegram is disabled due to missing session.")
+            return
+
+        try:
+            emoji_id = int(emoji_id)
+        except (ValueError, TypeError):
+            logger.error(f"Invalid emoji_id passed: {emoji_id}")
             return
 
-        async with cls._telegram_lock:
+        cls._emoji_channel.submit(emoji_id, priority)
+
+    @classmethod
+    async def _update_status_text(cls, status: str):
+        """Send the bio; FloodWaitError propagates so the channel can park and retry."""
+        async def update(client):
             try:
                 if cls.current_status != status:
-                    await cls._client(UpdateProfileRequest(about=status))
+                    await client(UpdateProfileRequest(about=status))
                     logger.info(f"Updated Telegram profile status: {status}")
                     cls.current_status = status
                 else:
+                    cls.skipped_unchanged += 1
                     logger.warning("Status unchanged, skipping update")
             except AboutTooLongError:
                 logger.warning("Status message too long.")
-            except FloodWaitError as e:
-                logger.warning(f"Flood wait: wait {e.seconds} seconds before retrying.")
+            except FloodWaitError:
+                raise
             except RPCError as e:
                 logger.error(f"Telegram RPC error: {e}")
 
-    @classmethod
-    async def set_status_emoji(cls, emoji_id: int):
-        logger.debug(f"Trying to set status emoji: {emoji_id}")
-        if not cls._enabled:
-            logger.debug("Telegram is disabled due to missing session.")
-            return
-        if cls._client is None:
-            await cls.connect()
-        if not cls._enabled:
-            return
-
-        try:
-            emoji_id = int(emoji_id)
-        except (ValueError, TypeError):
-            logger.error(f"Invalid emoji_id passed: {emoji_id}")
-            return
+        await cls._with_client("status_text", update)
 
-        async with cls._telegram_lock:
+    @classmethod
+    async def _update_status_emoji(cls, emoji_id: int):
+        """Send the emoji status; FloodWaitError propagates so the channel can park and retry."""
+        async def update(client):
             try:
                 if cls.current_emoji_status == emoji_id:
+                    cls.skipped_unchanged += 1
                     logger.warning("Emoji status unchanged, skipping update")
                     return
-                cls.current_emoji_status = emoji_id
                 emoji_status = EmojiStatus(document_id=emoji_id)
-                await cls._client(UpdateEmojiStatusRequest(emoji_status))
+                await client(UpdateEmojiStatusRequest(emoji_status))
+                cls.current_emoji_status = emoji_id
                 logger.info(f"Updated emoji status to emoji_id: {emoji_id}")
-            except FloodWaitError as e:
-                logger.warning(f"Flood wait: wait {e.seconds} seconds before retrying.")
+            except FloodWaitError:
+                raise
             except RPCError as e:
                 logger.error(f"Telegram RPC error: {e}")
 
+        await cls._with_client("status_emoji", update)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        channels = (cls._status_channel, cls._emoji_channel)
+        return {
+            "enabled": cls._enabled,
+            "connected": cls._client is not None and cls._client.is_connected(),
+            "current_status": cls.current_status,
+            "current_emoji_status": cls.current_emoji_status,
+            "skipped_unchanged": cls.skipped_unchanged,
+            "channels": {
+                channel.name: {**channel.stats, "pending": channel.pending} for channel in channels
+            },
+            "rpcs_saved": sum(channel.stats["coalesced"] for channel in channels) + cls.skipped_unchanged,
+            "scheduler": cls._scheduler.snapshot(),
+        }
+
     @classmethod
     async def set_default_status(cls):
-        await cls.set_status_text(get_random_quote())
+        await cls.set_status_text(get_random_quote(TG_BIO_LIMIT), StatusPriority.LOW)
 
     @classmethod
     async def set_default_emoji(cls):
-        await cls.set_status_emoji(get_random_emoji())
+        await cls.set_status_emoji(get_random_emoji(), StatusPriority.LOW)
 
     @classmethod
     async def send_message(cls, chat_id: int | str, message: str, quiet: bool = False):
         if not cls._enabled:
             logger.error("Telegram is disabled due to missing session.")
             return
-        if cls._client is None:
-            await cls.connect()
-        if not cls._enabled:
-            return
 
-        async with cls._telegram_lock:
+        async def send(client):
             try:
-                await cls._client.send_message(chat_id, message, silent=quiet)
+                await client.send_message(chat_id, message, silent=quiet)
                 logger.info(f"Sent message to {chat_id}: {message} (quiet={quiet})")
+                return True
             except FloodWaitError as e:
-                logger.warning(f"Flood wait: wait {e.seconds} seconds before retrying.")
+                cls._scheduler.record_flood_wait("send_message", e.seconds)
+                cls._scheduler.stats["retries"] += 1
+                return False
             except RPCError as e:
                 logger.error(f"Telegram RPC error while sending message: {e}")
+                return True
 
+        for attempt in range(MESSAGE_RETRIES):
+            await cls._scheduler.acquire("send_message", StatusPriority.HIGH)
+            done = await cls._with_client("send_message", send)
+            if done is None or done:
+                return
+        logger.error(f"Giving up on message to {chat_id} after {MESSAGE_RETRIES} flood waits")
 
 from .outages import handle_outage_message
 
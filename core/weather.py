@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+
+import httpx
+import pytz
+
+from .config import (
+    ACCUWEATHER_API_KEY,
+    ACCUWEATHER_LOCATION_CODE,
+    ACCUWEATHER_DAILY_BUDGET,
+    ACCUWEATHER_BUDGET_RESERVE,
+    WEATHER_COORDS,
+    WEATHER_TIMEZONE,
+    WEATHER_HTTP_TIMEOUT,
+    WEATHER_MIN_INTERVAL,
+    WEATHER_MAX_INTERVAL,
+    WEATHER_NIGHT_HOURS,
+    WEATHER_NIGHT_WEIGHT,
+)
+from .logger import get_logger
+from .solar import SunCalendar, parse_coords
+
+logger = get_logger("Weather-back")
+
+ACCUWEATHER_URL = f"http://dataservice.accuweather.com/currentconditions/v1/{ACCUWEATHER_LOCATION_CODE}"
+
+
+class WeatherClient:
+    """Shared keep-alive AsyncClient with per-request timeout and retries.
+
+    Failures are logged without the URL, which carries the API keys.
+    """
+
+    def __init__(self, timeout: float = WEATHER_HTTP_TIMEOUT):
+        self.timeout = timeout
+        self._client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_json(self, label: str, url: str, params: dict, attempts: int = 1, retry_delay: float = 1.0):
+        """Parsed JSON body, or None after ``attempts`` failures (retried with exponential backoff)."""
+        for attempt in range(attempts):
+            try:
+                response = await self.client.get(url, params=params)
+                response.raise_for_status()
+                return response.json()
+            except httpx.HTTPStatusError as e:
+                logger.warning(f"{label} answered {e.response.status_code}: {e.response.text[:200]}")
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"{label} request failed: {e.__class__.__name__}")
+            if attempt + 1 < attempts:
+                await asyncio.sleep(retry_delay * 2 ** attempt)
+        return None
+
+
+weather_client = WeatherClient()
+
+
+async def fetch_current_conditions() -> dict | None:
+    data = await weather_client.get_json(
+        "AccuWeather", ACCUWEATHER_URL, {"apikey": ACCUWEATHER_API_KEY, "details": "true"}
+    )
+    if data is None:
+        return None
+    try:
+        return data[0]
+    except (TypeError, IndexError, KeyError):
+        logger.error(f"Cant get [0], response: {str(data)[:200]}")
+        return None
+
+
+class WeatherSchedule:
+    """Spreads the AccuWeather daily request budget over the rest of the day.
+
+    Every request, failed or not, counts against today's budget. The next
+    interval is the weighted time left until local midnight divided by the
+    requests left, so night hours (``night_weight``) get fewer polls and a
+    budget eaten by restarts or retries slows the rest of the day down
+    instead of running out. The result is clamped to
+    [min_interval, max_interval]; with the budget spent it waits for the
+    next day.
+    """
+
+    def __init__(
+        self,
+        daily_budget: int = ACCUWEATHER_DAILY_BUDGET,
+        reserve: int = ACCUWEATHER_BUDGET_RESERVE,
+        min_interval: float = WEATHER_MIN_INTERVAL,
+        max_interval: float = WEATHER_MAX_INTERVAL,
+        night_hours: str = WEATHER_NIGHT_HOURS,
+        night_weight: float = WEATHER_NIGHT_WEIGHT,
+        timezone: str = WEATHER_TIMEZONE,
+    ):
+        self.daily_budget = daily_budget
+        self.reserve = reserve
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.night_start, self.night_end = (int(hour) for hour in night_hours.split("-"))
+        self.night_weight = night_weight
+        self.tz = pytz.timezone(timezone)
+        self.day: datetime.date | None = None
+        self.used = 0
+
+    def _local_now(self, now: datetime.datetime | None = None) -> datetime.datetime:
+        local = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(self.tz)
+        if local.date() != self.day:
+            self.day = local.date()
+            self.used = 0
+        return local
+
+    def weight(self, hour: int) -> float:
+        if self.night_start <= self.night_end:
+            night = self.night_start <= hour < self.night_end
+        else:
+            night = hour >= self.night_start or hour < self.night_end
+        return self.night_weight if night else 1.0
+
+    def record_request(self, now: datetime.datetime | None = None) -> None:
+        self._local_now(now)
+        self.used += 1
+
+    def next_interval(self, now: datetime.datetime | None = None) -> float:
+        #wall-clock arithmetic; a DST shift only skews one day's spacing slightly
+        local = self._local_now(now).replace(tzinfo=None)
+        midnight = datetime.datetime.combine(local.date() + datetime.timedelta(days=1), datetime.time())
+        remaining = self.daily_budget - self.reserve - self.used
+        if remaining <= 0:
+            return (midnight - local).total_seconds() + 1
+
+        weighted = 0.0
+        t = local
+        while t < midnight:
+            boundary = min(t.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1), midnight)
+            weighted += self.weight(t.hour) * (boundary - t).total_seconds()
+            t = boundary
+
+        interval = weighted / remaining / max(self.weight(local.hour), 1e-6)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def snapshot(self) -> dict:
+        return {"date": self.day.isoformat() if self.day else None, "used": self.used}
+
+    def restore(self, snapshot: dict | None) -> None:
+        """Carry today's usage over a restart (from the LAST_WEATHER_FILE cache)."""
+        local = self._local_now()
+        if snapshot and snapshot.get("date") == local.date().isoformat():
+            self.used = int(snapshot.get("used", 0))
+
+
+weather_schedule = WeatherSchedule()
+
+_coords = parse_coords(WEATHER_COORDS)
+if _coords is None:
+    logger.warning(f"WEATHER_COORDS '{WEATHER_COORDS}' is not 'lat,lon', is_day will come from AccuWeather")
+#sunrise/sunset computed locally, None without usable coordinates
+sun_calendar = SunCalendar(*_coords, WEATHER_TIMEZONE) if _coords else None
@@ -0,0 +1,252 @@
+import datetime
+import os
+from pathlib import Path
+
+import numpy as np
+import pytz
+
+from .config import WEATHER_TIMEZONE
+from .data_paths import WEATHER_HISTORY_DIR
+from .logger import get_logger
+
+logger = get_logger("WeatherHistory")
+
+RAW_DTYPE = np.dtype([
+    ("ts", "<u4"),
+    ("temp", "<f4"),
+    ("real", "<f4"),
+    ("icon", "u1"),
+    ("uv", "u1"),
+    ("is_day", "u1"),
+    ("pad", "u1"),
+])
+
+#sums rather than means so a bucket can be extended in place
+AGG_DTYPE = np.dtype([
+    ("ts", "<u4"),
+    ("count", "<u2"),
+    ("icon", "u1"),
+    ("uv_max", "u1"),
+    ("temp_min", "<f4"),
+    ("temp_max", "<f4"),
+    ("temp_sum", "<f4"),
+    ("real_sum", "<f4"),
+    ("day_count", "<u2"),
+    ("pad", "<u2"),
+])
+
+RESOLUTIONS = ("raw", "hour", "day")
+#"auto" picks the finest tier whose span limit covers the requested range
+AUTO_MAX_SPAN = {"raw": 2 * 86400, "hour": 62 * 86400}
+
+
+class SeriesFile:
+    """Fixed-size numpy records appended to one file, read back through a memmap.
+
+    Timestamps only grow, so a time range is two binary searches. The last
+    record may be rewritten in place (the open aggregation bucket); a torn
+    record left by a crash is cut off on open.
+    """
+
+    def __init__(self, path: Path, dtype: np.dtype):
+        self.path = path
+        self.dtype = dtype
+        self._memmap: np.memmap | None = None
+        self._memmap_size = 0
+        self._last: np.void | None = None
+        if path.exists():
+            size = path.stat().st_size
+            if size % dtype.itemsize:
+                logger.warning(f"Dropping a partial record at the end of {path}")
+                os.truncate(path, size - size % dtype.itemsize)
+
+    def __len__(self) -> int:
+        try:
+            return self.path.stat().st_size // self.dtype.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def last(self) -> np.void | None:
+        """Copy of the newest record (kept in memory, so appends don't touch the memmap)."""
+        if self._last is None:
+            records = self.records()
+            if not len(records):
+                return None
+            self._last = records[-1].copy()
+        return self._last.copy()
+
+    def append(self, record: np.ndarray) -> None:
+        with open(self.path, "ab") as f:
+            f.write(record.tobytes())
+        self._last = record.reshape(-1)[-1].copy()
+
+    def replace_last(self, record: np.ndarray) -> None:
+        with open(self.path, "r+b") as f:
+            f.seek(-self.dtype.itemsize, os.SEEK_END)
+            f.write(record.tobytes())
+        #an existing memmap is shared with the file and sees the new bytes
+        self._last = record.reshape(-1)[-1].copy()
+
+    def records(self) -> np.ndarray:
+        count = len(self)
+        if count == 0:
+            return np.zeros(0, dtype=self.dtype)
+        if self._memmap is None or self._memmap_size != count:
+            self._memmap = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(count,))
+            self._memmap_size = count
+        return self._memmap
+
+    def between(self, start: float, end: float) -> np.ndarray:
+        records = self.records()
+        ts = records["ts"]
+        lo = np.searchsorted(ts, start, side="left")
+        hi = np.searchsorted(ts, end, side="right")
+        return np.array(records[lo:hi])
+
+
+class WeatherHistory:
+    """Append-only weather observations with hourly and daily rollups.
+
+    ``raw.bin`` keeps every observation (16 bytes each); ``hour.bin`` and
+    ``day.bin`` keep one 28-byte bucket per local hour/day, updated as
+    observations arrive. A query reads only the tier it needs.
+    """
+
+    def __init__(self, directory: Path = WEATHER_HISTORY_DIR, timezone: str = WEATHER_TIMEZONE):
+        self.directory = directory
+        self.tz = pytz.timezone(timezone)
+        self._tiers: dict[str, SeriesFile] | None = None
+
+    @property
+    def tiers(self) -> dict[str, SeriesFile]:
+        if self._tiers is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._tiers = {
+                "raw": SeriesFile(self.directory / "raw.bin", RAW_DTYPE),
+                "hour": SeriesFile(self.directory / "hour.bin", AGG_DTYPE),
+                "day": SeriesFile(self.directory / "day.bin", AGG_DTYPE),
+            }
+        return self._tiers
+
+    def _bucket_start(self, ts: int, resolution: str) -> int:
+        local = datetime.datetime.fromtimestamp(ts, self.tz)
+        if resolution == "hour":
+            start = local.replace(minute=0, second=0, microsecond=0)
+        else:
+            start = self.tz.localize(datetime.datetime.combine(local.date(), datetime.time()))
+        return int(start.timestamp())
+
+    def _roll_up(self, tier: SeriesFile, resolution: str, raw: np.ndarray) -> None:
+        bucket = self._bucket_start(int(raw["ts"][0]), resolution)
+        last = tier.last()
+        is_day = int(raw["is_day"][0])
+        if last is not None and int(last["ts"]) == bucket:
+            last["count"] += 1
+            last["icon"] = raw["icon"][0]
+            last["uv_max"] = max(last["uv_max"], raw["uv"][0])
+            last["temp_min"] = min(last["temp_min"], raw["temp"][0])
+            last["temp_max"] = max(last["temp_max"], raw["temp"][0])
+            last["temp_sum"] += raw["temp"][0]
+            last["real_sum"] += raw["real"][0]
+            last["day_count"] += is_day
+            tier.replace_last(np.array(last, dtype=AGG_DTYPE))
+            return
+
+        record = np.zeros(1, dtype=AGG_DTYPE)
+        record["ts"] = bucket
+        record["count"] = 1
+        record["icon"] = raw["icon"]
+        record["uv_max"] = raw["uv"]
+        record["temp_min"] = record["temp_max"] = record["temp_sum"] = raw["temp"]
+        record["real_sum"] = raw["real"]
+        record["day_count"] = is_day
+        tier.append(record)
+
+    def append(self, weather: dict, ts: float | None = None) -> bool:
+        """Record one observation (a weather_update dict); False if it was older than the last one."""
+        ts = int(ts if ts is not None else datetime.datetime.now(datetime.timezone.utc).timestamp())
+        raw_tier = self.tiers["raw"]
+        last = raw_tier.last()
+        if last is not None and ts < int(last["ts"]):
+            logger.warning(f"Ignoring weather observation at {ts}, older than the last one ({int(last['ts'])})")
+            return False
+
+        raw = np.zeros(1, dtype=RAW_DTYPE)
+        raw["ts"] = ts
+        raw["temp"] = weather["temperature_celsius"]
+        raw["real"] = weather["real_temp_celsius"]
+        raw["icon"] = weather["weather_icon_id"]
+        raw["uv"] = weather["uv_index"]
+        raw["is_day"] = bool(weather["is_day"])
+        raw_tier.append(raw)
+        self._roll_up(self.tiers["hour"], "hour", raw)
+        self._roll_up(self.tiers["day"], "day", raw)
+        return True
+
+    @staticmethod
+    def pick_resolution(start: float, end: float) -> str:
+        span = end - start
+        for resolution in ("raw", "hour"):
+            if span <= AUTO_MAX_SPAN[resolution]:
+                return resolution
+        return "day"
+
+    def query(self, start: float, end: float, resolution: str = "auto") -> dict:
+        if resolution == "auto":
+            resolution = self.pick_resolution(start, end)
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        if resolution != "raw":
+            #include the bucket that 'start' falls into
+            start = min(start, self._bucket_start(int(start), resolution))
+        records = self.tiers[resolution].between(start, end)
+
+        if resolution == "raw":
+            points = [
+                {
+                    "time": ts,
+                    "temperature_celsius": round(temp, 2),
+                    "real_temp_celsius": round(real, 2),
+                    "weather_icon_id": icon,
+                    "uv_index": uv,
+                    "is_day": bool(is_day),
+                }
+                for ts, temp, real, icon, uv, is_day in zip(
+                    records["ts"].tolist(),
+                    records["temp"].tolist(),
+                    records["real"].tolist(),
+                    records["icon"].tolist(),
+                    records["uv"].tolist(),
+                    records["is_day"].tolist(),
+                )
+            ]
+        else:
+            count = np.maximum(records["count"].astype(np.float64), 1)
+            points = [
+                {
+                    "time": ts,
+                    "count": n,
+                    "temperature_min": round(tmin, 2),
+                    "temperature_max": round(tmax, 2),
+                    "temperature_avg": round(tavg, 2),
+                    "real_temp_avg": round(ravg, 2),
+                    "uv_max": uv,
+                    "weather_icon_id": icon,
+                    "day_fraction": round(day, 3),
+                }
+                for ts, n, tmin, tmax, tavg, ravg, uv, icon, day in zip(
+                    records["ts"].tolist(),
+                    records["count"].tolist(),
+                    records["temp_min"].tolist(),
+                    records["temp_max"].tolist(),
+                    (records["temp_sum"] / count).tolist(),
+                    (records["real_sum"] / count).tolist(),
+                    records["uv_max"].tolist(),
+                    records["icon"].tolist(),
+                    (records["day_count"] / count).tolist(),
+                )
+            ]
+        return {"resolution": resolution, "from": start, "to": end, "points": points}
+
+
+weather_history = WeatherHistory()
@@ -0,0 +1,38 @@
+#gunicorn reads this from the working directory; the worker count comes from WEB_CONCURRENCY (default 1)
+import os
+import subprocess
+import sys
+import threading
+import time
+
+#workers are forked after on_starting, so they inherit it; core.config reads it on import
+STATE_SOCKET = os.environ.setdefault("STATE_SOCKET", "/tmp/stitch-core-state.sock")
+
+_service = None
+_stopping = threading.Event()
+
+
+def _supervise(log):
+    #the state service is the one place workers share state through, so bring it back if it dies
+    global _service
+    while not _stopping.is_set():
+        _service = subprocess.Popen([sys.executable, "-m", "core.shared_state"])
+        code = _service.wait()
+        if not _stopping.is_set():
+            log.warning(f"State service exited with {code}, restarting")
+            time.sleep(1)
+
+
+def on_starting(server):
+    server.log.info(f"Starting the state service on {STATE_SOCKET}")
+    threading.Thread(target=_supervise, args=(server.log,), daemon=True).start()
+
+
+def on_exit(server):
+    _stopping.set()
+    if _service is not None:
+        _service.terminate()
+        try:
+            _service.wait(5)
+        except subprocess.TimeoutExpired:
+            _service.kill()
@@ -0,0 +1,120 @@
+"""Publisher cost of the WebSocket broadcast hub vs. the old per-module send loop.
+
+Run from the repository root:
+
+    python -m tools.bench_broadcast [--clients 1,10,100,500] [--messages 50] [--send-delay 0.001]
+
+Clients are in-memory fakes whose send_text takes ``--send-delay`` seconds.
+For each client count it reports how long the publisher is held per message
+(the legacy loop awaits every client in turn, the hub only queues) and the
+total time until every client has received every message. The last row adds
+one client that never finishes a send, which stalled the legacy loop for
+good and is evicted by the hub after WS_SEND_TIMEOUT.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from core.broadcast import BroadcastHub
+
+TOPIC = "sensors"
+
+
+class FakeWebSocket:
+    def __init__(self, delay: float, stuck: bool = False):
+        self.delay = delay
+        self.stuck = stuck
+        self.received = 0
+
+    async def send_text(self, text: str) -> None:
+        if self.stuck:
+            await asyncio.Event().wait()
+        await asyncio.sleep(self.delay)
+        self.received += 1
+
+    async def send_json(self, data) -> None:
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self, code: int = 1000) -> None:
+        pass
+
+
+def make_message(i: int) -> dict:
+    return {"temperature": 21.5 + i % 10 / 10, "pressure": 1013.2, "humidity": 40 + i % 7, "co2": 600 + i}
+
+
+async def legacy(clients: list[FakeWebSocket], messages: int, timeout: float) -> tuple[float, float]:
+    #the removed notify_clients(): one awaited send_json per client, in turn
+    async def notify(data):
+        for ws in clients:
+            await ws.send_json(data)
+
+    held = 0.0
+    start = time.perf_counter()
+    try:
+        for i in range(messages):
+            t = time.perf_counter()
+            await asyncio.wait_for(notify(make_message(i)), timeout)
+            held += time.perf_counter() - t
+    except asyncio.TimeoutError:
+        return float("inf"), float("inf")
+    return held / messages, time.perf_counter() - start
+
+
+async def hub(clients: list[FakeWebSocket], messages: int, send_timeout: float) -> tuple[float, float, dict]:
+    #a queue as long as the run, so every client gets every message as in the legacy loop
+    broadcast = BroadcastHub(max_queue=messages + 1, send_timeout=send_timeout)
+    for ws in clients:
+        broadcast.subscribe(ws, [TOPIC])
+    held = 0.0
+    start = time.perf_counter()
+    for i in range(messages):
+        t = time.perf_counter()
+        broadcast.publish(TOPIC, make_message(i))
+        held += time.perf_counter() - t
+        #the publisher yields between updates, as the request handlers do
+        await asyncio.sleep(0)
+    while any(ws.received < messages for ws in clients if not ws.stuck):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    while any(ws.stuck for ws in clients) and not broadcast.stats["evicted"]:
+        await asyncio.sleep(0.01)
+    await broadcast.close()
+    return held / messages, elapsed, broadcast.stats
+
+
+async def run(args) -> None:
+    counts = [int(n) for n in args.clients.split(",")]
+    print(f"{'clients':>9} {'legacy held/msg':>16} {'legacy total':>13} {'hub held/msg':>13} {'hub total':>10}  hub stats")
+    for count, stuck in [(n, False) for n in counts] + [(counts[-1], True)]:
+        rows = []
+        for run_legacy in (True, False):
+            clients = [FakeWebSocket(args.send_delay) for _ in range(count)]
+            if stuck:
+                clients.insert(0, FakeWebSocket(args.send_delay, stuck=True))
+            if run_legacy:
+                rows.append(await legacy(clients, args.messages, args.timeout))
+            else:
+                rows.append(await hub(clients, args.messages, args.timeout))
+        (l_held, l_total), (h_held, h_total, stats) = rows
+        label = f"{count}+stuck" if stuck else str(count)
+        fmt = lambda seconds, scale, unit: "stalled" if seconds == float("inf") else f"{seconds * scale:.3f} {unit}"
+        print(
+            f"{label:>9} {fmt(l_held, 1e3, 'ms'):>16} {fmt(l_total, 1, 's'):>13} "
+            f"{fmt(h_held, 1e3, 'ms'):>13} {fmt(h_total, 1, 's'):>10}  {stats}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", default="1,10,100,500", help="comma separated client counts")
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--send-delay", type=float, default=0.001, help="seconds each fake send takes")
+    parser.add_argument("--timeout", type=float, default=2.0, help="hub send timeout / legacy give-up time")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Lookup latency of the games.json catalog vs. the old parse-and-scan lookup.
+
+Run from the repository root:
+
+    python -m tools.bench_game_catalog [--entries 10000] [--lookups 20000]
+
+The "fuzzy" rows measure uncached trigram matching of mangled names
+(different casing, punctuation, trademark symbols and a dropped letter).
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from core.game_manager import GameCatalog
+from core.storage import JsonListStore
+
+
+SYLLABLES = ["ka", "ro", "shi", "dun", "gel", "mor", "tra", "vex", "li", "on", "zar", "qui", "pe", "bel", "tor", "na"]
+COMMON_WORDS = ["the", "of", "2", "3", "world", "legend", "tales", "simulator", "online", "remastered"]
+
+
+def make_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+
+
+def make_name(rng: random.Random, i: int) -> str:
+    words = [make_word(rng) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.5:
+        words.insert(rng.randint(0, len(words)), rng.choice(COMMON_WORDS))
+    return " ".join(w.capitalize() for w in words)
+
+
+def mangle(rng: random.Random, name: str) -> str:
+    name = name.replace(" ", rng.choice([" ", "-", ": "]), 1)
+    name = name.upper() if rng.random() < 0.3 else name
+    if len(name) > 6 and rng.random() < 0.5:
+        #drop one character to force a real trigram lookup
+        pos = rng.randrange(len(name))
+        name = name[:pos] + name[pos + 1:]
+    return name + rng.choice(["", "\u2122", "\u00ae", " "])
+
+
+def make_games(count: int) -> list[dict]:
+    rng = random.Random(42)
+    games = [
+        {
+            "steam_id": str(100000 + i),
+            "name": make_name(rng, i),
+            "emoji_id": str(5000000000000000000 + i),
+            "color": f"#{i % 0xFFFFFF:06x}",
+        }
+        for i in range(count)
+    ]
+    games.append({"steam_id": "", "name": "default game icon", "emoji_id": "1", "color": "#ffffff"})
+    return games
+
+
+def legacy_find(path: Path, query: str) -> dict | None:
+    with open(path, "r") as f:
+        games = json.load(f)
+    for game in games:
+        if game.get("steam_id") == query or game.get("name") == query:
+            return game
+    for game in games:
+        if game.get("name") == "default game icon":
+            return game
+    return None
+
+
+def timed(fn, queries: list[str]) -> list[float]:
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    mean = sum(samples) / len(samples)
+    print(f"{label:<10} mean {mean * 1e6:10.2f} us   p50 {p50 * 1e6:10.2f} us   p99 {p99 * 1e6:10.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--legacy-lookups", type=int, default=200)
+    parser.add_argument("--fuzzy-lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "games.json"
+        games = make_games(args.entries)
+        path.write_text(json.dumps(games, indent=2))
+
+        keys = [g["name"] for g in games] + [g["steam_id"] for g in games if g["steam_id"]] + ["Unknown Game"]
+        queries = [random.choice(keys) for _ in range(args.lookups)]
+
+        catalog = GameCatalog(JsonListStore(path))
+        start = time.perf_counter()
+        catalog.reload()
+        print(f"catalog with {len(catalog)} entries built in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+        report("legacy", timed(lambda q: legacy_find(path, q), queries[:args.legacy_lookups]))
+        report("catalog", timed(lambda q: catalog.find(q) or catalog.default, queries))
+
+        rng = random.Random(7)
+        mangled = [mangle(rng, rng.choice(games[:-1])["name"]) for _ in range(args.fuzzy_lookups)]
+
+        def fuzzy(query):
+            catalog._fuzzy_cache.clear()
+            return catalog.match(query)
+
+        report("fuzzy", timed(fuzzy, mangled))
+        report("fuzzy top5", timed(lambda q: catalog.match(q, limit=5, threshold=0.3), mangled))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Packet-path throughput and latency of core.piled against the local emulator.
+
+Run from the repository root:
+
+    python -m tools.bench_piled [--count 2000] [--latency 0.0] [--fail-rate 0.0]
+
+Starts tools.piled_emulator in-process on a free port, then reports
+packets/s and p50/p99 for set-color packets (with and without a kept-alive
+connection), for the ColorCommandQueue behind send_color_request, and for
+get_current_color round trips, both straight to the device and through the
+ColorShadow that GET /piled reads. Pass --host/--port to benchmark a real
+controller instead of the emulator.
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from core.piled import ColorCommandQueue, ColorShadow, PiLEDClient
+from tools.piled_emulator import PiLEDEmulator
+
+SECRET = "bench-secret"
+
+
+def report(label: str, samples: list[float], elapsed: float, failed: int = 0) -> None:
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    rate = len(samples) / elapsed if elapsed else float("inf")
+    print(
+        f"{label:<18} {rate:10.0f} pkt/s   p50 {p50 * 1e3:8.3f} ms   p99 {p99 * 1e3:8.3f} ms"
+        + (f"   failed {failed}" if failed else "")
+    )
+
+
+async def bench_send(client: PiLEDClient, count: int) -> tuple[list[float], float, int]:
+    samples, failed = [], 0
+    begin = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        if not await client.send_color(i % 256, (i * 7) % 256, (i * 13) % 256, 0):
+            failed += 1
+        samples.append(time.perf_counter() - start)
+    return samples, time.perf_counter() - begin, failed
+
+
+async def bench_queue(client: PiLEDClient, count: int) -> tuple[list[float], float, int]:
+    queue = ColorCommandQueue(client, min_interval=0)
+    samples = []
+    begin = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        queue.submit(i % 256, (i * 7) % 256, (i * 13) % 256, 0)
+        await queue.drain()
+        samples.append(time.perf_counter() - start)
+    return samples, time.perf_counter() - begin, queue.stats["failed"]
+
+
+async def bench_get(client: PiLEDClient, count: int) -> tuple[list[float], float, int]:
+    samples, failed = [], 0
+    begin = time.perf_counter()
+    for _ in range(count):
+        start = time.perf_counter()
+        if (await client.get_current_color())["status"] != "ok":
+            failed += 1
+        samples.append(time.perf_counter() - start)
+    return samples, time.perf_counter() - begin, failed
+
+
+async def bench_shadow(client: PiLEDClient, count: int) -> tuple[list[float], float, int]:
+    shadow = ColorShadow(client)
+    samples, failed = [], 0
+
+    async def read(refresh: bool):
+        start = time.perf_counter()
+        if (await shadow.get(refresh))["status"] != "ok":
+            nonlocal failed
+            failed += 1
+        samples.append(time.perf_counter() - start)
+
+    begin = time.perf_counter()
+    #bursts of concurrent readers, each burst starting with a forced refresh
+    for i in range(0, count, 50):
+        await asyncio.gather(*(read(j == 0) for j in range(min(50, count - i))))
+    return samples, time.perf_counter() - begin, failed
+
+
+async def run(args) -> None:
+    emulator = None
+    host, port, secret = args.host, args.port, args.secret
+    if host is None:
+        emulator = PiLEDEmulator(SECRET, latency=args.latency, fail_rate=args.fail_rate)
+        host, port, secret = "127.0.0.1", await emulator.start(), SECRET
+        print(f"emulator on {host}:{port} (latency {args.latency * 1e3:.1f} ms, fail rate {args.fail_rate:.1%})")
+
+    try:
+        for keepalive in (False, True):
+            client = PiLEDClient(host, port, secret, keepalive=keepalive)
+            label = "keepalive" if keepalive else "per-packet"
+            report(f"send {label}", *await bench_send(client, args.count))
+            report(f"queue {label}", *await bench_queue(client, args.count))
+            await client._close(client._writer)
+
+        client = PiLEDClient(host, port, secret)
+        report("get color", *await bench_get(client, args.count))
+        report("get shadow", *await bench_shadow(client, args.count))
+    finally:
+        if emulator is not None:
+            #let the emulator finish reading what was written before it goes away
+            await asyncio.sleep(0.1)
+            print(f"emulator stats: {emulator.stats}")
+            await emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0, help="emulator delay per packet in seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="emulator connection drop probability")
+    parser.add_argument("--host", default=None, help="benchmark a real controller instead of the emulator")
+    parser.add_argument("--port", type=int, default=3384)
+    parser.add_argument("--secret", default="")
+    args = parser.parse_args()
+    #per-packet debug lines would dominate the timings
+    logging.getLogger("PiLED-back").setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
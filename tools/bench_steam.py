@@ -0,0 +1,191 @@
+"""Per-poll cost of the Steam profile scraper vs. the old requests + BeautifulSoup poll.
+
+Run from the repository root:
+
+    python -m tools.bench_steam [--polls 200] [--delay 0.05] [--etag]
+
+Serves a synthetic ~150 KB profile page from a local HTTP server that
+answers after ``--delay`` seconds (with ``--etag`` it also honours
+If-None-Match). Reports parse CPU per poll and, while polling, the worst
+event-loop stall seen by a 5 ms heartbeat task. The legacy rows need
+``requests`` and ``beautifulsoup4`` installed.
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import threading
+import time
+
+from core.steam import SteamProfileScraper, extract_fragment, parse_fragment
+
+
+def make_page(game: str | None, seed: int = 1) -> bytes:
+    rng = random.Random(seed)
+    head = "<html><head><title>Steam Community :: someone</title>" + "".join(
+        f'<script type="text/javascript">var g_v{i} = "{rng.getrandbits(128):032x}";</script>' for i in range(40)
+    ) + "</head><body>"
+    filler = "".join(
+        f'<div class="profile_comment"><div class="commentthread_author"><a href="/id/u{i}">user {i}</a></div>'
+        f'<div class="commentthread_comment_text">comment {rng.getrandbits(64):x} &amp; more text here</div></div>'
+        for i in range(600)
+    )
+    if game:
+        header = (
+            '<div class="profile_in_game persona in-game"><div class="profile_in_game_header">Currently In-Game</div>'
+            f'<div class="profile_in_game_name">{game}</div></div>'
+        )
+    else:
+        header = '<div class="profile_in_game persona offline"><div class="profile_in_game_header">Currently Offline</div></div>'
+    return (head + filler[:len(filler) // 3] + header + filler[len(filler) // 3:] + "</body></html>").encode()
+
+
+class FakeProfileServer:
+    """Runs on its own thread and loop so a blocking client can't starve it."""
+
+    def __init__(self, page: bytes, delay: float, etag: bool):
+        self.page = page
+        self.delay = delay
+        self.etag = etag
+        self.port = 0
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._serve, daemon=True).start()
+        self._ready.wait()
+
+    def _serve(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, "127.0.0.1", 0))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _shutdown(self) -> None:
+        self._server.close()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    async def _handle(self, reader, writer) -> None:
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                await asyncio.sleep(self.delay)
+                tag = f'"{hashlib.md5(self.page).hexdigest()}"'
+                if self.etag and f"if-none-match: {tag}".encode() in request.lower():
+                    writer.write(b"HTTP/1.1 304 Not Modified\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    headers = f"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: {len(self.page)}\r\n"
+                    if self.etag:
+                        headers += f"ETag: {tag}\r\n"
+                    writer.write(headers.encode() + b"\r\n" + self.page)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+
+def legacy_parse(text: str) -> dict:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, "html.parser")
+    element = soup.find(class_="profile_in_game_header")
+    header = element.get_text() if element else ""
+    if header == "Currently In-Game":
+        return {"status": "playing", "game_name": soup.find(class_="profile_in_game_name").get_text().strip()}
+    return {"status": header}
+
+
+def cpu_per_call(fn, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat
+
+
+async def worst_stall(poll, polls: int) -> tuple[float, float]:
+    """Run ``poll`` ``polls`` times next to a 5 ms heartbeat; return (max stall, wall time per poll)."""
+    #first poll pays for one-time setup (client and TLS context creation)
+    await poll()
+    stall = 0.0
+    running = True
+
+    async def heartbeat():
+        nonlocal stall
+        while running:
+            before = time.perf_counter()
+            await asyncio.sleep(0.005)
+            stall = max(stall, time.perf_counter() - before - 0.005)
+
+    task = asyncio.create_task(heartbeat())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    for _ in range(polls):
+        await poll()
+        #the real poller sleeps between polls; give the heartbeat a turn to notice a stall
+        await asyncio.sleep(0)
+    elapsed = (time.perf_counter() - start) / polls
+    running = False
+    await task
+    return stall, elapsed
+
+
+async def run(args) -> None:
+    page = make_page("Some Game: Remastered &amp; More")
+    print(f"profile page: {len(page) / 1024:.0f} KB")
+
+    text = page.decode()
+    try:
+        legacy = cpu_per_call(lambda: legacy_parse(text), max(1, args.polls // 10))
+        print(f"parse legacy (bs4)      {legacy * 1e3:9.3f} ms CPU/poll")
+    except ImportError:
+        legacy = None
+        print("parse legacy (bs4)      skipped, beautifulsoup4 not installed")
+    targeted = cpu_per_call(lambda: parse_fragment(extract_fragment(page)), args.polls * 10)
+    unchanged = cpu_per_call(lambda: hashlib.blake2b(extract_fragment(page), digest_size=16).digest(), args.polls * 10)
+    print(f"parse targeted          {targeted * 1e3:9.3f} ms CPU/poll")
+    print(f"fragment unchanged      {unchanged * 1e3:9.3f} ms CPU/poll (hash only)")
+
+    server = FakeProfileServer(page, args.delay, args.etag)
+    server.start()
+    url = f"http://127.0.0.1:{server.port}/id/someone"
+    try:
+        try:
+            import requests
+
+            async def legacy_poll():
+                legacy_parse(requests.get(url).text)
+
+            stall, wall = await worst_stall(legacy_poll, args.polls)
+            print(f"poll legacy             {wall * 1e3:9.3f} ms/poll   worst loop stall {stall * 1e3:8.3f} ms")
+        except ImportError:
+            print("poll legacy             skipped, requests not installed")
+
+        scraper = SteamProfileScraper(url)
+        stall, wall = await worst_stall(scraper.fetch, args.polls)
+        print(f"poll scraper            {wall * 1e3:9.3f} ms/poll   worst loop stall {stall * 1e3:8.3f} ms")
+        print(f"scraper stats: {scraper.stats}")
+        await scraper.close()
+    finally:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--polls", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.05, help="server response delay in seconds")
+    parser.add_argument("--etag", action="store_true", help="serve ETags and answer 304 when unchanged")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Local fake of the Steam endpoints used by core.steam.
+
+Serves ISteamUser/GetPlayerSummaries/v0002/ and a profile page (/id/<anything>)
+that both reflect one mutable presence, so the Web API backend, the scraper
+fallback and the adaptive poll interval can be exercised offline.
+
+Run from the repository root:
+
+    python -m tools.fake_steam_api --check
+        run the backends through a scripted session against the fake and exit
+
+    python -m tools.fake_steam_api --port 8765 [--state playing --game-id 570 --game "Dota 2"]
+        keep serving; point STEAM_API_URL=http://127.0.0.1:8765 and
+        STEAM_PROFILE_LINK=http://127.0.0.1:8765/id/me at it. The presence can
+        be changed with e.g. ``curl -X POST '127.0.0.1:8765/state?state=online'``.
+"""
+import argparse
+import asyncio
+import json
+from urllib.parse import parse_qs, urlsplit
+
+from core.steam import AdaptivePollInterval, SteamPresence, SteamProfileScraper, SteamWebAPIPresence
+from tools.bench_steam import make_page
+
+API_KEY = "fake-key"
+STEAM_ID = "76561198000000000"
+PERSONASTATE = {"offline": 0, "online": 1, "playing": 1}
+
+
+class FakeSteam:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.state = "offline"
+        self.game_id = ""
+        self.game_name = ""
+        #when True the Web API answers 503, to exercise the scraper fallback
+        self.api_down = False
+        self.requests = {"api": 0, "profile": 0}
+        self._server: asyncio.AbstractServer | None = None
+
+    def set(self, state: str, game_id: str = "", game_name: str = "") -> None:
+        self.state, self.game_id, self.game_name = state, game_id, game_name
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    def _player_summaries(self, query: dict) -> tuple[int, bytes]:
+        self.requests["api"] += 1
+        if self.api_down:
+            return 503, b"{}"
+        players = []
+        if query.get("key") == [API_KEY] and query.get("steamids") == [STEAM_ID]:
+            player = {"steamid": STEAM_ID, "personaname": "someone", "personastate": PERSONASTATE[self.state]}
+            if self.state == "playing":
+                player.update(gameid=self.game_id, gameextrainfo=self.game_name)
+            players.append(player)
+        return 200, json.dumps({"response": {"players": players}}).encode()
+
+    def _route(self, method: str, target: str) -> tuple[int, bytes, str]:
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == "/ISteamUser/GetPlayerSummaries/v0002/":
+            return (*self._player_summaries(query), "application/json")
+        if url.path.startswith("/id/"):
+            self.requests["profile"] += 1
+            game = self.game_name if self.state == "playing" else None
+            page = make_page(game)
+            if self.state == "online":
+                page = page.replace(b"Currently Offline", b"Currently Online")
+            return 200, page, "text/html"
+        if url.path == "/state" and method == "POST":
+            self.set(query.get("state", ["offline"])[0], query.get("game_id", [""])[0], query.get("game", [""])[0])
+            return 200, b"ok", "text/plain"
+        return 404, b"not found", "text/plain"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                method, target, _ = head.split(b"\r\n", 1)[0].decode().split(" ", 2)
+                code, body, content_type = self._route(method, target)
+                writer.write(
+                    f"HTTP/1.1 {code} X\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def check() -> None:
+    fake = FakeSteam()
+    port = await fake.start()
+    base = f"http://127.0.0.1:{port}"
+    webapi = SteamWebAPIPresence(API_KEY, STEAM_ID, base_url=base)
+    scraper = SteamProfileScraper(f"{base}/id/someone")
+    presence = SteamPresence([webapi, scraper])
+    failures = 0
+
+    def expect(label: str, got, want) -> None:
+        nonlocal failures
+        ok = got == want
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {label}: {got}" + ("" if ok else f" (expected {want})"))
+
+    try:
+        expect("offline", await presence.fetch(), {"status": "offline"})
+        fake.set("online")
+        expect("online", await presence.fetch(), {"status": "online"})
+        fake.set("playing", "570", "Dota 2")
+        expect("playing", await presence.fetch(), {"status": "playing", "game_name": "Dota 2", "game_id": "570"})
+        expect("served by", presence.last_backend, "webapi")
+
+        fake.api_down = True
+        expect("fallback", await presence.fetch(), {"status": "playing", "game_name": "Dota 2"})
+        expect("served by", presence.last_backend, "scrape")
+        fake.api_down = False
+
+        bad = SteamPresence([SteamWebAPIPresence("wrong-key", STEAM_ID, base_url=base)])
+        expect("bad key", await bad.fetch(), None)
+        await bad.close()
+
+        interval = AdaptivePollInterval(fast=5, normal=20, slow=120, fast_window=60, slow_after=600)
+        expect("interval after change", interval.observe({"status": "offline"}, now=0), 5)
+        expect("interval offline", interval.observe({"status": "offline"}, now=100), 20)
+        expect("interval long offline", interval.observe({"status": "offline"}, now=700), 120)
+        expect("interval online", interval.observe({"status": "online"}, now=800), 5)
+        expect("interval still online", interval.observe({"status": "online"}, now=2000), 5)
+        expect("interval playing", interval.observe({"status": "playing", "game_id": "570"}, now=2001), 5)
+        expect("interval playing later", interval.observe({"status": "playing", "game_id": "570"}, now=2100), 20)
+        expect("interval game switch", interval.observe({"status": "playing", "game_id": "440"}, now=2200), 5)
+        expect("interval error", interval.observe(None, now=2300), 20)
+        print(f"requests served: {fake.requests}, backend stats: {presence.stats}")
+    finally:
+        await presence.close()
+        await fake.close()
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+async def serve(args) -> None:
+    fake = FakeSteam(args.host, args.port)
+    fake.set(args.state, args.game_id, args.game)
+    port = await fake.start()
+    print(f"fake Steam on http://{args.host}:{port} (key {API_KEY}, steam id {STEAM_ID})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="run the scripted session and exit")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--state", default="offline", choices=sorted(PERSONASTATE))
+    parser.add_argument("--game-id", default="")
+    parser.add_argument("--game", default="")
+    args = parser.parse_args()
+    try:
+        asyncio.run(check() if args.check else serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Local stand-in for the PiLED controller.
+
+Implements the two packets core.piled sends:
+
+* version 2 - set color: header(17) + HMAC-SHA256(header + payload)(32) + r, g, b, duration
+* version 4 / OP 1 - get current color: header(17) + op(1), answered with a
+  0x35-byte reply whose last three bytes are r, g, b
+
+Set-color packets are rejected (connection closed) when the HMAC does not
+match, the timestamp is outside ``--max-skew`` or the nonce was seen before.
+Several packets may be sent over one connection.
+
+Run from the repository root:
+
+    python -m tools.piled_emulator --port 3384 --secret "$PILED_SHARED_SECRET" [--latency 0.01] [--fail-rate 0.05]
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import random
+import struct
+import time
+from collections import deque
+
+HEADER = struct.Struct(">QQB")
+MAC_SIZE = 32
+SET_COLOR_PAYLOAD = 4
+OP_GET_CURRENT_COLOR = 1
+NONCE_MEMORY = 4096
+
+
+class PiLEDEmulator:
+    def __init__(
+        self,
+        secret: str,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        fail_rate: float = 0.0,
+        incomplete_rate: float = 0.0,
+        max_skew: int = 30,
+    ):
+        self.secret = secret.encode()
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.incomplete_rate = incomplete_rate
+        self.max_skew = max_skew
+        self.color = (0, 0, 0)
+        self.stats = {"connections": 0, "set_color": 0, "get_color": 0, "rejected": 0, "injected_failures": 0}
+        self._nonces: set[int] = set()
+        self._nonce_order: deque[int] = deque()
+        self._server: asyncio.AbstractServer | None = None
+        self._handlers: set[asyncio.Task] = set()
+
+    async def start(self) -> int:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for task in self._handlers:
+                task.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def _fresh(self, timestamp: int, nonce: int) -> bool:
+        if abs(time.time() - timestamp) > self.max_skew or nonce in self._nonces:
+            return False
+        self._nonces.add(nonce)
+        self._nonce_order.append(nonce)
+        if len(self._nonce_order) > NONCE_MEMORY:
+            self._nonces.discard(self._nonce_order.popleft())
+        return True
+
+    def _color_reply(self) -> bytes:
+        header = HEADER.pack(int(time.time()), random.getrandbits(64), 4)
+        body = bytes([OP_GET_CURRENT_COLOR, *self.color])
+        mac = hmac.new(self.secret, header + body, hashlib.sha256).digest()
+        return header + mac + body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.stats["connections"] += 1
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except asyncio.IncompleteReadError:
+                    return
+                timestamp, nonce, version = HEADER.unpack(header)
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if random.random() < self.fail_rate:
+                    self.stats["injected_failures"] += 1
+                    return
+
+                if version == 2:
+                    rest = await reader.readexactly(MAC_SIZE + SET_COLOR_PAYLOAD)
+                    mac, payload = rest[:MAC_SIZE], rest[MAC_SIZE:]
+                    expected = hmac.new(self.secret, header + payload, hashlib.sha256).digest()
+                    if not hmac.compare_digest(mac, expected) or not self._fresh(timestamp, nonce):
+                        self.stats["rejected"] += 1
+                        return
+                    self.color = tuple(payload[:3])
+                    self.stats["set_color"] += 1
+                elif version == 4:
+                    op = (await reader.readexactly(1))[0]
+                    if op != OP_GET_CURRENT_COLOR:
+                        self.stats["rejected"] += 1
+                        return
+                    self.stats["get_color"] += 1
+                    reply = self._color_reply()
+                    if random.random() < self.incomplete_rate:
+                        self.stats["injected_failures"] += 1
+                        writer.write(reply[:random.randrange(len(reply))])
+                        await writer.drain()
+                        return
+                    writer.write(reply)
+                    await writer.drain()
+                else:
+                    self.stats["rejected"] += 1
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(task)
+            writer.close()
+
+
+async def serve(args) -> None:
+    emulator = PiLEDEmulator(
+        args.secret,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        fail_rate=args.fail_rate,
+        incomplete_rate=args.incomplete_rate,
+        max_skew=args.max_skew,
+    )
+    port = await emulator.start()
+    print(f"PiLED emulator listening on {args.host}:{port}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"color={emulator.color} stats={emulator.stats}")
+    finally:
+        await emulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3384)
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added before handling each packet")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="probability of dropping the connection")
+    parser.add_argument("--incomplete-rate", type=float, default=0.0, help="probability of a truncated color reply")
+    parser.add_argument("--max-skew", type=int, default=30, help="accepted timestamp skew in seconds")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()